@@ -0,0 +1,271 @@
+"""Runs every agent in a long-lived process of its own, which answers within a deadline or is preempted"""
+
+import bisect
+import importlib
+import json
+import multiprocessing
+import time
+import traceback
+import weakref
+
+import main
+from state_delta import StateEncoder, StateMirror
+from state_view import StateView
+
+# the deadline of an agent is the action timeout of the game, less the time to give up on the agent
+HOST_MARGIN = 0.05
+# the upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+# whether hosts send the diff of the state from the previous turn, instead of the whole state
+HOST_DIFFS = True
+
+
+class LatencyHistogram:
+    """
+    Counts the latencies of the actions of an agent in the buckets of LATENCY_BUCKETS, and one more for the slower,
+    and the actions that fell back to the default action
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.maximum = 0.0
+        self.fallbacks = 0
+
+    def add(self, seconds, fallback=False):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.fallbacks += fallback
+
+    def merge(self, other):
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+        self.fallbacks += other.fallbacks
+
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        return self.total / max(1, self.count())
+
+    def quantile(self, fraction):
+        """
+        :return: the upper bound of the bucket of the quantile, or the maximum latency for the slowest bucket
+        """
+        rank = fraction * self.count()
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.maximum
+
+    def report(self):
+        buckets = '  '.join(f'<={bound * 1000:g}ms:{count}' for bound, count in zip(LATENCY_BUCKETS, self.counts)
+                            if count)
+        if self.counts[-1]:
+            buckets += f'  >{LATENCY_BUCKETS[-1] * 1000:g}ms:{self.counts[-1]}'
+        return (f'actions {self.count()}  fallbacks {self.fallbacks}  mean {self.mean() * 1000:.1f}ms  '
+                f'p50 <={self.quantile(0.5) * 1000:g}ms  p99 <={self.quantile(0.99) * 1000:g}ms  '
+                f'max {self.maximum * 1000:.1f}ms  | {buckets}')
+
+
+class AgentSpec:
+    """
+    Names an agent class and its keyword arguments, so that workers can build the agent in their own process
+    :param module: name of the module of the agent
+    :param name: name of the agent class in the module
+    :param kwargs: keyword arguments of the agent constructor, after the initial state and the player number
+    """
+
+    def __init__(self, module, name='Agent', **kwargs):
+        self.module = module
+        self.name = name
+        self.kwargs = kwargs
+
+    @classmethod
+    def parse(cls, text, kwargs=None):
+        """
+        :param text: 'module' or 'module:Class'
+        :param kwargs: JSON object of keyword arguments
+        """
+        module, _, name = text.partition(':')
+        return cls(module, name or 'Agent', **(json.loads(kwargs) if kwargs else {}))
+
+    def build(self, initial_state, player_number, turn=0):
+        """
+        :param turn: the number of turns of the game already played, for an agent built in the middle of it. An agent
+        that counts its turns in a turn attribute, as the agents of ex3 do, counts on from there
+        """
+        agent_class = getattr(importlib.import_module(self.module), self.name)
+        agent = agent_class(initial_state, player_number, **self.kwargs)
+        if turn and hasattr(agent, 'turn'):
+            agent.turn += turn
+        return agent
+
+    def __repr__(self):
+        arguments = ''.join(f', {key}={value!r}' for key, value in self.kwargs.items())
+        return f'{self.module}.{self.name}({arguments[2:]})'
+
+
+def default_action(initial_state, player_number):
+    """
+    :return: the action played when an agent misses its deadline, every ship waits, which is always legal
+    """
+    return tuple(('wait', name) for name, ship in initial_state['pirate_ships'].items()
+                 if ship['player'] == player_number)
+
+
+def host_worker(connection, spec, initial_state, player_number, action_time, diffs, turn=0):
+    """
+    The loop of an agent process: builds the agent, answers ('ready', ids), then answers every (number, state)
+    message with ('action', number, action), or ('error', number, traceback) if act raised.
+    A state that is already followed by another message is skipped, its turn is over.
+    Returns when the host closes its end of the connection, or after answering ('closed',) to a None message
+    :param diffs: whether the messages hold diffs of a state_delta.StateEncoder instead of states. The agent then
+    reads a read-only view of the mirrored state
+    :param turn: the number of turns already played, see AgentSpec.build
+    """
+    agent = spec.build(initial_state, player_number, turn)
+    if action_time is not None and hasattr(agent, 'time_manager'):
+        agent.time_manager.hard_limit = action_time
+    mirror = StateMirror(initial_state) if diffs else None
+    try:
+        connection.send(('ready', agent.ids))
+        while True:
+            message = connection.recv()
+            if message is None:
+                connection.send(('closed',))
+                return
+            number, state = message
+            # every diff is applied, even those of skipped turns
+            if mirror is not None:
+                state = StateView(mirror.apply(state))
+            if connection.poll():
+                continue
+            try:
+                action = agent.act(state)
+            except Exception:
+                connection.send(('error', number, traceback.format_exc()))
+                continue
+            connection.send(('action', number, action))
+    except (EOFError, OSError):
+        pass
+
+
+def stop_host(connection, process):
+    connection.close()
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+
+class AgentHost:
+    """
+    Plays an agent that runs in a process of its own, as a drop in agent of main.Game.
+    Every action is waited for until the deadline at most. An agent that misses it while acting is preempted: its
+    process is killed, the default action is played instead, and a new process with a new agent from the initial
+    state takes over. The new agent is told how many turns were played, but not what happened in them. An agent that
+    raises plays the default action too, and one still being built is not preempted.
+    :param spec: the agent to host, with a build(initial_state, player_number, turn) method, like AgentSpec
+    :param deadline: in seconds, the action timeout of the game less HOST_MARGIN by default
+    :param action_time: if given, the time limit the agent plans its moves for, for agents with a time manager
+    :param diffs: whether the whole state is sent only when the process starts, and then only its diff from the
+    previous turn, see state_delta
+    """
+
+    def __init__(self, spec, initial_state, player_number, deadline=None, action_time=None,
+                 constructor_timeout=main.CONSTRUCTOR_TIMEOUT, diffs=HOST_DIFFS):
+        self.spec = spec
+        self.initial_state = initial_state
+        self.player_number = player_number
+        self.deadline = deadline if deadline is not None else main.ACTION_TIMEOUT - HOST_MARGIN
+        self.action_time = action_time
+        self.fallback = default_action(initial_state, player_number)
+        self.histogram = LatencyHistogram()
+        self.timeouts = 0
+        self.errors = 0
+        self.restarts = 0
+        self.number = 0
+        self.ids = None
+        self.encoder = StateEncoder(initial_state) if diffs else None
+        self.connection = self.process = self.finalizer = None
+        self.start()
+        if not self.connection.poll(constructor_timeout):
+            self.close()
+            raise ValueError('agent timed out on constructor!')
+        try:
+            self.receive()
+        except (EOFError, OSError):
+            pass
+        if not self.ready:
+            self.close()
+            raise ValueError('agent failed on constructor!')
+
+    def start(self):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        # not a daemon, so that the agent may start processes of its own
+        self.process = multiprocessing.Process(target=host_worker, args=(
+            worker_connection, self.spec, self.initial_state, self.player_number, self.action_time,
+            self.encoder is not None, self.number))
+        self.process.start()
+        # a new process mirrors the initial state
+        if self.encoder is not None:
+            self.encoder.reset(self.initial_state)
+        worker_connection.close()
+        self.ready = False
+        self.finalizer = weakref.finalize(self, stop_host, self.connection, self.process)
+
+    def restart(self):
+        self.finalizer()
+        self.restarts += 1
+        self.start()
+
+    def receive(self):
+        """
+        :return: the next answer of the agent, after its ready message
+        """
+        message = self.connection.recv()
+        while message[0] == 'ready':
+            self.ready = True
+            self.ids = message[1]
+            if not self.connection.poll():
+                return None
+            message = self.connection.recv()
+        return message
+
+    def act(self, state):
+        self.number += 1
+        start = time.monotonic()
+        deadline = start + self.deadline
+        try:
+            self.connection.send((self.number, self.encoder.encode(state) if self.encoder is not None else state))
+            while self.connection.poll(max(0.0, deadline - time.monotonic())):
+                message = self.receive()
+                # answers to the turns that were already given up on are dropped
+                if message is None or message[1] != self.number:
+                    continue
+                if message[0] == 'error':
+                    self.errors += 1
+                    break
+                self.histogram.add(time.monotonic() - start)
+                return message[2]
+            else:
+                self.timeouts += 1
+                if self.ready:
+                    self.restart()
+        except (EOFError, OSError):
+            # the process of the agent died
+            self.errors += 1
+            self.restart()
+        self.histogram.add(time.monotonic() - start, fallback=True)
+        return self.fallback
+
+    def close(self):
+        self.finalizer()
+
+    def report(self):
+        return (f'{self.ids}: timeouts {self.timeouts}  errors {self.errors}  restarts {self.restarts}  '
+                f'{self.histogram.report()}')
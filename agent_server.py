@@ -0,0 +1,247 @@
+"""Serves agents over TCP or Unix sockets, so that games on one machine can play agents running on others"""
+
+import argparse
+import ipaddress
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+import traceback
+import types
+import weakref
+from multiprocessing.connection import Client, Listener
+
+import main
+from agent_host import AgentHost, AgentSpec, HOST_DIFFS, host_worker
+
+# messages are pickles, which run code when loaded, so only clients that know the key are served. Servers and
+# clients read the key from this environment variable
+AUTHKEY_VARIABLE = 'AGENT_SERVER_AUTHKEY'
+AUTHKEY = os.environ.get(AUTHKEY_VARIABLE, '').encode() or None
+DEFAULT_ADDRESS = '127.0.0.1:6060'
+# idle connections kept per server address
+CONNECTION_POOL_SIZE = 16
+# the longest a client waits for the server to end a session before dropping the connection
+SESSION_CLOSE_TIMEOUT = 1.0
+
+
+def parse_address(text):
+    """
+    :param text: 'host:port' for TCP, or the path of a Unix socket
+    :return: the address as multiprocessing.connection takes it
+    """
+    host, separator, port = text.rpartition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return text
+
+
+def is_loopback(address):
+    """
+    :param address: an address as parse_address returns it. Unix sockets are local, guarded by file permissions
+    """
+    if not isinstance(address, tuple):
+        return True
+    host = address[0]
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        # a host name, which may resolve to any interface
+        return False
+
+
+def serve_connection(connection):
+    """
+    Serves the sessions of a client connection one after another, until the client closes it. A session starts with
+    a ('new', spec, initial_state, player_number, action_time, diffs, turn) message, is answered like
+    agent_host.AgentHost, and ends with a None message. An agent that fails to build is answered with
+    ('failed', traceback)
+    """
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                connection.send(('closed',))
+                continue
+            _, spec, initial_state, player_number, action_time, diffs, turn = message
+            try:
+                host_worker(connection, spec, initial_state, player_number, action_time, diffs, turn)
+            except Exception:
+                connection.send(('failed', traceback.format_exc()))
+    except (EOFError, OSError):
+        pass
+    finally:
+        connection.close()
+
+
+class AgentServer:
+    """
+    Accepts client connections and serves each in a process of its own
+    :param address: 'host:port' or a Unix socket path, port 0 for any free port. The address the server listens on
+    is kept in self.address
+    :param authkey: the key clients must know, required to listen beyond loopback. Without one, a loopback server
+    makes up a random key, kept in self.authkey
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=AUTHKEY):
+        address = parse_address(address)
+        if authkey is None:
+            if not is_loopback(address):
+                raise ValueError(f'serving beyond loopback needs an authkey, set {AUTHKEY_VARIABLE}')
+            authkey = secrets.token_hex(16).encode()
+        self.authkey = authkey
+        self.listener = Listener(address, authkey=authkey)
+        address = self.listener.address
+        self.address = f'{address[0]}:{address[1]}' if isinstance(address, tuple) else address
+        self.process = None
+
+    def serve_forever(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (multiprocessing.AuthenticationError, EOFError, ConnectionError):
+                continue
+            # not a daemon, so that served agents may start processes of their own
+            multiprocessing.Process(target=serve_connection, args=(connection,)).start()
+            connection.close()
+            # reaps the processes of the connections that ended
+            multiprocessing.active_children()
+
+    def start(self):
+        """
+        Serves in a background process, a stand-in server for trying the clients on one machine
+        """
+        self.process = multiprocessing.Process(target=self.serve_forever)
+        self.process.start()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+        self.listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class ConnectionPool:
+    """
+    Keeps the idle connections to a server, so that the agents of successive games reuse them
+    """
+
+    def __init__(self, address, authkey=AUTHKEY, size=CONNECTION_POOL_SIZE):
+        if authkey is None:
+            raise ValueError(f'connecting to an agent server needs its authkey, set {AUTHKEY_VARIABLE}')
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return Client(self.address, authkey=self.authkey)
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+# the connection pools of the process, per server address
+pools = {}
+
+
+def connection_pool(address, authkey=AUTHKEY):
+    key = address, authkey
+    if key not in pools:
+        pools[key] = ConnectionPool(address, authkey)
+    return pools[key]
+
+
+class RemoteAgent(AgentHost):
+    """
+    Plays an agent served by an AgentServer, as a drop in agent of main.Game, with the deadlines, default actions and
+    state diffs of AgentHost. An agent that misses its deadline can not be killed from here: its connection is
+    dropped instead, and its session ends on the server when its act returns
+    :param address: the address of the server, 'host:port' or a Unix socket path
+    :param authkey: the key of the server, AUTHKEY by default
+    """
+
+    def __init__(self, address, spec, initial_state, player_number, deadline=None, action_time=None,
+                 constructor_timeout=main.CONSTRUCTOR_TIMEOUT, diffs=HOST_DIFFS, authkey=AUTHKEY):
+        self.pool = connection_pool(address, authkey)
+        super().__init__(spec, initial_state, player_number, deadline, action_time, constructor_timeout, diffs)
+
+    def start(self):
+        connection = self.connection = self.pool.acquire()
+        self.ready = False
+        self.finalizer = weakref.finalize(self, connection.close)
+        connection.send(('new', self.spec, self.initial_state, self.player_number, self.action_time,
+                         self.encoder is not None, self.number))
+        if self.encoder is not None:
+            self.encoder.reset(self.initial_state)
+
+    def close(self):
+        """
+        Ends the session, and returns the connection to the pool if the server ends it in time
+        """
+        if not self.finalizer.alive:
+            return
+        try:
+            self.connection.send(None)
+            deadline = time.monotonic() + SESSION_CLOSE_TIMEOUT
+            while self.connection.poll(max(0.0, deadline - time.monotonic())):
+                if self.connection.recv() == ('closed',):
+                    self.finalizer.detach()
+                    self.pool.release(self.connection)
+                    return
+        except (EOFError, OSError):
+            pass
+        self.finalizer()
+
+
+def remote_module(address, module, authkey=AUTHKEY, **kwargs):
+    """
+    :param module: the name of the module of the agents, on the server
+    :param kwargs: keyword arguments of RemoteAgent
+    :return: a stand-in for the module, for main.Game.play_game, whose Agent and UCTAgent are played on the server.
+    The game closes their sessions when each episode ends, which returns the connections to the pool
+    """
+    def agent_class(name):
+        return lambda initial_state, player_number: RemoteAgent(address, AgentSpec(module, name), initial_state,
+                                                                player_number, authkey=authkey, **kwargs)
+
+    return types.SimpleNamespace(Agent=agent_class('Agent'), UCTAgent=agent_class('UCTAgent'))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help="'host:port' or the path of a Unix socket")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    server = AgentServer(parse_arguments().address)
+    print(f'serving agents on {server.address}', flush=True)
+    if AUTHKEY is None:
+        print(f'clients must set {AUTHKEY_VARIABLE}={server.authkey.decode()}', flush=True)
+    server.serve_forever()
@@ -0,0 +1,325 @@
+"""Benchmarks the hot paths of the simulator and of the agents on scenarios of growing size, with fixed seeds.
+Reports operations per second with their spread over the repeats, saves them to JSON and flags the regressions
+against a baseline saved the same way"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from copy import deepcopy
+
+import ex3_213125164_325407054 as ex3
+import main
+import sample_agent
+from simulator import Simulator
+from state_delta import large_input
+from state_view import StateView
+
+SEED = 0
+# the side of the square map of every scenario
+SCENARIOS = {'small': 7, 'medium': 25, 'large': 60}
+# rounds of the recorded game the benchmarks replay states of
+TRAJECTORY_ROUNDS = 50
+REPEATS = 5
+# every repeat of a benchmark runs for at least this long
+MIN_REPEAT_SECONDS = 0.2
+# the search time of the mcts benchmark, as in a real game
+SEARCH_SECONDS = ex3.ACTION_TIMEOUT
+# a benchmark regressed if it got slower by more than this fraction, and by more than its spread
+REGRESSION_TOLERANCE = 0.1
+
+
+class Scenario:
+    """
+    A game on a map of a given size, and the states of a game the sample agents played on it, with the action each
+    player chose in each of them
+    """
+
+    def __init__(self, name, size, rounds=TRAJECTORY_ROUNDS, seed=SEED):
+        self.name = name
+        self.initial_state = large_input(size, main.default_input())
+        random.seed(seed)
+        simulator = Simulator(self.initial_state)
+        agents = {1: sample_agent.Agent(self.initial_state, 1), 2: sample_agent.Agent(self.initial_state, 2)}
+        self.steps = []
+        for _ in range(rounds):
+            for player, agent in agents.items():
+                state = deepcopy(simulator.state)
+                action = agent.act(deepcopy(state))
+                self.steps.append((state, action, player))
+                simulator.act(action, player)
+            simulator.check_collision_with_marines()
+            simulator.move_marines()
+
+    def step(self, index):
+        return self.steps[index % len(self.steps)]
+
+
+# -------------------------------------------- Benchmarks --------------------------------------------
+# every benchmark takes a scenario and returns an operation, called with a counter and returning the number of
+# operations it made. An operation that draws from a random generator of its own, which random.seed does not reach,
+# has a seed attribute that reseeds it
+
+def bench_check_if_action_legal(scenario):
+    simulator = Simulator(scenario.initial_state)
+
+    def operation(index):
+        simulator.state, action, player = scenario.step(index)
+        simulator.check_if_action_legal(action, player)
+        return 1
+    return operation
+
+
+def bench_simulator_act(scenario):
+    """
+    Includes a cheap copy of the state it acts on
+    """
+    simulator = Simulator(scenario.initial_state)
+
+    def operation(index):
+        state, action, player = scenario.step(index)
+        simulator.state = ex3.copy_state(state)
+        simulator.act(action, player)
+        return 1
+    return operation
+
+
+def bench_move_marines(scenario):
+    simulator = Simulator(scenario.initial_state)
+
+    def operation(index):
+        simulator.state = ex3.copy_state(scenario.step(index)[0])
+        simulator.move_marines()
+        return 1
+    return operation
+
+
+def bench_add_treasure(scenario):
+    simulator = Simulator(scenario.initial_state)
+
+    def operation(index):
+        simulator.state = ex3.copy_state(scenario.step(index)[0])
+        simulator.add_treasure()
+        return 1
+    return operation
+
+
+def bench_get_actions(scenario):
+    """
+    The joint actions of the player to move, through the action cache as in a search
+    """
+    agents = {player: ex3.UCTAgent(scenario.initial_state, player) for player in (1, 2)}
+    simulator = Simulator(scenario.initial_state)
+
+    def operation(index):
+        simulator.state, _, player = scenario.step(index)
+        agents[player].get_actions(simulator, player)
+        return 1
+    return operation
+
+
+def bench_get_actions_uncached(scenario):
+    agents = {player: ex3.UCTAgent(scenario.initial_state, player) for player in (1, 2)}
+    simulator = Simulator(scenario.initial_state)
+
+    def operation(index):
+        simulator.state, _, player = scenario.step(index)
+        agents[player].action_cache.entries.clear()
+        agents[player].get_actions(simulator, player)
+        return 1
+    return operation
+
+
+def bench_sample_agent_act(scenario):
+    agents = {player: sample_agent.Agent(scenario.initial_state, player) for player in (1, 2)}
+
+    def operation(index):
+        state, _, player = scenario.step(index)
+        agents[player].act(StateView(state))
+        return 1
+    return operation
+
+
+def bench_rollouts(scenario):
+    """
+    Rollouts of UCTAgent.simulation to the end of the game, from the states of the scenario
+    """
+    agent = ex3.UCTAgent(scenario.initial_state, 1)
+    simulator = Simulator(scenario.initial_state)
+    rounds = scenario.initial_state["turns to go"] // 2
+
+    def operation(index):
+        state, _, player = scenario.step(index)
+        ex3.reset_simulator(simulator, state)
+        agent.simulation(None, simulator, rounds - index % len(scenario.steps) // 2, player)
+        return 1
+    return operation
+
+
+def bench_batch_rollouts(scenario, rollouts=64):
+    """
+    Vectorized rollouts of BatchRolloutEngine to the end of the game, from the states of the scenario, in batches
+    """
+    batch = ex3.BatchRolloutEngine(ex3.RolloutEngine(scenario.initial_state))
+    simulator = Simulator(scenario.initial_state)
+    rounds = scenario.initial_state["turns to go"] // 2
+
+    def operation(index):
+        state, _, player = scenario.step(index)
+        ex3.reset_simulator(simulator, state)
+        batch.play(simulator, rounds - index % len(scenario.steps) // 2, player, rollouts)
+        return rollouts
+    operation.seed = batch.seed
+    return operation
+
+
+def bench_mcts_iterations(scenario, search_seconds=SEARCH_SECONDS):
+    """
+    The iterations of a whole search of UCTAgent with the given time limit, from the middle of the scenario. Returns
+    them with the seconds the act took, which leave out building the agent
+    """
+    state, _, player = scenario.step(len(scenario.steps) // 2)
+
+    def operation(index):
+        agent = ex3.UCTAgent(scenario.initial_state, player, stats=True)
+        agent.time_manager.hard_limit = search_seconds
+        # a critical turn spends the whole time limit
+        agent.time_manager.allocate = lambda turns_to_go, num_actions, critical=False: search_seconds
+        agent.act(StateView(state))
+        return agent.search_stats.iterations, agent.search_stats.seconds
+    return operation
+
+
+BENCHMARKS = {
+    'check_if_action_legal': bench_check_if_action_legal,
+    'simulator_act': bench_simulator_act,
+    'move_marines': bench_move_marines,
+    'add_treasure': bench_add_treasure,
+    'get_actions': bench_get_actions,
+    'get_actions_uncached': bench_get_actions_uncached,
+    'sample_agent_act': bench_sample_agent_act,
+    'rollouts': bench_rollouts,
+    'batch_rollouts': bench_batch_rollouts,
+    'mcts_iterations': bench_mcts_iterations,
+}
+# benchmarks that run for a fixed time, once per repeat, and return their operations with the seconds they took
+TIMED_BENCHMARKS = ('mcts_iterations',)
+
+
+def measure(operation, repeats=REPEATS, min_seconds=MIN_REPEAT_SECONDS, once=False, seed=SEED):
+    """
+    :param once: whether every repeat calls the operation once, instead of as many times as fit in min_seconds. The
+    operation then returns the seconds it took too
+    :param seed: the seed of the first repeat, seeding random and the generator of the operation if it has one
+    :return: the operations per second of every repeat
+    """
+    rates = []
+    index = 0
+    seed_operation = getattr(operation, 'seed', None)
+    for repeat in range(repeats):
+        random.seed(seed + repeat)
+        if seed_operation is not None:
+            seed_operation(seed + repeat)
+        if once:
+            operations, elapsed = operation(index)
+            index += 1
+            rates.append(operations / elapsed)
+            continue
+        operations = 0
+        start = time.perf_counter()
+        while True:
+            operations += operation(index)
+            index += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                break
+        rates.append(operations / elapsed)
+    return rates
+
+
+def summary(rates):
+    return {'mean': statistics.fmean(rates), 'stdev': statistics.stdev(rates) if len(rates) > 1 else 0.0,
+            'runs': rates}
+
+
+def run(scenarios=None, benchmarks=None, repeats=REPEATS, search_seconds=SEARCH_SECONDS, output=print, seed=SEED):
+    """
+    :param scenarios: names of SCENARIOS, all by default
+    :param benchmarks: names of BENCHMARKS, all by default
+    :return: the results, by 'scenario/benchmark'
+    """
+    results = {}
+    for scenario_name in scenarios or SCENARIOS:
+        scenario = Scenario(scenario_name, SCENARIOS[scenario_name], seed=seed)
+        for name in benchmarks or BENCHMARKS:
+            if name in TIMED_BENCHMARKS:
+                operation = BENCHMARKS[name](scenario, search_seconds)
+            else:
+                operation = BENCHMARKS[name](scenario)
+            result = summary(measure(operation, repeats, once=name in TIMED_BENCHMARKS, seed=seed))
+            results[f'{scenario_name}/{name}'] = result
+            output(f'{scenario_name:>8} {name:<24} {result["mean"]:>14.1f} ops/s '
+                   f'± {100 * result["stdev"] / max(result["mean"], 1e-9):5.1f}%')
+    return results
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    :return: the names of the benchmarks slower than in the baseline by more than the tolerance and their spread,
+    and a line of report per benchmark found in both
+    """
+    regressions, lines = [], []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        change = result['mean'] / before['mean'] - 1 if before['mean'] else 0.0
+        # the relative spread of the difference of the two means
+        spread = 2 * ((result['stdev'] / max(result['mean'], 1e-9)) ** 2 +
+                      (before['stdev'] / max(before['mean'], 1e-9)) ** 2) ** 0.5
+        regressed = change < -max(tolerance, spread)
+        if regressed:
+            regressions.append(key)
+        lines.append(f'{key:<40} {before["mean"]:>14.1f} -> {result["mean"]:>14.1f} ops/s  {100 * change:+6.1f}%'
+                     f'{"  REGRESSION" if regressed else ""}')
+    return regressions, lines
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), help='all by default')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), help='all by default')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--search-seconds', type=float, default=SEARCH_SECONDS,
+                        help='the time limit of the searches of mcts_iterations')
+    parser.add_argument('--output', help='a JSON file to save the results to, to be used as a baseline later')
+    parser.add_argument('--baseline', help='a JSON file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    return parser.parse_args()
+
+
+def main_benchmark():
+    arguments = parse_arguments()
+    results = run(arguments.scenarios, arguments.benchmarks, arguments.repeats, arguments.search_seconds,
+                  seed=arguments.seed)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'seed': arguments.seed,
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'search_seconds': arguments.search_seconds,
+                       'results': results}, file, indent=1)
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions, lines = compare(results, baseline, arguments.tolerance)
+        print('\n'.join(lines))
+        if regressions:
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,202 @@
+"""Structured events of the games played by main.Game, and the sinks they are written to"""
+
+import json
+import pickle
+import time
+
+# events buffered by file sinks before a write
+EVENT_BUFFER_SIZE = 1024
+
+
+class EventSink:
+    """
+    Receives the events of games, as dictionaries with a 'type' key.
+    Games do not even build the events of a sink that is not enabled
+    """
+
+    enabled = True
+
+    def emit(self, event):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class NullSink(EventSink):
+    """
+    The headless sink, drops every event
+    """
+
+    enabled = False
+
+    def emit(self, event):
+        pass
+
+
+class MemorySink(EventSink):
+    """
+    Keeps the events in a list
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+
+class BufferedFileSink(EventSink):
+    """
+    Writes the events to a file, EVENT_BUFFER_SIZE events at a time
+    """
+
+    mode = 'w'
+
+    def __init__(self, path, buffer_size=EVENT_BUFFER_SIZE):
+        self.file = open(path, self.mode)
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def emit(self, event):
+        self.buffer.append(self.encode(event))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def encode(self, event):
+        raise NotImplementedError
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.joiner.join(self.buffer) + self.joiner)
+            self.buffer = []
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class JsonlSink(BufferedFileSink):
+    """
+    Writes one JSON object per line. Tuples become lists
+    """
+
+    joiner = '\n'
+
+    def encode(self, event):
+        return json.dumps(event, separators=(',', ':'))
+
+
+class BinarySink(BufferedFileSink):
+    """
+    Writes the events as consecutive pickles, read back by read_binary_events
+    """
+
+    mode = 'wb'
+    joiner = b''
+
+    def encode(self, event):
+        return pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+
+
+def read_jsonl_events(path):
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_binary_events(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+class PrintSink(EventSink):
+    """
+    Prints the events for humans, as main.Game used to print them while playing
+    """
+
+    def __init__(self):
+        self.ids = []
+
+    def emit(self, event):
+        kind = event['type']
+        if kind == 'episode_start':
+            self.ids = event['ids']
+            print(f"***********  starting a {'second' if event['swapped'] else 'first'} round!  ************ \n \n")
+        elif kind == 'turn':
+            print(f"Turn {event['turn']}")
+            for ids, action in zip(self.ids, event['actions']):
+                print(f"{ids} chose {action}")
+            print(event['score'])
+            print("-----")
+        elif kind == 'error':
+            print(f"Turn {event['turn']}")
+            print(event['message'])
+        elif kind == 'episode_end':
+            if event['swapped']:
+                print('***********  end of round!  ************ \n \n')
+            else:
+                print(event['state'])
+        elif kind == 'game_end':
+            print('end of game!')
+
+
+class WaitingAgent:
+    """
+    An agent whose ships always wait, so that a benchmark measures the game itself
+    """
+
+    def __init__(self, initial_state, player_number):
+        self.ids = ['waiting']
+        self.action = tuple(('wait', name) for name, ship in initial_state['pirate_ships'].items()
+                            if ship['player'] == player_number)
+
+    def act(self, state):
+        return self.action
+
+
+def benchmark_sinks(games=50, turns=200, repeats=3):
+    """
+    Plays the same games with every sink, printing to the null device, and prints the best games per second of each
+    over the repeats
+    """
+    import contextlib
+    import os
+    import random
+    import tempfile
+    import types
+    import main
+
+    an_input = main.default_input()
+    an_input["turns to go"] = turns
+    waiting = types.SimpleNamespace(Agent=WaitingAgent)
+    directory = tempfile.mkdtemp()
+    sinks = {'print': PrintSink, 'none': NullSink, 'memory': MemorySink,
+             'jsonl': lambda: JsonlSink(os.path.join(directory, 'events.jsonl')),
+             'binary': lambda: BinarySink(os.path.join(directory, 'events.bin'))}
+    for name, make_sink in sinks.items():
+        best = 0.0
+        for _ in range(repeats):
+            random.seed(0)
+            start = time.perf_counter()
+            with make_sink() as sink, open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+                for _ in range(games):
+                    main.Game(an_input, sink).play_game(waiting, waiting, UCT_flag=False)
+            best = max(best, games / (time.perf_counter() - start))
+        print(f'{name:>8}: {best:.2f} games/s')
+
+
+if __name__ == '__main__':
+    benchmark_sinks()
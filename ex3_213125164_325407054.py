@@ -1,9 +1,22 @@
 import time
-from simulator import Simulator
+from simulator import Simulator, TREASURE_ARRIVAL_PROBABILITY, TREASURE_NAMES
 import random
 import math
 from typing import List, Tuple
 import itertools
+import gc
+import json
+import multiprocessing
+import weakref
+from array import array
+from contextlib import contextmanager
+from collections import OrderedDict
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 IDS = ["213125164", "325407054"]
 
@@ -15,15 +28,82 @@ PLAYER_1_NAME = "player 1"
 PLAYER_2_NAME = "player 2"
 PENALTY = 10000
 
-
-def check_time(start, timeout):
-    """
-    :param start: start of phase time
-    :param timeout: max phase length
-    :raise TimeoutError: is a phase timed out
-    """
-    if time.time() - start > timeout:
-        raise TimeoutError("")
+# time management
+NORMAL_TURN_FRACTION = 0.8
+LAST_TURN_FRACTION = 0.2
+CHECK_INTERVAL = 0.01
+SAFETY_FACTOR = 2
+MIN_SAFETY_MARGIN = 0.02
+LATENCY_DECAY = 0.9
+CLOSE_VALUE_MARGIN = 0.1
+MAX_TIME_BANK = ACTION_TIMEOUT
+MIN_ITERATIONS_TO_SETTLE = 50
+SETTLE_CONFIDENCE = 3
+
+# root policy: 'uct' selects the root moves by UCT, 'halving' by sequential halving
+ROOT_POLICY = 'uct'
+ROOT_POLICIES = ('uct', 'halving')
+
+# tree memory
+POOL_SIZE = 20000
+MAX_NODES = 200000
+EVICTION_LOW_WATER = 0.75
+CLOSED_LOOP = False
+OPEN_LOOP = True
+
+# RAVE
+RAVE = False
+RAVE_EQUIVALENCE = 300
+
+# priors
+PRIOR_SCORER = 'distance'
+PRIOR_TEMPERATURE = 1.0
+PUCT_EXPLORATION = 1.0
+LEARNING_RATE = 0.01
+MIN_LEARNING_VISITS = 10
+
+# endgame solver
+SOLVER_HORIZON = 2
+SOLVER_TIME_FRACTION = 0.5
+SOLVER_CHECK_INTERVAL = 256
+MAX_TREASURES = 9
+MIN_REWARD = 1
+MAX_REWARD = 9
+
+# batched leaf evaluation
+BATCH_ROLLOUTS = False
+BATCH_SIZE = 16
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 64
+BATCH_MEASURE_TURNS = 2000
+CALIBRATION_SIZES = (16, 32, 64, 128, 256, 512)
+CALIBRATION_TURNS = 10
+
+# macro actions
+MACRO_ACTIONS = False
+MACRO_TREASURES = 3
+MACRO_MAX_TURNS = 8
+MACRO_KINDS = ('to_treasure', 'to_base', 'intercept', 'hold')
+
+# rollouts move the marines by a table of their joint moves, if they have at most this many joint states
+MARINE_TABLE_STATES = 4096
+
+# action list cache
+ACTION_CACHE_SIZE = 50000
+
+# opponent model
+OPPONENT_MODEL = False
+OPPONENT_PRIOR = 1
+
+# pondering: searching in a worker process while the opponent thinks
+PONDER = False
+# the longest the worker ponders, the time an opponent may think
+PONDER_LIMIT = ACTION_TIMEOUT
+# the longest act waits for the statistics pondered by the worker
+PONDER_WAIT = 0.1
+
+# search statistics of every turn, see SearchStats
+SEARCH_STATS = False
 
 
 def heuristic(state, player_number, heuristic_name):
@@ -43,11 +123,78 @@ def heuristic_1(state, player_number):
     return total
 
 
+def state_key(state):
+    """
+    :return: a hashable key of the changing part of a state (ships, treasures and marine positions)
+    """
+    pirate_ships = tuple((k, v["location"], v["capacity"]) for k, v in state["pirate_ships"].items())
+    treasures = tuple((k, v["location"], v["reward"]) for k, v in state["treasures"].items())
+    marine_ships = tuple(v["index"] for v in state["marine_ships"].values())
+    return pirate_ships, treasures, marine_ships
+
+
+def ships_key(state):
+    """
+    :return: a hashable key of the locations and capacities of the ships of a state
+    """
+    return tuple((name, ship["location"], ship["capacity"]) for name, ship in state["pirate_ships"].items())
+
+
+def canonical_state_key(state):
+    """
+    A key that is the same for states equal up to the names of the treasures and a permutation of the ships of
+    a player, which have the same values
+    """
+    carried = {}
+    free_treasures = []
+    for treasure in state["treasures"].values():
+        if type(treasure["location"]) == str:
+            carried.setdefault(treasure["location"], []).append(treasure["reward"])
+        else:
+            free_treasures.append((treasure["location"], treasure["reward"]))
+    ships = sorted((ship["player"], ship["location"], ship["capacity"], tuple(sorted(carried.get(name, ()))))
+                   for name, ship in state["pirate_ships"].items())
+    return (tuple(ships), tuple(sorted(free_treasures)),
+            tuple(marine["index"] for marine in state["marine_ships"].values()))
+
+
 def hash_state(state):
-    pirate_ships = sum(f'{k}{v["location"]}{v["capacity"]}{v["player"]};' for k, v in state["pirate_ships"].items())
-    treasures = sum(f'{k}{v["location"]}{v["reward"]};' for k, v in state["treasures"].items())
-    marine_ships = sum(f'{k}{v["index"]}{v["path"]};' for k, v in state["marine_ships"].items())
-    return hash(pirate_ships + ';' + treasures + ';' + marine_ships + ';' + state["turns to go"])
+    return hash(state_key(state))
+
+
+def copy_state(state):
+    """
+    Copies the changing part of a state. The map and the marine paths are shared with the original state
+    """
+    return {
+        "map": state["map"],
+        "base": state["base"],
+        "pirate_ships": {name: dict(ship) for name, ship in state["pirate_ships"].items()},
+        "treasures": {name: dict(treasure) for name, treasure in state["treasures"].items()},
+        "marine_ships": {name: dict(marine) for name, marine in state["marine_ships"].items()},
+        "turns to go": state["turns to go"],
+    }
+
+
+def own_state(state, initial_state):
+    """
+    Copies a state passed to act, which the game may pass as a read-only view of its live state, into plain
+    dictionaries. The map and the marine paths never change, so they are taken from the initial state
+    """
+    state = copy_state(state)
+    state["map"] = initial_state["map"]
+    for name, marine in state["marine_ships"].items():
+        marine["path"] = initial_state["marine_ships"][name]["path"]
+    return state
+
+
+def reset_simulator(simulator, state):
+    """
+    Resets a reusable simulator to a snapshot of a state, without deep copying it
+    """
+    simulator.state = copy_state(state)
+    simulator.score = {PLAYER_1_NAME: 0, PLAYER_2_NAME: 0}
+    simulator.turns_to_go = state["turns to go"]
 
 
 def action_heuristic(move):
@@ -64,49 +211,925 @@ def action_heuristic(move):
     return value
 
 
+# -------------------------------------------- Priors --------------------------------------------
+
+
+class PriorScorer:
+    """
+    Gives the children of a node their prior probabilities, a softmax of the scores of their moves.
+    The score of a joint move is the sum of the scores of its atomic actions.
+    """
+
+    def __init__(self, initial_state, temperature=PRIOR_TEMPERATURE):
+        self.temperature = temperature
+
+    def prepare(self, state, player):
+        """
+        :return: what the scorer needs to know about the state, computed once for all the moves
+        """
+        return None
+
+    def score_atom(self, action, state, player, context) -> float:
+        raise NotImplementedError
+
+    def priors(self, actions, state, player) -> List[float]:
+        """
+        :param actions: the joint actions of the player
+        :return: the prior probability of every action
+        """
+        context = self.prepare(state, player)
+        scores = {}
+        totals = []
+        for action in actions:
+            total = 0
+            for atomic_action in action:
+                if atomic_action not in scores:
+                    scores[atomic_action] = self.score_atom(atomic_action, state, player, context)
+                total += scores[atomic_action]
+            totals.append(total / self.temperature)
+        top = max(totals)
+        weights = [math.exp(total - top) for total in totals]
+        norm = sum(weights)
+        return [weight / norm for weight in weights]
+
+    def learn(self, children, state, player):
+        """
+        Learns from the values the search found for the children of the root. Does nothing by default
+        """
+
+
+class HeuristicScorer(PriorScorer):
+    """
+    Scores atomic actions by action_heuristic
+    """
+
+    def score_atom(self, action, state, player, context) -> float:
+        return action_heuristic((action,))
+
+
+class DistanceScorer(PriorScorer):
+    """
+    Scores atomic actions by a weighted sum of features. Besides the type of the action, a sail scores the
+    progress of a loaded ship toward the base, of a ship with room toward the closest free treasure, and the risk
+    of a loaded ship to meet a marine. Distances are by sea, from BFS tables computed once per target.
+    """
+
+    # collect, deposit, idle, loot, base progress, treasure progress, marine risk
+    WEIGHTS = (3, 5, -0.5, 2, 1, 1, -2)
+
+    def __init__(self, initial_state, temperature=PRIOR_TEMPERATURE, weights=None):
+        super().__init__(initial_state, temperature)
+        self.weights = list(weights or self.WEIGHTS)
+        self.neighbors = get_neighbor_dict(initial_state["map"])
+        self.base = initial_state["base"]
+        self.tables = {}
+
+    def distances(self, sources):
+        """
+        :param sources: the cells at distance 0
+        :return: the distance by sea of every reachable cell to the closest source
+        """
+        sources = tuple(sources)
+        if sources not in self.tables:
+            self.tables[sources] = sea_distances(self.neighbors, sources)
+        return self.tables[sources]
+
+    def prepare(self, state, player):
+        # a treasure is collected from the sea cells next to it
+        free_treasures = [self.distances(self.neighbors[treasure["location"]])
+                          for treasure in state["treasures"].values() if type(treasure["location"]) != str]
+        marine_cells = marine_reach(state)
+        carried = {}
+        for treasure in state["treasures"].values():
+            carried[treasure["location"]] = carried.get(treasure["location"], 0) + 1
+        return free_treasures, marine_cells, carried
+
+    def features(self, action, state, player, context):
+        """
+        :return: the features of an atomic action
+        """
+        free_treasures, marine_cells, carried = context
+        ship = state["pirate_ships"][action[1]]
+        loaded = carried.get(action[1], 0) > 0
+        if action[0] == 'collect':
+            return 1, 0, 0, 0, 0, 0, 0
+        if action[0] == 'deposit':
+            return 0, 1, 0, 0, 0, 0, 0
+        if action[0] == 'wait':
+            return 0, 0, 1, 0, 0, 0, 0
+        if action[0] == 'plunder':
+            loot = carried.get(action[2], 0)
+            return 0, 0, int(loot == 0), loot, 0, 0, 0
+        here, there = ship["location"], action[2]
+        base_progress = treasure_progress = 0
+        if loaded:
+            to_base = self.distances((self.base,))
+            base_progress = to_base.get(here, 0) - to_base.get(there, 0)
+        if ship["capacity"] > 0 and free_treasures:
+            unreachable = len(self.neighbors)
+            treasure_progress = (min(table.get(here, unreachable) for table in free_treasures) -
+                                 min(table.get(there, unreachable) for table in free_treasures))
+        return 0, 0, 0, 0, base_progress, treasure_progress, int(loaded and there in marine_cells)
+
+    def score_atom(self, action, state, player, context) -> float:
+        return sum(weight * feature for weight, feature in zip(self.weights, self.features(action, state, player,
+                                                                                              context)))
+
+
+class LinearScorer(DistanceScorer):
+    """
+    A linear model over the features of DistanceScorer, learned during the game: after every search, the weights
+    move by SGD toward predicting the advantage of every well visited root child over the average child,
+    in units of the spread of the child values.
+    """
+
+    def __init__(self, initial_state, temperature=PRIOR_TEMPERATURE, weights=None, learning_rate=LEARNING_RATE):
+        super().__init__(initial_state, temperature, weights)
+        self.learning_rate = learning_rate
+
+    def learn(self, children, state, player):
+        visited = [child for child in children if child.visits >= MIN_LEARNING_VISITS]
+        if len(visited) < 2:
+            return
+        means = [child.wins / child.visits for child in visited]
+        average = sum(means) / len(means)
+        spread = max(1.0, math.sqrt(sum((mean - average) ** 2 for mean in means) / len(means)))
+        context = self.prepare(state, player)
+        for child, mean in zip(visited, means):
+            features = [sum(column) for column in zip(*(self.features(atomic_action, state, player, context)
+                                                        for atomic_action in child.move))]
+            error = (mean - average) / spread - sum(weight * feature for weight, feature in zip(self.weights,
+                                                                                                  features))
+            for index, feature in enumerate(features):
+                self.weights[index] += self.learning_rate * error * feature
+
+
+def sea_distances(neighbors, sources):
+    """
+    :param neighbors: the sea neighbors of every cell
+    :param sources: the cells at distance 0
+    :return: the distance by sea of every reachable cell to the closest source
+    """
+    distance = dict.fromkeys(sources, 0)
+    frontier = list(sources)
+    while frontier:
+        next_frontier = []
+        for location in frontier:
+            for neighbor in neighbors[location]:
+                if neighbor not in distance:
+                    distance[neighbor] = distance[location] + 1
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    return distance
+
+
+PRIOR_SCORERS = {'heuristic': HeuristicScorer, 'distance': DistanceScorer, 'linear': LinearScorer}
+
+
+def make_scorer(prior, initial_state):
+    """
+    :param prior: name of a scorer in PRIOR_SCORERS, or None for no priors
+    :return: the scorer, or None
+    """
+    return PRIOR_SCORERS[prior](initial_state) if prior else None
+
+
+def exploration_constant(min_result, max_result):
+    """
+    :return: the PUCT exploration constant, scaled by the range of the simulation results seen so far
+    """
+    return PUCT_EXPLORATION * max(1.0, max_result - min_result)
+
+
+def first_play_value(children):
+    """
+    :return: the value of unvisited children, the mean of the visited ones
+    """
+    visits = sum(child.visits for child in children)
+    return sum(child.wins for child in children) / visits if visits else 0
+
+
+# -------------------------------------------- Time Manager --------------------------------------------
+
+
+class TimeManager:
+    """
+    Allocates the search time of every turn and decides when a search should stop.
+    The clock is read only every `check_every` iterations, and a search is only stopped between iterations,
+    so no rollout is thrown away. `check_every` adapts to the measured iteration latency.
+    """
+
+    def __init__(self, hard_limit=ACTION_TIMEOUT):
+        self.hard_limit = hard_limit
+        self.iteration_latency = 0.0
+        self.max_iteration_latency = 0.0
+        self.check_every = 1
+        self.start_time = 0.0
+        self.deadline = 0.0
+        self.extended = False
+        self.iterations = 0
+        self.last_check = 0.0
+        self.last_check_iteration = 0
+        self.checked = False
+        # time saved on earlier turns, spent on later ones
+        self.bank = 0.0
+        self.leftover = 0.0
+
+    def allocate(self, turns_to_go, num_actions, critical=False):
+        """
+        :param turns_to_go: turns left in the game, including the current one
+        :param num_actions: number of legal joint actions at the root
+        :param critical: whether the state is critical (carried treasure near marines)
+        :return: the time budget of the turn, in seconds
+        """
+        if num_actions <= 1:
+            return 0.0
+        if turns_to_go <= 1:
+            return self.hard_limit * LAST_TURN_FRACTION
+        if critical:
+            return self.hard_limit
+        return min(self.hard_limit, self.hard_limit * NORMAL_TURN_FRACTION + self.bank)
+
+    def start(self, budget):
+        """
+        Starts the search of a turn
+        :param budget: time budget of the turn, in seconds
+        """
+        self.start_time = time.monotonic()
+        self.deadline = self.start_time + min(budget, self.hard_limit)
+        self.extended = False
+        self.iterations = 0
+        self.last_check = self.start_time
+        self.last_check_iteration = 0
+        self.checked = False
+        # the latency of the previous turn is a good prior, but rollouts get shorter as the game advances
+        self.max_iteration_latency *= LATENCY_DECAY
+
+    def safety_margin(self):
+        """
+        :return: the time a check interval may still take after the deadline was last checked
+        """
+        return SAFETY_FACTOR * self.check_every * self.max_iteration_latency + MIN_SAFETY_MARGIN
+
+    def keep_searching(self):
+        """
+        Called once after every iteration
+        :return: whether there is time for more iterations
+        """
+        self.iterations += 1
+        self.checked = self.iterations - self.last_check_iteration >= self.check_every
+        if not self.checked:
+            return True
+        now = time.monotonic()
+        latency = (now - self.last_check) / (self.iterations - self.last_check_iteration)
+        self.last_check = now
+        self.last_check_iteration = self.iterations
+        self.iteration_latency = latency if self.iteration_latency == 0 else \
+            LATENCY_DECAY * self.iteration_latency + (1 - LATENCY_DECAY) * latency
+        self.max_iteration_latency = max(self.max_iteration_latency, latency)
+        self.check_every = max(1, int(CHECK_INTERVAL / max(self.iteration_latency, 1e-6)))
+        return now + self.safety_margin() < self.deadline
+
+    def extend(self):
+        """
+        Extends the search of the current turn up to the hard limit, once per turn
+        :return: whether the deadline was extended
+        """
+        hard_deadline = self.start_time + self.hard_limit
+        if self.extended or self.deadline >= hard_deadline:
+            return False
+        self.extended = True
+        self.deadline = hard_deadline
+        return time.monotonic() + self.safety_margin() < self.deadline
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def remaining_iterations(self):
+        """
+        :return: estimated number of iterations that still fit before the deadline
+        """
+        remaining = self.deadline - time.monotonic() - self.safety_margin()
+        return max(0, int(remaining / max(self.iteration_latency, 1e-6)))
+
+    def finish(self):
+        """
+        Ends the search of a turn, and carries the time it did not use over to later turns
+        :return: the time left before the deadline, in seconds
+        """
+        elapsed = self.elapsed()
+        self.leftover = max(0.0, self.deadline - self.start_time - elapsed)
+        self.bank = min(MAX_TIME_BANK, max(0.0, self.bank + self.hard_limit * NORMAL_TURN_FRACTION - elapsed))
+        return self.leftover
+
+
+def is_critical_state(state, my_ships):
+    """
+    :param state: current state
+    :param my_ships: names of the ships of the player
+    :return: whether one of the ships carries treasure next to a cell a marine may reach this turn
+    """
+    marine_cells = marine_reach(state)
+    carriers = {treasure["location"] for treasure in state["treasures"].values()}
+    for ship in my_ships:
+        if ship not in carriers:
+            continue
+        x, y = state["pirate_ships"][ship]["location"]
+        if any(abs(x - i) + abs(y - j) <= 1 for i, j in marine_cells):
+            return True
+    return False
+
+
+def root_values_close(children):
+    """
+    :param children: the children of the root
+    :return: whether the two best children (by mean value) are too close to tell apart
+    """
+    means = sorted((child.wins / child.visits for child in children if child.visits > 0), reverse=True)
+    if len(means) < 2:
+        return False
+    return means[0] - means[1] <= CLOSE_VALUE_MARGIN * max(1.0, abs(means[0]))
+
+
+def decision_settled(children, remaining_iterations, value_range):
+    """
+    Checks whether more search can still change the chosen root move
+    :param children: the children of the root
+    :param remaining_iterations: estimated number of iterations left in the turn
+    :param value_range: the range of the simulation results seen so far, the deviation of children with few results
+    :return: whether the best child can no longer be overtaken
+    """
+    visited = [child for child in children if child.visits > 0]
+    if len(visited) < 2 or sum(child.visits for child in visited) < MIN_ITERATIONS_TO_SETTLE:
+        return len(visited) == 1 and len(children) == 1
+    by_visits = sorted(visited, key=lambda child: child.visits, reverse=True)
+    best = max(visited, key=lambda child: child.wins / child.visits)
+    if best is not by_visits[0]:
+        return False
+    # no other child can reach the visit count of the best one, even if it takes all the remaining iterations
+    if best.visits - by_visits[1].visits > remaining_iterations:
+        return True
+    # the lower confidence bound of the best child is above the upper confidence bound of every other child
+    if value_range <= 0:
+        return False
+    deviation = max(child.deviation(value_range) for child in visited)
+    best_lower = best.wins / best.visits - SETTLE_CONFIDENCE * deviation / math.sqrt(best.visits)
+    return all(child.wins / child.visits + SETTLE_CONFIDENCE * deviation / math.sqrt(child.visits) < best_lower
+               for child in visited if child is not best)
+
+
+# -------------------------------------------- Search Statistics --------------------------------------------
+
+class SearchStats:
+    """
+    How the search of one turn spent its time. Agents only collect statistics when enabled: the search loops then
+    read the clock between the phases of every iteration
+    """
+
+    __slots__ = ('turn', 'started', 'seconds', 'iterations', 'rollouts', 'selection', 'expansion', 'simulation',
+                 'backpropagation', 'max_depth', 'depth_sum', 'nodes', 'root', 'budget', 'leftover', 'slack')
+
+    def __init__(self, turn):
+        self.turn = turn
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.iterations = 0
+        self.rollouts = 0
+        self.selection = self.expansion = self.simulation = self.backpropagation = 0.0
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.nodes = 0
+        self.root = []
+        self.budget = self.leftover = self.slack = 0.0
+
+    def iteration(self, started, selected, expanded, simulated, depth, rollouts=1):
+        """
+        Records an iteration, given the clock when it started and after each of its first three phases
+        :param depth: the depth of the leaf it reached
+        """
+        finished = time.perf_counter()
+        self.iterations += 1
+        self.rollouts += rollouts
+        self.selection += selected - started
+        self.expansion += expanded - selected
+        self.simulation += simulated - expanded
+        self.backpropagation += finished - simulated
+        self.max_depth = max(self.max_depth, depth)
+        self.depth_sum += depth
+
+    def finish(self, root, pool, time_manager):
+        """
+        Records the tree and the time left once the move is chosen
+        """
+        self.seconds = time.perf_counter() - self.started
+        self.nodes = pool.in_use
+        self.root = sorted(([child.move, child.visits, child.wins / child.visits if child.visits else 0.0]
+                            for child in root.children), key=lambda entry: -entry[1])
+        self.budget = time_manager.deadline - time_manager.start_time
+        self.leftover = time_manager.leftover
+        # the time left before the hard limit of the move
+        self.slack = time_manager.hard_limit - self.seconds
+
+    def search_seconds(self):
+        return self.selection + self.expansion + self.simulation + self.backpropagation
+
+    def rollouts_per_second(self):
+        return self.rollouts / self.search_seconds() if self.rollouts else 0.0
+
+    def mean_depth(self):
+        return self.depth_sum / self.iterations if self.iterations else 0.0
+
+    def as_dict(self):
+        return {'turn': self.turn, 'seconds': self.seconds, 'iterations': self.iterations, 'rollouts': self.rollouts,
+                'rollouts_per_second': self.rollouts_per_second(),
+                'phases': {'selection': self.selection, 'expansion': self.expansion, 'simulation': self.simulation,
+                           'backpropagation': self.backpropagation},
+                'max_depth': self.max_depth, 'mean_depth': self.mean_depth(), 'nodes': self.nodes,
+                'root': self.root, 'budget': self.budget, 'leftover': self.leftover, 'slack': self.slack}
+
+
+class StatsSink:
+    """
+    Appends the statistics of every turn to a file, as a line of JSON
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a', buffering=1)
+
+    def write(self, stats: SearchStats):
+        self.file.write(json.dumps(stats.as_dict(), separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+# -------------------------------------------- Root Policy --------------------------------------------
+
+
+class SequentialHalving:
+    """
+    Splits the search of a turn between the root moves by sequential halving: every round gives each surviving move
+    an equal share of the iterations of the round, then drops the worse half of the moves by mean value, until a
+    single move is left. Below the root, the search is the usual UCT.
+    The iterations of a round are estimated from the measured iteration rate when the round starts. Before the rate
+    was ever measured, a first round samples every move once and drops none.
+    """
+
+    def __init__(self, children, time_manager):
+        self.time_manager = time_manager
+        self.children = list(children)
+        self.candidates = list(children)
+        self.eliminated = {}
+        self.round = 0
+        self.queue = []
+        self.probing = False
+
+    def next_child(self):
+        """
+        :return: the root child to search in the next iteration, or None once a single move is left
+        """
+        if not self.queue:
+            if self.round > 0 and not self.probing:
+                self.halve()
+            if len(self.candidates) <= 1:
+                return None
+            self.plan()
+        return self.queue.pop()
+
+    def plan(self):
+        count = len(self.candidates)
+        self.probing = self.time_manager.iteration_latency == 0
+        per_child = 1
+        if not self.probing:
+            rounds = math.ceil(math.log2(count))
+            per_child = max(1, self.time_manager.remaining_iterations() // (rounds * count))
+        self.queue = self.candidates * per_child
+        self.round += 1
+
+    def halve(self):
+        ranked = sorted(self.candidates, key=self.mean, reverse=True)
+        self.candidates = ranked[:math.ceil(len(ranked) / 2)]
+        for child in ranked[len(self.candidates):]:
+            self.eliminated[id(child)] = self.round
+
+    @staticmethod
+    def mean(child):
+        return child.wins / child.visits if child.visits else -math.inf
+
+    def best(self):
+        """
+        :return: the best surviving child, by mean value
+        """
+        return max(self.candidates, key=self.mean)
+
+    def statistics(self):
+        """
+        :return: per root child, its move, visits, mean value and the round in which it was dropped, or None if it
+        survived, best first
+        """
+        return [(child.move, child.visits, self.mean(child), self.eliminated.get(id(child)))
+                for child in sorted(self.children, key=lambda child: (id(child) not in self.eliminated,
+                                                                       self.eliminated.get(id(child), 0),
+                                                                       self.mean(child)), reverse=True)]
+
+
+# -------------------------------------------- Endgame Solver --------------------------------------------
+
+
+def solver_deadline(time_manager):
+    """
+    :return: the time by which the endgame solver gives up, leaving the rest of the turn to the search
+    """
+    return time_manager.start_time + SOLVER_TIME_FRACTION * (time_manager.deadline - time_manager.start_time)
+
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+
+class SolverTimeout(Exception):
+    pass
+
+
+class EndgameSolver:
+    """
+    Solves the last turns of the game exactly, by depth limited expectimax: the player maximizes and the opponent
+    minimizes the score difference, and treasure spawns and marine moves are chance layers.
+    Max and min layers prune by alpha-beta and are memoized by canonical state key, with bound flags. Chance layers are
+    searched with a full window. A spawn is skipped when no ship can still collect and deposit the spawned treasure
+    before the end of the game, as it can not change the value.
+    """
+
+    def __init__(self, initial_state, player_number, horizon=SOLVER_HORIZON):
+        self.player_number = player_number
+        self.his_number = his_number(player_number)
+        self.horizon = horizon
+        self.neighbors = get_neighbor_dict(initial_state["map"])
+        self.fleets = {player: get_my_ships(initial_state, player) for player in (PLAYER_1, PLAYER_2)}
+        self.owner = {name: ship["player"] for name, ship in initial_state["pirate_ships"].items()}
+        game_map = initial_state["map"]
+        self.islands = [(i, j) for i in range(len(game_map)) for j in range(len(game_map[0])) if game_map[i][j] == 'I']
+        # the number of actions a ship needs to score a treasure spawned on any island: sail next to it, collect,
+        # sail to the base and deposit
+        to_base = sea_distances(self.neighbors, (initial_state["base"],))
+        self.score_cost = {}
+        for cell in {cell for island in self.islands for cell in self.neighbors[island] if cell in to_base}:
+            for location, distance in sea_distances(self.neighbors, (cell,)).items():
+                cost = distance + to_base[cell] + 2
+                self.score_cost[location] = min(cost, self.score_cost.get(location, cost))
+        self.names = {PLAYER_1: PLAYER_1_NAME, PLAYER_2: PLAYER_2_NAME}
+        self.simulator = Simulator(initial_state)
+        self.table = {}
+        self.nodes = 0
+        self.deadline = 0.0
+        self.value = None
+
+    def solve(self, state, turns_to_go, deadline):
+        """
+        :param state: the state, with the player to move
+        :param turns_to_go: turns left in the game, including the current one
+        :param deadline: time.monotonic() by which the solver gives up
+        :return: the optimal move, or None if the solver did not finish in time
+        """
+        self.deadline = deadline
+        self.nodes = 0
+        self.table = {}
+        try:
+            self.value, move = self.act(copy_state(state), self.player_number, turns_to_go, -math.inf, math.inf)
+        except SolverTimeout:
+            return None
+        finally:
+            self.table = {}
+        return move
+
+    def difference(self, score):
+        return score[self.names[self.player_number]] - score[self.names[self.his_number]]
+
+    def actions(self, state, player, first=None):
+        """
+        :param first: a move to try first, the best move found by an earlier search of the same state
+        :return: the legal joint actions of the player, most promising first
+        """
+        per_ship = [get_actions_for_ship(ship, state, [], self.simulator, player, self.neighbors)
+                    for ship in self.fleets[player]]
+        actions = [action for action in joint_actions(per_ship, state) if collects_distinct(action)]
+        actions.sort(key=lambda action: (-action_heuristic(action), action))
+        if first is not None and first in actions:
+            actions.remove(first)
+            actions.insert(0, first)
+        return actions
+
+    def act(self, state, player, rounds, alpha, beta):
+        """
+        A max layer for the player and a min layer for the opponent
+        :param rounds: rounds left, including the current one
+        :return: the value of the state and the best move
+        """
+        self.nodes += 1
+        if self.nodes % SOLVER_CHECK_INTERVAL == 0 and time.monotonic() > self.deadline:
+            raise SolverTimeout()
+        key = (canonical_state_key(state), player, rounds)
+        entry = self.table.get(key)
+        first = None
+        if entry is not None:
+            value, flag, first = entry
+            if flag == EXACT or (flag == LOWER_BOUND and value >= beta) or (flag == UPPER_BOUND and value <= alpha):
+                return value, first
+
+        maximizing = player == self.player_number
+        window = alpha, beta
+        best_value = -math.inf if maximizing else math.inf
+        best_move = None
+        simulator = self.simulator
+        for action in self.actions(state, player, first):
+            simulator.state = copy_state(state)
+            simulator.score = {PLAYER_1_NAME: 0, PLAYER_2_NAME: 0}
+            simulator.apply_action(action, player)
+            reward = self.difference(simulator.score)
+            value = reward + self.spawn(simulator.state, player, rounds, alpha - reward, beta - reward)
+            if maximizing:
+                if value > best_value:
+                    best_value, best_move = value, action
+                alpha = max(alpha, value)
+            else:
+                if value < best_value:
+                    best_value, best_move = value, action
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        flag = EXACT
+        if best_value <= window[0]:
+            flag = UPPER_BOUND
+        elif best_value >= window[1]:
+            flag = LOWER_BOUND
+        self.table[key] = (best_value, flag, best_move)
+        return best_value, best_move
+
+    def spawn_matters(self, state, player, rounds):
+        """
+        :return: whether a treasure spawned after the action of the player may still be deposited
+        """
+        # actions left to every player after the spawn
+        left = {PLAYER_1: rounds - 1, PLAYER_2: rounds - 1 if player == PLAYER_2 else rounds}
+        return any(self.score_cost.get(ship["location"], math.inf) <= left[ship["player"]]
+                   for ship in state["pirate_ships"].values())
+
+    def spawn(self, state, player, rounds, alpha, beta):
+        """
+        The chance layer of a treasure spawn, after the action of a player
+        :return: the expected value
+        """
+        if len(state["treasures"]) > MAX_TREASURES or not self.islands or not self.spawn_matters(state, player,
+                                                                                                 rounds):
+            return self.end_action(state, player, rounds, alpha, beta)
+        name = next(name for name in TREASURE_NAMES if name not in state["treasures"])
+        outcomes = []
+        for island in self.islands:
+            for reward in range(MIN_REWARD, MAX_REWARD + 1):
+                outcome = copy_state(state)
+                outcome["treasures"][name] = {"location": island, "reward": reward}
+                outcomes.append(outcome)
+        probability = TREASURE_ARRIVAL_PROBABILITY / len(outcomes)
+        value = (1 - TREASURE_ARRIVAL_PROBABILITY) * self.end_action(state, player, rounds, -math.inf, math.inf)
+        for outcome in outcomes:
+            value += probability * self.end_action(outcome, player, rounds, -math.inf, math.inf)
+        return value
+
+    def end_action(self, state, player, rounds, alpha, beta):
+        """
+        Passes the turn to the second player, or ends the round with the collisions and the chance layer of the
+        marine moves
+        :return: the value
+        """
+        if player == PLAYER_1:
+            return self.act(state, PLAYER_2, rounds, alpha, beta)[0]
+        simulator = self.simulator
+        simulator.state = state
+        simulator.score = {PLAYER_1_NAME: 0, PLAYER_2_NAME: 0}
+        simulator.check_collision_with_marines()
+        penalty = self.difference(simulator.score)
+        if rounds == 1:
+            return penalty
+        marines = list(state["marine_ships"].items())
+        choices = [range(max(0, marine["index"] - 1), min(len(marine["path"]), marine["index"] + 2))
+                   for _, marine in marines]
+        if all(len(choice) == 1 for choice in choices):
+            return penalty + self.act(state, PLAYER_1, rounds - 1, alpha - penalty, beta - penalty)[0]
+        probability = 1 / math.prod(len(choice) for choice in choices)
+        value = penalty
+        for indices in itertools.product(*choices):
+            outcome = copy_state(state)
+            for (name, _), index in zip(marines, indices):
+                outcome["marine_ships"][name]["index"] = index
+            value += probability * self.act(outcome, PLAYER_1, rounds - 1, -math.inf, math.inf)[0]
+        return value
+
+
+# -------------------------------------------- Node Pool --------------------------------------------
+
+
+class NodePool:
+    """
+    A preallocated pool of tree nodes.
+    Nodes of a released subtree are recycled instead of being left to the garbage collector, and the number of
+    nodes in use is bounded by evicting the subtrees of the least visited nodes.
+    """
+
+    def __init__(self, node_class, size=POOL_SIZE, max_nodes=MAX_NODES):
+        self.node_class = node_class
+        self.max_nodes = max_nodes
+        self.free = [node_class() for _ in range(size)]
+        self.in_use = 0
+
+    def acquire(self, player_number, move=None):
+        node = self.free.pop() if self.free else self.node_class()
+        node.reset(player_number, move)
+        self.in_use += 1
+        return node
+
+    def release(self, node):
+        """
+        Returns a node and its whole subtree to the pool
+        """
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            stack.extend(current.children)
+            current.children = ()
+            current.reset(None, None)
+            self.free.append(current)
+            self.in_use -= 1
+
+    def prune(self, node):
+        """
+        Releases the subtree below a node, keeping the node itself and its statistics
+        """
+        for child in node.children:
+            self.release(child)
+        node.children = ()
+
+    def make_room(self, root, path, needed):
+        """
+        Makes sure `needed` more nodes can be used, evicting the subtrees of the least visited nodes if necessary
+        :param root: root of the tree
+        :param path: the nodes of the current selection path, which are never evicted
+        :param needed: number of nodes about to be acquired
+        :return: whether there is room for the new nodes
+        """
+        if self.in_use + needed <= self.max_nodes:
+            return True
+        protected = set(map(id, path))
+        candidates = []
+        stack = [(root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            for child in node.children:
+                if child.children:
+                    stack.append((child, depth + 1))
+                    if id(child) not in protected:
+                        candidates.append((child.visits, -depth, id(child), child))
+        # descendants never have more visits than their ancestors, and deeper nodes go first on ties,
+        # so a subtree is always pruned before the subtree that contains it
+        candidates.sort(key=lambda candidate: candidate[:3])
+        target = self.max_nodes * EVICTION_LOW_WATER - needed
+        for _, _, _, node in candidates:
+            if self.in_use <= target:
+                break
+            self.prune(node)
+        return self.in_use + needed <= self.max_nodes
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pauses the cyclic garbage collector during a search, and moves the objects alive when it starts, such as the node
+    pool, to the permanent generation so that no collection made meanwhile scans them. Both are undone when the search
+    ends. If the process already froze objects of its own, the permanent generation is left alone.
+    Trees have no reference cycles, so their nodes are still freed by reference counting.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    frozen = gc.get_freeze_count() == 0
+    if frozen:
+        gc.freeze()
+    try:
+        yield
+    finally:
+        if frozen:
+            gc.unfreeze()
+        if was_enabled:
+            gc.enable()
+
+
 class Node:
     """
-    A class for a single node
+    A class for a single node.
+    Nodes keep no parent link, so a tree has no reference cycles. Backpropagation follows the selection path.
+    Nodes keep no state either: the state of a node is regenerated by replaying the path from the root.
+    In open loop mode a node stands for a sequence of our own moves only, and its children are the moves that were
+    legal in any of the states sampled below it, each counting the visits of the parent in which it was available.
     """
 
-    def __init__(self, state, player_number, parent=None, move=None):
-        self.state = state
-        self.parent = parent
+    __slots__ = ('move', 'wins', 'visits', 'sum_squares', 'children', 'player_number', 'prior', 'availability')
+
+    def __init__(self, player_number=None, move=None):
+        self.children = ()
+        self.reset(player_number, move)
+
+    def reset(self, player_number, move):
         self.move = move
         self.wins = 0
         self.visits = 0
-        self.children = []
+        self.sum_squares = 0
         self.player_number = player_number
-        self.h = action_heuristic(move)
+        self.prior = 0
+        self.availability = 0
 
-    def add_child(self, child_state, move):
-        child = Node(child_state, self.player_number, self, move)
+    def add_child(self, move, pool):
+        child = pool.acquire(self.player_number, move)
         self.children.append(child)
         return child
 
-    def select_child(self, simulator, moves):
-        return max(self.children, key=lambda child: child.uct_value(simulator, moves))
-
-    def expand(self, actions):
-        for action in actions:
-            self.add_child(self.state, action)
+    def select_child(self, simulator, moves, exploration=None):
+        """
+        :param exploration: the PUCT exploration constant, or None for UCB1
+        """
+        if exploration is not None:
+            first_play = first_play_value(self.children)
+            scale = exploration * math.sqrt(max(1, self.visits))
+            return max(self.children, key=lambda child: child.puct_value(simulator, moves, scale, first_play))
+        return max(self.children, key=lambda child: child.uct_value(simulator, moves, self.visits))
+
+    @staticmethod
+    def select_available(children, exploration=None):
+        """
+        Open loop selection among the children legal in the current state
+        :param exploration: the PUCT exploration constant, or None for UCB1
+        """
+        if exploration is not None:
+            first_play = first_play_value(children)
+            return max(children, key=lambda child: child.available_puct_value(exploration, first_play))
+        return max(children, key=Node.available_uct_value)
+
+    def expand(self, actions, pool, priors=None):
+        if not self.children:
+            self.children = []
+        for index, action in enumerate(actions):
+            child = self.add_child(action, pool)
+            if priors is not None:
+                child.prior = priors[index]
 
     def update(self, result):
         self.visits += 1
         self.wins += result
+        self.sum_squares += result * result
+
+    def deviation(self, default):
+        """
+        :return: the standard deviation of the results of the node, or the default with less than two results
+        """
+        if self.visits < 2:
+            return default
+        mean = self.wins / self.visits
+        return math.sqrt(max(0.0, self.sum_squares / self.visits - mean * mean))
+
+    def uct_value(self, simulator, moves, parent_visits) -> float:
+        if not check_if_action_legal_better(simulator, self.move,
+                                            PLAYER_1 if self.player_number == PLAYER_1 else PLAYER_2,
+                                            moves):
+            return float('-inf')
+        if self.visits == 0:
+            return float('inf')
+        return self.wins / self.visits + math.sqrt(2 * math.log(parent_visits) / self.visits)
 
-    def uct_value(self, simulator, moves) -> float:
+    def puct_value(self, simulator, moves, scale, first_play) -> float:
+        """
+        :param scale: the exploration constant times the square root of the visits of the parent
+        :param first_play: the mean value of an unvisited child
+        """
         if not check_if_action_legal_better(simulator, self.move,
                                             PLAYER_1 if self.player_number == PLAYER_1 else PLAYER_2,
                                             moves):
             return float('-inf')
+        mean = self.wins / self.visits if self.visits else first_play
+        return mean + scale * self.prior / (1 + self.visits)
+
+    def available_uct_value(self) -> float:
+        """
+        UCB1 counting the visits of the parent in which the move was legal
+        """
         if self.visits == 0:
-            return 9999 + self.h
-        return (self.wins + self.h) / self.visits + math.sqrt(2 * math.log(self.parent.visits) / self.visits)
+            return float('inf')
+        return self.wins / self.visits + math.sqrt(2 * math.log(self.availability) / self.visits)
+
+    def available_puct_value(self, exploration, first_play) -> float:
+        mean = self.wins / self.visits if self.visits else first_play
+        return mean + exploration * math.sqrt(self.availability) * self.prior / (1 + self.visits)
 
 
 class Agent:
-    def __init__(self, initial_state, player_number):
+    def __init__(self, initial_state, player_number, prior=PRIOR_SCORER, open_loop=OPEN_LOOP, root_policy=ROOT_POLICY,
+                 opponent_model=OPPONENT_MODEL, stats=SEARCH_STATS, stats_path=None):
         self.start = time.time()
         self.ids = IDS
         self.player_number = player_number
@@ -115,141 +1138,246 @@ class Agent:
         self.his_ships = get_my_ships(initial_state, PLAYER_1 if player_number == PLAYER_2 else PLAYER_2)
         # self.actions_by_location = get_actions_by_location(initial_state, player_number)
         self.moves_by_location = get_neighbor_dict(initial_state['map'])
-        self.my_sail_actions = get_sail_actions(initial_state, player_number, self.moves_by_location)
-        self.his_sail_actions = get_sail_actions(initial_state, PLAYER_1 if player_number == PLAYER_2 else PLAYER_2
-                                                 , self.moves_by_location)
+        # the joint actions of both fleets are cached for the whole game
+        self.action_cache = ActionCache(self.moves_by_location)
+        self.rollout = RolloutEngine(initial_state)
+        self.simulator = Simulator(initial_state)
+        self.policies = {player_number: CAREFUL_POLICY, his_number(player_number): GREEDY_POLICY}
+        # the opponent model learns from the states passed to act how the opponent plays in rollouts and selection
+        self.opponent_model = None
+        if opponent_model:
+            self.opponent_model = OpponentModel(initial_state, player_number)
+            self.policies[his_number(player_number)] = RolloutPolicy(model=self.opponent_model)
         self.turn = -1
-
-    def selection(self, node: Node, simulator: Simulator, sample_agent, start_time):
+        self.time_manager = TimeManager()
+        self.pool = NodePool(Node)
+        self.root = None
+        # the moves legal in the state of the root, the only moves the root may have as children
+        self.root_moves = frozenset()
+        self.scorer = make_scorer(prior, initial_state)
+        self.exploration = None
+        self.solver = EndgameSolver(initial_state, player_number)
+        # in open loop mode the legal moves are generated on every descent instead of checking every child
+        self.open_loop = open_loop
+        assert root_policy in ROOT_POLICIES
+        self.root_policy = root_policy
+        # per root child of the last search: move, visits, mean value and the halving round that dropped it
+        self.root_statistics = []
+        # the statistics of the last turn, with stats enabled, also written to the sink of stats_path if given
+        self.stats = stats or stats_path is not None
+        self.stats_sink = StatsSink(stats_path) if stats_path is not None else None
+        self.search_stats = None
+
+    def selection(self, node: Node, simulator: Simulator, forced=None):
         """
-        Select the best child nodes
+        Select the best child nodes, the opponent moves by its rollout policy
         :param node: node to start from
         :param simulator: instance of the simulator
-        :param sample_agent: opponent agent
-        :param start_time: the start time of the time limited phase
-        :return: the best child nodes
+        :param forced: the child of the node to descend to, chosen by the root policy
+        :return: the selection path, from the given node to the best leaf, and its length in turns
         """
 
         # initialize the current node
         current_node = node
+        path = [node]
 
         turns = 0
 
         # while the current node has children
         while len(current_node.children) != 0:
-            check_time(start_time, ACTION_TIMEOUT)
             turns += 1
             # select the best child node
 
             # apply the action of the current node
             if self.player_number == PLAYER_1:
-                current_node = current_node.select_child(simulator, self.moves_by_location)
+                current_node = self.select(current_node, simulator, node, path, forced)
                 simulator.apply_action(current_node.move, self.player_number)
                 simulator.add_treasure()
-                simulator.apply_action(sample_agent.act(simulator.state), PLAYER_2)
+                simulator.apply_action(self.rollout.act(simulator.state, PLAYER_2, self.policies[PLAYER_2]), PLAYER_2)
             else:
-                simulator.apply_action(sample_agent.act(simulator.state), PLAYER_1)
+                simulator.apply_action(self.rollout.act(simulator.state, PLAYER_1, self.policies[PLAYER_1]), PLAYER_1)
                 simulator.add_treasure()
-                current_node = current_node.select_child(simulator, self.moves_by_location)
+                current_node = self.select(current_node, simulator, node, path, forced)
                 simulator.apply_action(current_node.move, self.player_number)
+            path.append(current_node)
             simulator.add_treasure()
             simulator.check_collision_with_marines()
             simulator.move_marines()
 
-        # return the current node
-        return current_node, turns
+        # return the selection path
+        return path, turns
 
-    def expansion(self, parent_node: Node, simulator: Simulator):
+    def select(self, node: Node, simulator: Simulator, root: Node, path, forced=None):
+        """
+        Selects the next move of a selection path
+        :param root: root of the tree
+        :param path: the selection path so far, protected from eviction
+        :param forced: the child of the root chosen by the root policy
+        """
+        if forced is not None and node is root:
+            return forced
+        if not self.open_loop:
+            return node.select_child(simulator, self.moves_by_location, self.exploration)
+        legal = self.get_actions(simulator)
+        if node is root:
+            # a player 2 root is reached through a sampled move of player 1, which may make moves legal, such as
+            # collecting a treasure it added, that are not legal in the real state the move is chosen for
+            legal = [move for move in legal if move in self.root_moves]
+        children = {child.move: child for child in node.children}
+        missing = [index for index, move in enumerate(legal) if move not in children]
+        if missing:
+            # moves first legal in this sample become children, unless the tree is full and other moves are legal
+            if len(missing) < len(legal) and not self.pool.make_room(root, path, len(missing)):
+                missing = ()
+            priors = self.scorer.priors(legal, simulator.state, self.player_number) \
+                if missing and self.scorer is not None else None
+            for index in missing:
+                child = node.add_child(legal[index], self.pool)
+                if priors is not None:
+                    child.prior = priors[index]
+                children[child.move] = child
+        available = [children[move] for move in legal if move in children]
+        for child in available:
+            child.availability += 1
+        return Node.select_available(available, self.exploration)
+
+    def expansion(self, path, simulator: Simulator):
         """
         Expand the parent node
         :param simulator:
-        :param parent_node: parent node
+        :param path: the selection path, ending at the parent node
         """
 
         # getting all the possible actions
         action_list = self.get_actions(simulator)
 
-        # expanding the parent node
-        parent_node.expand(action_list)
+        # expanding the parent node, if the tree is not full
+        if self.pool.make_room(path[0], path, len(action_list)):
+            priors = None
+            if self.scorer is not None:
+                priors = self.scorer.priors(action_list, simulator.state, self.player_number)
+            path[-1].expand(action_list, self.pool, priors)
 
-    def simulation(self, node, simulator: Simulator, sample_agent, turns, turns_to_go, start) -> int:
+    def simulation(self, node, simulator: Simulator, turns, turns_to_go) -> int:
         """
-        Preforms a random simulation
+        Preforms a simulation, both players follow their rollout policies
         """
+        score = self.rollout.play(simulator, turns_to_go - turns, PLAYER_1, self.policies)
+        return score[self.player_number] - score[his_number(self.player_number)]
 
-        # initialize the current node
-        current_node = node
-
-        # running the simulation
-        my_sample_agent = BetterSample(current_node.state, self.player_number, self.moves_by_location, self.my_ships
-                                       , self.my_sail_actions)
-        for i in range(turns_to_go - turns):
-            check_time(start, ACTION_TIMEOUT)
-
-            if self.player_number == PLAYER_1:
-                simulator.apply_action(my_sample_agent.act(simulator.state), self.player_number)
-                simulator.add_treasure()
-                simulator.apply_action(sample_agent.act(simulator.state), PLAYER_2)
-            else:
-                simulator.apply_action(sample_agent.act(simulator.state), PLAYER_1)
-                simulator.add_treasure()
-                simulator.apply_action(my_sample_agent.act(simulator.state), self.player_number)
-            simulator.add_treasure()
-            simulator.check_collision_with_marines()
-            simulator.move_marines()
-
-        score = simulator.get_score()
-        return (score[PLAYER_1_NAME if self.player_number == PLAYER_1 else PLAYER_2_NAME] -
-                score[PLAYER_2_NAME if self.player_number == PLAYER_1 else PLAYER_1_NAME])
-
-    def backpropagation(self, node, simulation_result):
-        while node is not None:
+    def backpropagation(self, path, simulation_result):
+        for node in reversed(path):
             node.update(simulation_result)
-            node = node.parent
 
     def act(self, state):
-        return self.mcts(state).move
+        state = own_state(state, self.initial_state)
+        if self.opponent_model is not None:
+            self.opponent_model.observe(state)
+        self.search_stats = SearchStats(self.turn + 1) if self.stats else None
+        move = self.mcts(state).move
+        self.record_stats()
+        if self.opponent_model is not None:
+            self.opponent_model.remember(state, move)
+        return move
 
     def get_actions(self, simulator):
-        actions = {}
-        collected_treasures = []
-        state = simulator.state
-        for ship in self.my_ships:
-            actions[ship] = get_actions_for_ship(ship, state, collected_treasures, simulator, self.player_number,
-                                                 self.moves_by_location)
-        all_combinations = list(itertools.product(*actions.values()))
-        return all_combinations
+        return self.action_cache.actions(simulator.state, self.my_ships)
+
+    def record_stats(self):
+        if self.search_stats is not None:
+            self.search_stats.finish(self.root, self.pool, self.time_manager)
+            if self.stats_sink is not None:
+                self.stats_sink.write(self.search_stats)
 
     def mcts(self, state) -> Node:
-        start = time.time()
-        root = Node(state, self.player_number)
+        # the tree of the previous turn is recycled
+        if self.root is not None:
+            self.pool.release(self.root)
+        root = self.root = self.pool.acquire(self.player_number)
         turns_to_go = state["turns to go"] // 2
         self.turn += 1
         turns_to_go = turns_to_go - self.turn
         # print(turns_to_go)
-        count_simulations = 0
-        try:
+
+        # a single simulator, made once per game, is reset to the root state before every iteration
+        simulator = self.simulator
+        reset_simulator(simulator, state)
+
+        # forced and trivial turns get little or no search time
+        root_actions = self.get_actions(simulator)
+        self.root_moves = frozenset(root_actions)
+        budget = self.time_manager.allocate(turns_to_go, len(root_actions), is_critical_state(state, self.my_ships))
+        self.time_manager.start(budget)
+        if budget == 0:
+            self.time_manager.finish()
+            root.expand(root_actions, self.pool)
+            return root.children[0]
+        # the last turns are solved exactly, or searched as usual if the solver does not finish in time
+        move = self.solver.solve(state, turns_to_go, solver_deadline(self.time_manager)) \
+            if turns_to_go <= self.solver.horizon else None
+        if move is not None:
+            self.time_manager.finish()
+            root.expand([move], self.pool)
+            return root.children[0]
+
+        min_result, max_result = math.inf, -math.inf
+        self.exploration = exploration_constant(0, 0) if self.scorer is not None else None
+        halving = None
+        if self.root_policy == 'halving':
+            self.expansion([root], simulator)
+            halving = SequentialHalving(root.children, self.time_manager)
+        stats = self.search_stats
+        with paused_gc():
             while True:
-                check_time(start, ACTION_TIMEOUT)
-                simulator = Simulator(state)
-                sample_agent = MySampleAgent(state, PLAYER_1 if self.player_number == PLAYER_2 else PLAYER_2,
-                                             self.moves_by_location, self.his_ships, self.his_sail_actions,
-                                             )
-                check_time(start, ACTION_TIMEOUT)
-                node, turns = self.selection(root, simulator, sample_agent, start)
+                if stats is not None:
+                    started = time.perf_counter()
+                reset_simulator(simulator, state)
+                forced = None
+                if halving is not None:
+                    forced = halving.next_child()
+                    if forced is None:
+                        break
+                path, turns = self.selection(root, simulator, forced)
                 if turns >= turns_to_go:
                     break
-                self.expansion(node, simulator)
-                result = self.simulation(node, simulator, sample_agent, turns, turns_to_go, start)
-                self.backpropagation(node, result)
-                count_simulations += 1
-        except TimeoutError:
-            pass
-        # print(f'count_simulations: {count_simulations}')
+                if stats is not None:
+                    selected = time.perf_counter()
+                self.expansion(path, simulator)
+                if stats is not None:
+                    expanded = time.perf_counter()
+                result = self.simulation(path[-1], simulator, turns, turns_to_go)
+                if stats is not None:
+                    simulated = time.perf_counter()
+                self.backpropagation(path, result)
+                if stats is not None:
+                    stats.iteration(started, selected, expanded, simulated, len(path) - 1)
+                if not min_result <= result <= max_result:
+                    min_result, max_result = min(min_result, result), max(max_result, result)
+                    if self.scorer is not None:
+                        self.exploration = exploration_constant(min_result, max_result)
+                if not self.time_manager.keep_searching():
+                    # spending the rest of the hard limit only when the best moves are too close to tell apart
+                    if halving is not None or not (root_values_close(root.children) and self.time_manager.extend()):
+                        break
+                elif halving is None and self.time_manager.checked and \
+                        decision_settled(root.children, self.time_manager.remaining_iterations(),
+                                         max_result - min_result):
+                    break
+        # the time left is carried over to later turns
+        self.time_manager.finish()
 
         if len(root.children) == 0:
             return root
 
+        if halving is not None:
+            self.root_statistics = halving.statistics()
+            if self.scorer is not None:
+                self.scorer.learn(root.children, state, self.player_number)
+            return halving.best()
+        if self.scorer is not None:
+            self.scorer.learn(root.children, state, self.player_number)
+            # with priors, children with few visits have unreliable means
+            return max(root.children, key=lambda child: child.visits)
         return max(root.children,
                    key=lambda child: child.wins / child.visits if child.visits > 0 else 0)
 
@@ -257,43 +1385,190 @@ class Agent:
 # -------------------------------------------- UCT Node ------------------------------------------------------------
 
 
-class UCTNode:
-    """
-    A class for a single node
-    """
+class UCTNode:
+    """
+    A class for a single node.
+    Nodes keep no parent link, so a tree has no reference cycles. Backpropagation follows the selection path.
+    Nodes keep no state either: in open loop mode the children of a node are shared by all the states reached
+    by replaying its path, and in closed loop mode every child is tagged with the key of the state it was expanded in.
+    With RAVE, an expanded node also keeps all-moves-as-first statistics of the atomic ship actions of its children,
+    in arrays indexed by slot, and every child keeps the slots of the atomic actions of its move.
+    """
+
+    __slots__ = ('move', 'wins', 'visits', 'sum_squares', 'children', 'player_number', 'key', 'prior',
+                 'atoms', 'amaf_ids', 'amaf_wins', 'amaf_visits')
+
+    def __init__(self, player_number=None, move=None):
+        self.children = ()
+        self.reset(player_number, move)
+
+    def reset(self, player_number, move, key=None):
+        self.move = move
+        self.wins = 0
+        self.visits = 0
+        self.sum_squares = 0
+        self.player_number = player_number
+        self.key = key
+        self.prior = 0
+        self.atoms = ()
+        self.amaf_ids = None
+
+    @property
+    def his_number(self):
+        return his_number(self.player_number)
+
+    def add_child(self, move, pool, key=None):
+        child = pool.acquire(self.his_number, move)
+        child.key = key
+        self.children.append(child)
+        return child
+
+    def children_for(self, key):
+        """
+        :param key: key of the current state in closed loop mode, None in open loop mode
+        :return: the children that apply to the current state
+        """
+        if key is None:
+            return self.children
+        return [child for child in self.children if child.key == key]
+
+    def select_child(self, simulator, moves, children=None, exploration=None):
+        """
+        :param children: the children that apply to the current state, all of them by default
+        :param exploration: the PUCT exploration constant, or None for UCB1
+        """
+        if children is None:
+            children, visits = self.children, self.visits
+        else:
+            visits = sum(child.visits for child in children)
+        if exploration is not None:
+            first_play = first_play_value(children)
+            scale = exploration * math.sqrt(max(1, visits))
+            return max(children, key=lambda child: child.puct_value(simulator, moves, scale, first_play, self))
+        if self.amaf_ids is not None:
+            return max(children, key=lambda child: child.rave_value(simulator, moves, visits, self))
+        return max(children, key=lambda child: child.uct_value(simulator, moves, visits))
+
+    def expand(self, actions, pool, key=None, atoms=None, priors=None):
+        """
+        :param atoms: the atomic action ids of every action, to keep RAVE statistics
+        :param priors: the prior probability of every action
+        """
+        if not self.children:
+            self.children = []
+        if atoms is not None and self.amaf_ids is None:
+            self.amaf_ids = array('l')
+            self.amaf_wins = array('d')
+            self.amaf_visits = array('l')
+        for index, action in enumerate(actions):
+            child = self.add_child(action, pool, key)
+            if priors is not None:
+                child.prior = priors[index]
+            if atoms is not None:
+                child.atoms = tuple(self.amaf_slot(atom) for atom in atoms[index])
+
+    def amaf_slot(self, atom):
+        """
+        :return: the slot of an atomic action id in the RAVE arrays, added if new
+        """
+        try:
+            return self.amaf_ids.index(atom)
+        except ValueError:
+            self.amaf_ids.append(atom)
+            self.amaf_wins.append(0)
+            self.amaf_visits.append(0)
+            return len(self.amaf_ids) - 1
+
+    def update_amaf(self, seen, result, count=1):
+        """
+        Updates the RAVE statistics of the atomic actions played later in the iteration by the player to move
+        :param seen: the atomic action ids played by the player to move
+        :param result: the sum of the results, from the perspective of the player to move
+        :param count: the number of results
+        """
+        amaf_wins = self.amaf_wins
+        amaf_visits = self.amaf_visits
+        for slot, atom in enumerate(self.amaf_ids):
+            if atom in seen:
+                amaf_wins[slot] += result
+                amaf_visits[slot] += count
+
+    def update(self, result, count=1, squares=None):
+        """
+        :param result: the sum of the results
+        :param count: the number of results
+        :param squares: the sum of the squares of the results, if there are several
+        """
+        self.visits += count
+        self.wins += result
+        self.sum_squares += result * result if squares is None else squares
+
+    def deviation(self, default):
+        """
+        :return: the standard deviation of the results of the node, or the default with less than two results
+        """
+        if self.visits < 2:
+            return default
+        mean = self.wins / self.visits
+        return math.sqrt(max(0.0, self.sum_squares / self.visits - mean * mean))
 
-    def __init__(self, state, player_number, parent=None, move=None):
-        self.state = state
-        self.parent = parent
-        self.move = move
-        self.wins = 0
-        self.visits = 0
-        self.children = []
-        self.player_number = player_number
-        self.his_number = his_number(player_number)
+    def select_option(self, exploration):
+        """
+        Selects a child by UCB1, for macro options, which are checked when they are followed
+        :param exploration: the exploration constant
+        """
+        visits = self.visits
+        return max(self.children, key=lambda child: child.ucb_value(visits, exploration))
 
-    def add_child(self, child_state, move):
-        child = UCTNode(child_state, self.his_number, self, move)
-        self.children.append(child)
-        return child
+    def ucb_value(self, parent_visits, exploration) -> float:
+        if self.visits == 0:
+            return float('inf')
+        return self.wins / self.visits + exploration * math.sqrt(2 * math.log(parent_visits) / self.visits)
 
-    def select_child(self, simulator, moves):
-        return max(self.children, key=lambda child: child.uct_value(simulator, moves))
+    def uct_value(self, simulator, moves, parent_visits) -> float:
+        if not check_if_action_legal(simulator, self.move, self.his_number, moves):
+            return float('-inf')
+        if self.visits == 0:
+            return float('inf')
+        return self.wins / self.visits + math.sqrt(2 * math.log(parent_visits) / self.visits)
 
-    def expand(self, actions):
-        for action in actions:
-            self.add_child(self.state, action)
+    def mean(self, parent, first_play):
+        """
+        :param first_play: the mean of the child if it is unvisited
+        :return: the mean value of the child, blended with the RAVE mean of the atomic actions of its move
+        with a weight that decays as the child gets visits
+        """
+        mean = self.wins / self.visits if self.visits else first_play
+        if parent.amaf_ids is None:
+            return mean
+        amaf_visits = sum(parent.amaf_visits[slot] for slot in self.atoms)
+        if amaf_visits == 0:
+            return mean
+        amaf_mean = sum(parent.amaf_wins[slot] for slot in self.atoms) / amaf_visits
+        if self.visits == 0:
+            return amaf_mean
+        beta = math.sqrt(RAVE_EQUIVALENCE / (3 * self.visits + RAVE_EQUIVALENCE))
+        return (1 - beta) * mean + beta * amaf_mean
 
-    def update(self, result):
-        self.visits += 1
-        self.wins += result
+    def rave_value(self, simulator, moves, parent_visits, parent) -> float:
+        """
+        UCT value with the mean blended with the RAVE mean
+        """
+        if self.visits == 0 and sum(parent.amaf_visits[slot] for slot in self.atoms) == 0:
+            return self.uct_value(simulator, moves, parent_visits)
+        if not check_if_action_legal(simulator, self.move, self.his_number, moves):
+            return float('-inf')
+        # an unvisited child is valued by its RAVE mean alone, as if visited once
+        return self.mean(parent, 0) + math.sqrt(2 * math.log(max(parent_visits, 1)) / max(self.visits, 1))
 
-    def uct_value(self, simulator, moves) -> float:
+    def puct_value(self, simulator, moves, scale, first_play, parent) -> float:
+        """
+        :param scale: the exploration constant times the square root of the visits of the parent
+        :param first_play: the mean value of an unvisited child
+        """
         if not check_if_action_legal(simulator, self.move, self.his_number, moves):
             return float('-inf')
-        if self.visits == 0:
-            return float('inf')
-        return self.wins / self.visits + math.sqrt(2 * math.log(self.parent.visits) / self.visits)
+        return self.mean(parent, first_play) + scale * self.prior / (1 + self.visits)
 
 
 class UCTTree:
@@ -375,6 +1650,140 @@ def get_actions_by_location(state, player_number, neighbors_dict):
     return actions_by_location
 
 
+def ship_signature(state, name):
+    """
+    :return: what makes ships interchangeable: the player, the location, the capacity and the carried rewards
+    """
+    ship = state["pirate_ships"][name]
+    carried = sorted(treasure["reward"] for treasure in state["treasures"].values() if treasure["location"] == name)
+    return ship["player"], ship["location"], ship["capacity"], tuple(carried)
+
+
+def action_descriptor(atomic_action, state):
+    """
+    :return: the atomic action without the name of its ship, and with the reward of a deposited treasure instead of
+    its name
+    """
+    if atomic_action[0] == 'wait':
+        return 'wait',
+    if atomic_action[0] == 'deposit':
+        return 'deposit', state["treasures"][atomic_action[2]]["reward"]
+    return atomic_action[0], atomic_action[2]
+
+
+def joint_actions(per_ship, state):
+    """
+    Combines the actions of the ships of a player, keeping one joint action of every class of joint actions that
+    lead to states equal up to the names of the ships and treasures: interchangeable ships swapping their actions,
+    and a ship depositing one of several treasures with the same reward
+    :param per_ship: the actions of every ship of the player
+    :return: the joint actions
+    """
+    per_ship = [list(actions) for actions in per_ship]
+    signatures = [ship_signature(state, actions[0][1]) for actions in per_ship]
+    groups = [[position for position, signature in enumerate(signatures) if signature == group_signature]
+              for group_signature in dict.fromkeys(signatures)]
+    # without interchangeable ships or carried treasures of the same reward, all the joint actions are different
+    if len(groups) == len(signatures) and all(len(set(signature[3])) == len(signature[3]) for signature in signatures):
+        return list(itertools.product(*per_ship))
+    options = []
+    for actions in per_ship:
+        unique = {}
+        for atomic_action in actions:
+            unique.setdefault(action_descriptor(atomic_action, state), atomic_action)
+        options.append(list(unique.items()))
+    seen = set()
+    actions = []
+    for combination in itertools.product(*options):
+        key = tuple(tuple(sorted(combination[position][0] for position in group)) for group in groups)
+        if key not in seen:
+            seen.add(key)
+            actions.append(tuple(atomic_action for _, atomic_action in combination))
+    return actions
+
+
+class ActionCache:
+    """
+    An LRU cache of the joint actions of a fleet.
+    The joint actions only depend on the location and capacity of every ship of the fleet, the treasures it carries,
+    the treasures it can collect and the enemy ships it can plunder, so they are cached by a compact key of exactly
+    these, and the entries stay valid from turn to turn.
+    """
+
+    def __init__(self, neighbors, size=ACTION_CACHE_SIZE):
+        self.neighbors = neighbors
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, state, ships):
+        """
+        :param ships: the names of the ships of the fleet
+        :return: per ship, its location, capacity, the rewards of the treasures it carries, with their names at the
+        base, the names of the treasures next to it and the names of the enemy ships at its location
+        """
+        pirate_ships = state["pirate_ships"]
+        carried = {}
+        free = []
+        for name, treasure in state["treasures"].items():
+            location = treasure["location"]
+            if type(location) == str:
+                carried.setdefault(location, []).append((name, treasure["reward"]))
+            else:
+                free.append((name, location))
+        player = pirate_ships[ships[0]]["player"]
+        base = state["base"]
+        key = []
+        for ship in ships:
+            location = pirate_ships[ship]["location"]
+            capacity = pirate_ships[ship]["capacity"]
+            cargo = sorted(carried.get(ship, ()))
+            # away from the base, the names of the carried treasures do not appear in any action
+            if location != base:
+                cargo = sorted(reward for _, reward in cargo)
+            key.append((location, capacity, tuple(cargo),
+                        tuple(sorted(name for name, treasure_location in free
+                                     if capacity > 0 and location in self.neighbors[treasure_location])),
+                        tuple(sorted(name for name, enemy in pirate_ships.items()
+                                     if enemy["location"] == location and enemy["player"] != player))))
+        return player, tuple(key)
+
+    def actions(self, state, ships):
+        """
+        :return: the joint actions of the fleet, shared with the cache and not to be modified
+        """
+        key = self.key(state, ships)
+        entries = self.entries
+        actions = entries.get(key)
+        if actions is not None:
+            self.hits += 1
+            entries.move_to_end(key)
+            return actions
+        self.misses += 1
+        player = key[0]
+        # two ships can not collect the same treasure, so such joint actions are never legal
+        actions = [action for action in joint_actions([get_actions_for_ship(ship, state, [], None, player,
+                                                                            self.neighbors) for ship in ships], state)
+                   if collects_distinct(action)]
+        entries[key] = actions
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+        return actions
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def collects_distinct(action):
+    """
+    :return: whether no two ships of the joint action collect the same treasure
+    """
+    collected = [atomic_action[2] for atomic_action in action if atomic_action[0] == 'collect']
+    return len(collected) == len(set(collected))
+
+
 def get_neighbor_dict(map):
     neighbors = dict()
     for i in range(len(map)):
@@ -388,25 +1797,141 @@ def get_neighbor_dict(map):
     return neighbors
 
 
-def get_sail_actions(state, player, neighbors):
-    sail_actions = {}
-    map = state["map"]
-    for ship_name, ship in state["pirate_ships"].items():
-        if ship["player"] == player:
-            for i in range(len(map)):
-                for j in range(len(map[0])):
-                    if map[i][j] != 'I':
-                        sail_actions[(ship_name, (i, j))] = [('sail', ship_name, neighbor)
-                                                             for neighbor in neighbors[(i, j)]]
-    return sail_actions
-
-
 def his_number(number):
     return PLAYER_1 if number == PLAYER_2 else PLAYER_2
 
 
+def is_macro(move):
+    """
+    :return: whether a joint move is made of macro options rather than of actions of the simulator
+    """
+    return bool(move) and move[0][0] in MACRO_KINDS
+
+
+class MacroOptions:
+    """
+    Path following options of a ship, on top of the actions of the simulator:
+    ('to_treasure', ship, treasure) sails next to a free treasure and collects it,
+    ('to_base', ship) sails to the base and deposits the carried treasures,
+    ('intercept', ship, enemy) sails to a loaded enemy ship and plunders it,
+    ('hold', ship) waits.
+    Ships follow shortest paths by sea, and keep off the cells marines may reach next when another shortest step
+    or waiting allows it.
+    """
+
+    def __init__(self, initial_state):
+        self.neighbors = get_neighbor_dict(initial_state["map"])
+        self.base = initial_state["base"]
+        self.tables = {}
+
+    def distances(self, sources):
+        sources = tuple(sources)
+        if sources not in self.tables:
+            self.tables[sources] = sea_distances(self.neighbors, sources)
+        return self.tables[sources]
+
+    def options(self, state, player, ships):
+        """
+        :param ships: the ships of the player
+        :return: the joint options of the player, no two ships going to the same treasure
+        """
+        per_ship = []
+        for name in ships:
+            ship = state["pirate_ships"][name]
+            options = [('hold', name)]
+            if any(treasure["location"] == name for treasure in state["treasures"].values()):
+                options.append(('to_base', name))
+            if ship["capacity"] > 0:
+                free = [(self.distances(self.neighbors[treasure["location"]]).get(ship["location"], math.inf), treasure_name)
+                        for treasure_name, treasure in state["treasures"].items() if type(treasure["location"]) != str]
+                options += [('to_treasure', name, treasure_name)
+                            for distance, treasure_name in sorted(free)[:MACRO_TREASURES] if distance < math.inf]
+            loaded = {treasure["location"] for treasure in state["treasures"].values()}
+            options += [('intercept', name, enemy_name) for enemy_name, enemy in state["pirate_ships"].items()
+                        if enemy["player"] != player and enemy_name in loaded]
+            per_ship.append(options)
+        joint = []
+        for combination in itertools.product(*per_ship):
+            targets = [option[2] for option in combination if option[0] == 'to_treasure']
+            if len(targets) == len(set(targets)):
+                joint.append(combination)
+        return joint
+
+    def step(self, state, option, avoid):
+        """
+        :param option: the option of a ship
+        :param avoid: the cells marines may reach next
+        :return: the action of the ship and whether it completes the option, or None if the option no longer applies
+        """
+        name = option[1]
+        ship = state["pirate_ships"][name]
+        location = ship["location"]
+        if option[0] == 'hold':
+            return ('wait', name), False
+        if option[0] == 'to_base':
+            carried = [treasure_name for treasure_name, treasure in state["treasures"].items()
+                       if treasure["location"] == name]
+            if not carried:
+                return None
+            if location == self.base:
+                return ('deposit', name, carried[0]), len(carried) == 1
+            return self.sail(name, location, self.distances((self.base,)), avoid)
+        if option[0] == 'to_treasure':
+            treasure = state["treasures"].get(option[2])
+            if treasure is None or type(treasure["location"]) == str or ship["capacity"] <= 0:
+                return None
+            if location in self.neighbors[treasure["location"]]:
+                return ('collect', name, option[2]), True
+            return self.sail(name, location, self.distances(self.neighbors[treasure["location"]]), avoid)
+        enemy = state["pirate_ships"][option[2]]
+        if not any(treasure["location"] == option[2] for treasure in state["treasures"].values()):
+            return None
+        if enemy["location"] == location:
+            return ('plunder', name, option[2]), True
+        return self.sail(name, location, self.distances((enemy["location"],)), avoid)
+
+    def sail(self, name, location, distances, avoid):
+        """
+        :return: the next step of a ship on a shortest path to the cells of the distance table, or None if there
+        is no path
+        """
+        if location not in distances:
+            return None
+        closer = [cell for cell in self.neighbors[location] if distances.get(cell, math.inf) < distances[location]]
+        safe = [cell for cell in closer if cell not in avoid]
+        if safe:
+            return ('sail', name, safe[0]), False
+        if location not in avoid or not closer:
+            return ('wait', name), False
+        return ('sail', name, closer[0]), False
+
+    def first_action(self, state, joint_option):
+        """
+        :return: the joint action that starts a joint option, waiting for the options that no longer apply
+        """
+        avoid = marine_reach(state)
+        action = []
+        for option in joint_option:
+            step = self.step(state, option, avoid)
+            action.append(step[0] if step is not None else ('wait', option[1]))
+        return tuple(action)
+
+
+def marine_reach(state):
+    """
+    :return: the cells the marines may reach on their next move
+    """
+    cells = set()
+    for marine in state["marine_ships"].values():
+        path, index = marine["path"], marine["index"]
+        cells.update(path[max(0, index - 1):index + 2])
+    return cells
+
+
 class UCTAgent:
-    def __init__(self, initial_state, player_number):
+    def __init__(self, initial_state, player_number, closed_loop=CLOSED_LOOP, rave=RAVE, prior=PRIOR_SCORER,
+                 batch=BATCH_ROLLOUTS, macro=MACRO_ACTIONS, root_policy=ROOT_POLICY, opponent_model=OPPONENT_MODEL,
+                 ponder=PONDER, stats=SEARCH_STATS, stats_path=None):
         self.start = time.time()
         self.ids = IDS
         self.player_number = player_number
@@ -415,140 +1940,487 @@ class UCTAgent:
         self.my_ships = get_my_ships(initial_state, player_number)
         self.his_ships = get_my_ships(initial_state, self.his_number)
         self.moves_by_location = get_neighbor_dict(initial_state['map'])
-        self.my_sail_actions = get_sail_actions(initial_state, player_number, self.moves_by_location)
-        self.his_sail_actions = get_sail_actions(initial_state, self.his_number, self.moves_by_location)
+        # the joint actions of both fleets are cached for the whole game
+        self.action_cache = ActionCache(self.moves_by_location)
         self.turn = -1
+        self.time_manager = TimeManager()
+        self.pool = NodePool(UCTNode)
+        self.root = None
+        self.closed_loop = closed_loop
+        self.rave = rave
+        self.scorer = make_scorer(prior, initial_state)
+        self.exploration = None
+        self.solver = EndgameSolver(initial_state, player_number)
+        self.rollout = RolloutEngine(initial_state)
+        self.simulator = Simulator(initial_state)
+        self.policies = {PLAYER_1: RANDOM_POLICY, PLAYER_2: RANDOM_POLICY}
+        # the opponent model learns from the states passed to act how the opponent plays in rollouts
+        self.opponent_model = None
+        if opponent_model:
+            self.opponent_model = OpponentModel(initial_state, player_number)
+            self.policies[self.his_number] = RolloutPolicy(model=self.opponent_model)
+        # with batches, every new leaf is evaluated by several rollouts
+        self.batch = self.batch_sizer = None
+        if batch:
+            self.batch = BatchRolloutEngine(self.rollout)
+            self.batch.calibrate(Simulator(initial_state))
+            self.batch_sizer = BatchSizer()
+        # with macro actions, the tree is searched over joint options that last several turns
+        self.macros = MacroOptions(initial_state) if macro else None
+        assert root_policy in ROOT_POLICIES
+        self.root_policy = root_policy
+        # per root child of the last search: move, visits, mean value and the halving round that dropped it
+        self.root_statistics = []
+        # with pondering, a worker process searches the answers to the opponent replies while the opponent thinks,
+        # and the search of the next turn starts from the statistics of the answers to the reply actually played
+        assert not (ponder and macro), 'pondering searches primitive moves only'
+        self.ponderer = None
+        self.pondered = None
+        if ponder:
+            self.ponderer = Ponderer(initial_state, player_number,
+                                     dict(closed_loop=closed_loop, rave=rave, prior=prior, batch=batch,
+                                          root_policy=root_policy, opponent_model=opponent_model))
+        # the statistics of the last turn, with stats enabled, also written to the sink of stats_path if given
+        self.stats = stats or stats_path is not None
+        self.stats_sink = StatsSink(stats_path) if stats_path is not None else None
+        self.search_stats = None
+
+    def selection(self, node: UCTNode, simulator: Simulator, player, path, forced=None):
+        """
+        Select the best leaf, appending the visited nodes to the path
+        :param forced: the child of the node to descend to, chosen by the root policy
+        :return: the leaf, the number of turns played to reach it, and the player to move at the leaf
+        """
 
-    def selection(self, node: UCTNode, simulator: Simulator, start_time, player):
+        path.append(node)
 
-        check_time(start_time, ACTION_TIMEOUT)
+        # in closed loop mode only the children expanded in the current state apply
+        children = node.children_for(state_key(simulator.state) if self.closed_loop else None)
 
         # base of recursion
-        if len(node.children) == 0:
+        if len(children) == 0:
             return node, 0, player
 
         # selecting next node (action)
-        current_node = node
-        current_node = current_node.select_child(simulator, self.moves_by_location)
+        current_node = forced if forced is not None else \
+            node.select_child(simulator, self.moves_by_location, children, self.exploration)
 
         # applying the action
         simulator.apply_action(current_node.move, player)
         simulator.add_treasure()
 
         if player == 1:
-            rec_result = self.selection(current_node, simulator, start_time, 2)
+            rec_result = self.selection(current_node, simulator, 2, path)
             return rec_result[0], rec_result[1] + 1, rec_result[2]
 
         simulator.check_collision_with_marines()
         simulator.move_marines()
-        return self.selection(current_node, simulator, start_time, 1)
+        return self.selection(current_node, simulator, 1, path)
 
-    def expansion(self, parent_node: UCTNode, simulator: Simulator, player):
+    def expansion(self, path, simulator: Simulator, player):
         """
         Expand the parent node
         :param simulator:
-        :param parent_node: parent node
+        :param path: the selection path, ending at the parent node
         """
 
         # getting all the possible actions
         action_list = self.get_actions(simulator, player)
 
-        # expanding the parent node
-        parent_node.expand(action_list)
-
-    def simulation(self, node, simulator: Simulator, sample_agent, my_sample_agent, turns_to_go, start,
-                   player) -> int:
-        if turns_to_go == 0:
-            score = simulator.score
-            return (score[PLAYER_1_NAME if self.player_number == PLAYER_1 else PLAYER_2_NAME] -
-                    score[PLAYER_2_NAME if self.player_number == PLAYER_1 else PLAYER_1_NAME])
+        # expanding the parent node, if the tree is not full
+        if self.pool.make_room(path[0], path, len(action_list)):
+            atoms = priors = None
+            if self.rave:
+                atoms = [[self.rollout.atom(atomic_action, simulator.state) for atomic_action in action]
+                         for action in action_list]
+            if self.scorer is not None:
+                priors = self.scorer.priors(action_list, simulator.state, player)
+            path[-1].expand(action_list, self.pool, state_key(simulator.state) if self.closed_loop else None, atoms,
+                            priors)
+
+    def simulation(self, node, simulator: Simulator, turns_to_go, player, seen=None) -> int:
+        """
+        :param seen: with RAVE, the sets of atomic action ids played by every player, filled by the rollout
+        """
+        score = self.rollout.play(simulator, turns_to_go, player, self.policies, seen)
+        return score[self.player_number] - score[self.his_number]
 
-        check_time(start, ACTION_TIMEOUT)
-        if player == self.player_number:
-            simulator.apply_action(my_sample_agent.act(simulator.state), self.player_number)
-        else:
-            simulator.apply_action(sample_agent.act(simulator.state), PLAYER_1 if self.player_number == PLAYER_2
-            else PLAYER_2)
-        simulator.add_treasure()
-        if player == 1:
-            return self.simulation(node, simulator, sample_agent, my_sample_agent, turns_to_go, start, 2)
-        simulator.check_collision_with_marines()
-        simulator.move_marines()
-        return self.simulation(node, simulator, sample_agent, my_sample_agent, turns_to_go - 1, start, 1)
+    def batch_simulation(self, simulator: Simulator, turns_to_go, player, rollouts):
+        """
+        :return: the sum, the sum of squares, the minimum and the maximum of the results of the rollouts
+        """
+        return self.batch.moments(simulator, turns_to_go, player, rollouts, self.player_number)
 
-    def backpropagation(self, node, simulation_result):
-        while node is not None:
+    def backpropagation(self, path, simulation_result, seen=None, count=1, squares=None):
+        """
+        :param simulation_result: the sum of the results of the rollouts
+        :param seen: with RAVE, the sets of atomic action ids played by every player in the rollout
+        :param count: the number of rollouts
+        :param squares: the sum of the squares of the results, if there are several rollouts
+        """
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
             prod = 1
             if node.player_number == self.player_number:
                 prod = -1
-            node.update(simulation_result * prod)
-            node = node.parent
+            node.update(simulation_result * prod, count, squares)
+            if seen is not None and node.amaf_ids is not None:
+                # the move played from the node counts as played later too
+                if depth + 1 < len(path):
+                    seen[node.player_number].update(node.amaf_ids[slot] for slot in path[depth + 1].atoms)
+                node.update_amaf(seen[node.player_number], -simulation_result * prod, count)
 
     def act(self, state):
-        return self.mcts(state).move
+        state = own_state(state, self.initial_state)
+        if self.opponent_model is not None:
+            self.opponent_model.observe(state)
+        if self.ponderer is not None:
+            answers = self.ponderer.collect()
+            self.pondered = answers.get(ships_key(state)) if answers else None
+        self.search_stats = SearchStats(self.turn + 1) if self.stats else None
+        move = self.mcts(state).move
+        self.record_stats()
+        if is_macro(move):
+            move = self.macros.first_action(state, move)
+        if self.opponent_model is not None:
+            self.opponent_model.remember(state, move)
+        turns_to_go = state["turns to go"] // 2 - self.turn
+        if self.ponderer is not None and turns_to_go > 1:
+            self.ponderer.start(state, move, turns_to_go)
+        return move
 
     def get_actions(self, simulator, player):
-
-        actions = {}
-        collected_treasures = []
-        state = simulator.state
-
         ships = self.my_ships if player == self.player_number else self.his_ships
+        return self.action_cache.actions(simulator.state, ships)
 
-        for ship in ships:
-            actions[ship] = get_actions_for_ship(ship, state, collected_treasures, simulator, player,
-                                                 self.moves_by_location)
-        all_combinations = list(itertools.product(*actions.values()))
-        return all_combinations
+    def record_stats(self):
+        if self.search_stats is not None:
+            self.search_stats.finish(self.root, self.pool, self.time_manager)
+            if self.stats_sink is not None:
+                self.stats_sink.write(self.search_stats)
 
     def mcts(self, state) -> UCTNode:
 
-        start = time.time()
-
-        root = UCTNode(state, self.player_number)
+        # the tree of the previous turn is recycled
+        if self.root is not None:
+            self.pool.release(self.root)
+        root = self.root = self.pool.acquire(self.player_number)
 
         turns_to_go = state["turns to go"] // 2
         self.turn += 1
         turns_to_go = turns_to_go - self.turn
 
-        count_simulations = 0
+        # a single simulator, made once per game, is reset to the root state before every iteration
+        simulator = self.simulator
+        reset_simulator(simulator, state)
+
+        # forced and trivial turns get little or no search time
+        root_actions = self.get_actions(simulator, self.player_number)
+        budget = self.time_manager.allocate(turns_to_go, len(root_actions), is_critical_state(state, self.my_ships))
+        self.time_manager.start(budget)
+        if budget == 0:
+            self.time_manager.finish()
+            root.expand(root_actions, self.pool, state_key(state) if self.closed_loop else None)
+            return root.children[0]
+        # the last turns are solved exactly, or searched as usual if the solver does not finish in time
+        move = self.solver.solve(state, turns_to_go, solver_deadline(self.time_manager)) \
+            if turns_to_go <= self.solver.horizon else None
+        if move is not None:
+            self.time_manager.finish()
+            root.expand([move], self.pool)
+            return root.children[0]
+
+        with paused_gc():
+            if self.macros is not None:
+                return self.macro_search(root, state, simulator, turns_to_go)
+            return self.search(root, state, simulator, turns_to_go)
+
+    def search(self, root, state, simulator, turns_to_go) -> UCTNode:
+        """
+        Runs MCTS iterations from the root until the time manager stops the search
+        :return: the best child of the root
+        """
 
-        try:
-            while True:
+        min_result, max_result = math.inf, -math.inf
+        self.exploration = exploration_constant(0, 0) if self.scorer is not None else None
+        stats = self.search_stats
+
+        pondered, self.pondered = self.pondered, None
+        if self.root_policy == 'halving' or pondered:
+            self.expansion([root], simulator, self.player_number)
+        if pondered:
+            self.reuse_pondered(root, pondered)
+        halving = None
+        if self.root_policy == 'halving':
+            halving = SequentialHalving(root.children, self.time_manager)
+
+        while True:
+
+            started = time.perf_counter()
+            reset_simulator(simulator, state)
 
-                check_time(start, ACTION_TIMEOUT)
+            forced = None
+            if halving is not None:
+                forced = halving.next_child()
+                if forced is None:
+                    break
+
+            path = []
+            node, turns, player = self.selection(root, simulator, self.player_number, path, forced)
+
+            if turns >= turns_to_go:
+                break
+            if stats is not None:
+                selected = time.perf_counter()
+
+            self.expansion(path, simulator, player)
+            if stats is not None:
+                expanded = time.perf_counter()
+
+            seen = {PLAYER_1: set(), PLAYER_2: set()} if self.rave else None
+            if self.batch is None:
+                rollouts = 1
+                result = low = high = self.simulation(node, simulator, turns_to_go - turns, player, seen)
+                if stats is not None:
+                    simulated = time.perf_counter()
+                self.backpropagation(path, result, seen)
+            else:
+                # batch rollouts do not record their actions, RAVE only sees the selection path
+                rollouts = self.batch_sizer.size
+                result, squares, low, high = self.batch_simulation(simulator, turns_to_go - turns, player, rollouts)
+                if stats is not None:
+                    simulated = time.perf_counter()
+                self.backpropagation(path, result, seen, rollouts, squares)
+                self.batch_sizer.record(rollouts, turns_to_go - turns, time.perf_counter() - started)
+            if stats is not None:
+                stats.iteration(started, selected, expanded, simulated, len(path) - 1, rollouts)
+
+            if low < min_result or high > max_result:
+                min_result, max_result = min(min_result, low), max(max_result, high)
+                if self.scorer is not None:
+                    self.exploration = exploration_constant(min_result, max_result)
+
+            if not self.time_manager.keep_searching():
+                # spending the rest of the hard limit only when the best moves are too close to tell apart
+                if halving is not None or not (root_values_close(root.children) and self.time_manager.extend()):
+                    break
+            elif halving is None and self.time_manager.checked and \
+                    decision_settled(root.children, self.time_manager.remaining_iterations(), max_result - min_result):
+                break
+        # the time left is carried over to later turns
+        self.time_manager.finish()
 
-                simulator = Simulator(state)
+        if len(root.children) == 0:
+            return root
 
-                sample_agent = RandomSampleAgent(state, PLAYER_1 if self.player_number == PLAYER_2 else PLAYER_2,
-                                                 self.moves_by_location, self.his_ships, self.his_sail_actions)
-                my_sample_agent = RandomSampleAgent(state, self.player_number,
-                                                    self.moves_by_location, self.my_ships, self.my_sail_actions)
+        if halving is not None:
+            self.root_statistics = halving.statistics()
+            if self.scorer is not None:
+                self.scorer.learn(root.children, state, self.player_number)
+            return halving.best()
+        if self.scorer is not None:
+            self.scorer.learn(root.children, state, self.player_number)
+            # with priors, children with few visits have unreliable means
+            return max(root.children, key=lambda child: child.visits)
+        return max(root.children,
+                   key=lambda child: child.wins / child.visits if child.visits > 0 else 0)
 
-                check_time(start, ACTION_TIMEOUT)
 
-                node, turns, player = self.selection(root, simulator, start, self.player_number)
+    # -------------------------------------------- Pondering --------------------------------------------
 
+    def reuse_pondered(self, root, answers):
+        """
+        Starts the statistics of the children of the root from the results pondered for them
+        :param answers: the move, visits, sum and sum of squares of the results of every pondered answer
+        """
+        pondered = {move: (visits, wins, squares) for move, visits, wins, squares in answers}
+        for child in root.children:
+            if child.move in pondered:
+                visits, wins, squares = pondered[child.move]
+                child.update(wins, visits, squares)
+                root.update(-wins, visits, squares)
+
+    def ponder(self, state, move, turns_to_go):
+        """
+        Runs MCTS iterations below the move, over the replies of the opponent and the answers to them, until the time
+        manager stops the search. Run by the worker process of a Ponderer
+        :param state: the state the move was chosen in
+        :return: per ships_key of the states after a reply, the statistics of the answers to it, see reuse_pondered
+        """
+        if self.root is not None:
+            self.pool.release(self.root)
+        root = self.root = self.pool.acquire(self.player_number)
+        root.expand([move], self.pool, state_key(state) if self.closed_loop else None)
+        simulator = self.simulator
+        min_result, max_result = math.inf, -math.inf
+        self.exploration = exploration_constant(0, 0) if self.scorer is not None else None
+        self.time_manager.start(self.time_manager.hard_limit)
+        with paused_gc():
+            while True:
+                reset_simulator(simulator, state)
+                path = []
+                node, turns, player = self.selection(root, simulator, self.player_number, path)
                 if turns >= turns_to_go:
                     break
+                self.expansion(path, simulator, player)
+                result = self.simulation(node, simulator, turns_to_go - turns, player)
+                self.backpropagation(path, result)
+                if not min_result <= result <= max_result:
+                    min_result, max_result = min(min_result, result), max(max_result, result)
+                    if self.scorer is not None:
+                        self.exploration = exploration_constant(min_result, max_result)
+                if not self.time_manager.keep_searching():
+                    break
+        self.time_manager.finish()
+        return self.pondered_answers(state, root.children[0])
 
-                self.expansion(node, simulator, player)
+    def pondered_answers(self, state, chosen):
+        """
+        Keys the answers to every reply by the ships after the reply, which do not depend on the treasures spawned in
+        between. Replies that lead to the same ships, collecting different treasures, keep the most visited answers
+        """
+        simulator = self.simulator
+        answers = {}
+        for reply in chosen.children:
+            if not reply.children:
+                continue
+            reset_simulator(simulator, state)
+            simulator.apply_action(chosen.move, self.player_number)
+            if self.player_number == PLAYER_2:
+                simulator.check_collision_with_marines()
+                simulator.move_marines()
+            # the reply may collect a treasure spawned after the move
+            if not check_if_action_legal_better(simulator, reply.move, self.his_number, self.moves_by_location):
+                continue
+            simulator.apply_action(reply.move, self.his_number)
+            if self.player_number == PLAYER_1:
+                simulator.check_collision_with_marines()
+                simulator.move_marines()
+            key = ships_key(simulator.state)
+            if key in answers and answers[key][0] >= reply.visits:
+                continue
+            answers[key] = reply.visits, [(answer.move, answer.visits, answer.wins, answer.sum_squares)
+                                          for answer in reply.children if answer.visits > 0]
+        return {key: statistics for key, (_, statistics) in answers.items()}
 
-                result = self.simulation(node, simulator, sample_agent, my_sample_agent, turns_to_go - turns, start,
-                                         player)
+    # -------------------------------------------- Macro Search --------------------------------------------
 
-                self.backpropagation(node, result)
+    def macro_selection(self, node: UCTNode, simulator: Simulator, turns_to_go, path, exploration):
+        """
+        Selects joint options down the tree: the player chooses, then the opponent, then both follow their options
+        :return: the leaf, the number of turns played to reach it, and the player to move at the leaf
+        """
+        path.append(node)
+        turns, player = 0, self.player_number
+        choices = {}
+        while node.children and turns < turns_to_go:
+            node = node.select_option(exploration)
+            path.append(node)
+            choices[his_number(node.player_number)] = node.move
+            if len(choices) == 2:
+                played, player = self.follow_options(simulator, choices, player, turns_to_go - turns)
+                turns += played
+                choices = {}
+        return node, turns, player
+
+    def follow_options(self, simulator: Simulator, choices, player, turns_to_go):
+        """
+        Plays the joint options of both players until an option completes or no longer applies, a ship is caught by
+        a marine, or MACRO_MAX_TURNS turns passed. At least one player acts
+        :param choices: the joint option of every player
+        :param player: the player to move
+        :return: the number of turns completed and the player to move next
+        """
+        turns = 0
+        first = True
+        while turns < min(turns_to_go, MACRO_MAX_TURNS):
+            avoid = marine_reach(simulator.state)
+            action = []
+            stop = False
+            for option in choices[player]:
+                step = self.macros.step(simulator.state, option, avoid)
+                if step is None:
+                    if not first:
+                        return turns, player
+                    step = ('wait', option[1]), True
+                action.append(step[0])
+                stop = stop or step[1]
+            action = tuple(action)
+            if not check_if_action_legal(simulator, action, player, self.moves_by_location):
+                action = tuple(('wait', option[1]) for option in choices[player])
+                stop = True
+            first = False
+
+            simulator.apply_action(action, player)
+            simulator.add_treasure()
+            if player == PLAYER_1:
+                player = PLAYER_2
+            else:
+                score = dict(simulator.score)
+                simulator.check_collision_with_marines()
+                simulator.move_marines()
+                stop = stop or simulator.score != score
+                player = PLAYER_1
+                turns += 1
+            if stop:
+                break
+        return turns, player
+
+    def macro_expansion(self, path, simulator: Simulator):
+        """
+        Expands the leaf with the joint options of the player who chooses there
+        """
+        chooser = path[-1].player_number
+        options = self.macros.options(simulator.state, chooser,
+                                      self.my_ships if chooser == self.player_number else self.his_ships)
+        if self.pool.make_room(path[0], path, len(options)):
+            path[-1].expand(options, self.pool)
 
-                count_simulations += 1
-        except TimeoutError:
-            pass
-        # print(f'count_simulations: {count_simulations}')
+    def macro_search(self, root, state, simulator, turns_to_go) -> UCTNode:
+        """
+        Runs MCTS iterations over joint options from the root until the time manager stops the search, or the root
+        decision is settled
+        :return: the most visited child of the root
+        """
+        min_result, max_result = math.inf, -math.inf
+        exploration = exploration_constant(0, 0)
+        stats = self.search_stats
+
+        while True:
+            if stats is not None:
+                started = time.perf_counter()
+            reset_simulator(simulator, state)
+            path = []
+            node, turns, player = self.macro_selection(root, simulator, turns_to_go, path, exploration)
+            if stats is not None:
+                selected = time.perf_counter()
+            if turns < turns_to_go:
+                self.macro_expansion(path, simulator)
+            if stats is not None:
+                expanded = time.perf_counter()
+            result = self.simulation(node, simulator, turns_to_go - turns, player)
+            if stats is not None:
+                simulated = time.perf_counter()
+            self.backpropagation(path, result)
+            if stats is not None:
+                stats.iteration(started, selected, expanded, simulated, len(path) - 1)
+
+            if result < min_result or result > max_result:
+                min_result, max_result = min(min_result, result), max(max_result, result)
+                exploration = exploration_constant(min_result, max_result)
+
+            if not self.time_manager.keep_searching():
+                if not (root_values_close(root.children) and self.time_manager.extend()):
+                    break
+            elif self.time_manager.checked and \
+                    decision_settled(root.children, self.time_manager.remaining_iterations(), max_result - min_result):
+                break
+        # the time left is carried over to later turns
+        self.time_manager.finish()
 
         if len(root.children) == 0:
             return root
-
-        return max(root.children,
-                   key=lambda child: child.wins / child.visits if child.visits > 0 else 0)
+        return max(root.children, key=lambda child: child.visits)
 
 
 def check_if_action_legal(simulator, action, player, moves_by_location):
@@ -786,166 +2658,866 @@ def check_if_action_legal_better(simulator, action, player, moves_by_location):
     return True
 
 
+# -------------------------------------------- Ponderer --------------------------------------------
+
+class PonderClock(TimeManager):
+    """
+    The time manager of a pondering worker, which also stops the search as soon as a message is waiting
+    """
+
+    def __init__(self, connection, hard_limit=PONDER_LIMIT):
+        super().__init__(hard_limit)
+        self.connection = connection
+
+    def keep_searching(self):
+        return super().keep_searching() and not (self.checked and self.connection.poll())
+
+
+def ponder_worker(connection, initial_state, player_number, kwargs):
+    """
+    The loop of a pondering worker process: ponders every ('ponder', number, state, move, turns to go) message
+    until the ('stop', number) message that follows it, then answers (number, statistics).
+    Exits when the agent closes its end of the pipe
+    """
+    random.seed()
+    agent = UCTAgent(initial_state, player_number, **kwargs)
+    agent.time_manager = PonderClock(connection)
+    try:
+        while True:
+            _, number, state, move, turns_to_go = connection.recv()
+            answers = agent.ponder(state, move, turns_to_go)
+            connection.recv()
+            connection.send((number, answers))
+    except (EOFError, OSError):
+        pass
+
+
+def stop_worker(connection, process):
+    connection.close()
+    process.join(PONDER_WAIT)
+    if process.is_alive():
+        process.terminate()
+
+
+class Ponderer:
+    """
+    Keeps a worker process that ponders on the opponent's turn, with a UCTAgent of its own.
+    The worker is stopped when the ponderer is garbage collected
+    :param kwargs: the keyword arguments of the agent of the worker
+    """
+
+    def __init__(self, initial_state, player_number, kwargs):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=ponder_worker, daemon=True,
+                                               args=(worker_connection, initial_state, player_number, kwargs))
+        self.process.start()
+        worker_connection.close()
+        self.number = 0
+        self.pondering = False
+        self.alive = True
+        weakref.finalize(self, stop_worker, self.connection, self.process)
+
+    def start(self, state, move, turns_to_go):
+        """
+        Starts pondering the replies to the move chosen in the state
+        """
+        if not self.alive:
+            return
+        self.number += 1
+        try:
+            self.connection.send(('ponder', self.number, state, move, turns_to_go))
+            self.pondering = True
+        except OSError:
+            self.alive = False
+
+    def collect(self, wait=PONDER_WAIT):
+        """
+        Stops pondering
+        :param wait: the longest to wait for the worker to answer, in seconds
+        :return: the statistics pondered, see UCTAgent.ponder, or None if the worker did not answer in time
+        """
+        if not self.pondering:
+            return None
+        self.pondering = False
+        deadline = time.monotonic() + wait
+        try:
+            self.connection.send(('stop', self.number))
+            # late answers to earlier stops are dropped
+            while self.connection.poll(max(0.0, deadline - time.monotonic())):
+                number, answers = self.connection.recv()
+                if number == self.number:
+                    return answers
+        except (EOFError, OSError):
+            self.alive = False
+        return None
+
+
 ##########################################################################################################
 
-class RandomSampleAgent:
-    def __init__(self, initial_state, player_number, neighbors_dict, my_ships, sail_actions):
-        self.ids = IDS
-        self.player_number = player_number
-        self.my_ships = []
-        self.neighbors_dict = neighbors_dict
-        self.my_ships = my_ships
-        self.sail_actions = sail_actions
-        self.simulator = Simulator(initial_state)
-        # for ship_name, ship in initial_state['pirate_ships'].items():
-        #     if ship['player'] == player_number:
-        #         self.my_ships.append(ship_name)
 
-    def act(self, state):
-        actions = {}
-        self.simulator.set_state(state)
-        collected_treasures = []
-        for ship in self.my_ships:
-            actions[ship] = set()
-            ship_loc = state["pirate_ships"][ship]["location"]
-            actions[ship].update(self.sail_actions[(ship, ship_loc)])
-            if state["pirate_ships"][ship]["capacity"] > 0:
-                for treasure in state["treasures"].keys():
-                    treasure_loc = state["treasures"][treasure]["location"]
-                    if type(treasure_loc) == str:
-                        continue
-                    if (ship_loc in self.neighbors_dict[treasure_loc] and
-                            treasure not in collected_treasures):
-                        actions[ship].add(("collect", ship, treasure))
-                        collected_treasures.append(treasure)
-            for treasure in state["treasures"].keys():
-                if (ship_loc == state["base"]
-                        and state["treasures"][treasure]["location"] == ship):
-                    actions[ship].add(("deposit", ship, treasure))
-            for enemy_ship_name in state["pirate_ships"].keys():
-                if (ship_loc == state["pirate_ships"][enemy_ship_name]["location"] and
-                        self.player_number != state["pirate_ships"][enemy_ship_name]["player"]):
-                    actions[ship].add(("plunder", ship, enemy_ship_name))
-            actions[ship].add(("wait", ship))
+class RolloutPolicy:
+    """
+    The behaviour of a player during rollouts
+    :param prefer_deposit_collect: always deposit or collect when possible, otherwise act randomly
+    :param avoid_marines: a ship that carries treasure never sails into a marine
+    :param plunder_only_profitable: only plunder enemy ships that carry treasure
+    :param model: an opponent model choosing the kind of action of every ship, instead of the rules above
+    """
 
-        whole_action = []
-        for atomic_actions in actions.values():
-            whole_action.append(random.choice(list(atomic_actions)))
-        return whole_action
+    __slots__ = ('prefer_deposit_collect', 'avoid_marines', 'plunder_only_profitable', 'model')
 
+    def __init__(self, prefer_deposit_collect=False, avoid_marines=False, plunder_only_profitable=False, model=None):
+        self.prefer_deposit_collect = prefer_deposit_collect
+        self.avoid_marines = avoid_marines
+        self.plunder_only_profitable = plunder_only_profitable
+        self.model = model
 
-class MySampleAgent:
-    def __init__(self, initial_state, player_number, neighbors_dict, my_ships, sail_actions):
-        self.ids = IDS
+
+REMOVED = -1 << 30
+# the plunders of a ship with no enemy ship in its cell
+NO_PLUNDERS = ()
+# a flag of the bit mask of the treasures offered to the ships of a player, above the bits of the treasures, set once
+# one of them collected a treasure
+COLLECTED = 1 << 60
+
+# uniformly random legal actions
+RANDOM_POLICY = RolloutPolicy()
+# deposits and collects when possible
+GREEDY_POLICY = RolloutPolicy(prefer_deposit_collect=True)
+# deposits and collects when possible, keeps its treasure away from marines and plunders only loaded ships
+CAREFUL_POLICY = RolloutPolicy(prefer_deposit_collect=True, avoid_marines=True, plunder_only_profitable=True)
+
+# kinds of ship actions
+SAIL, WAIT, COLLECT, DEPOSIT, PLUNDER = range(5)
+ACTION_KINDS = 5
+# situations of a ship, as bit flags: a treasure it can collect, treasure to deposit, an enemy ship to plunder
+CAN_COLLECT, CAN_DEPOSIT, CAN_PLUNDER = 1, 2, 4
+SITUATIONS = 8
+
+
+class OpponentModel:
+    """
+    Learns during the game how often the opponent takes every kind of ship action in every situation, from the
+    states passed to act, and samples the kinds of actions of its ships in rollouts by these frequencies.
+    The state the opponent decided in is rebuilt from the previous state and our move, and the action of every
+    enemy ship is a best guess from how the ship and its treasures changed: plundering an empty ship looks like
+    waiting, and a ship caught by a marine may look like it was plundered.
+    Counts start at OPPONENT_PRIOR and are kept in one flat array. Every situation has an alias table over the
+    kinds of actions possible in it, rebuilt only after its counts changed, so sampling takes constant time.
+    """
+
+    def __init__(self, initial_state, player_number, prior=OPPONENT_PRIOR):
         self.player_number = player_number
-        self.my_ships = []
-        self.neighbors_dict = neighbors_dict
-        self.my_ships = my_ships
-        self.sail_actions = sail_actions
+        self.his_number = his_number(player_number)
+        self.neighbors = get_neighbor_dict(initial_state["map"])
         self.simulator = Simulator(initial_state)
-        # for ship_name, ship in initial_state['pirate_ships'].items():
-        #     if ship['player'] == player_number:
-        #         self.my_ships.append(ship_name)
+        self.counts = array('l', [prior] * (SITUATIONS * ACTION_KINDS))
+        self.tables = [None] * SITUATIONS
+        self.previous = None
+        self.observations = 0
 
-    def act(self, state):
-        actions = {}
-        self.simulator.set_state(state)
-        collected_treasures = []
-        for ship in self.my_ships:
-            actions[ship] = set()
-            ship_loc = state["pirate_ships"][ship]["location"]
-            actions[ship].update(self.sail_actions[(ship, ship_loc)])
-            if state["pirate_ships"][ship]["capacity"] > 0:
-                for treasure in state["treasures"].keys():
-                    treasure_loc = state["treasures"][treasure]["location"]
-                    if type(treasure_loc) == str:
-                        continue
-                    if (ship_loc in self.neighbors_dict[treasure_loc] and
-                            treasure not in collected_treasures):
-                        actions[ship].add(("collect", ship, treasure))
-                        collected_treasures.append(treasure)
-            for treasure in state["treasures"].keys():
-                if (ship_loc == state["base"]
-                        and state["treasures"][treasure]["location"] == ship):
-                    actions[ship].add(("deposit", ship, treasure))
-            for enemy_ship_name in state["pirate_ships"].keys():
-                if (ship_loc == state["pirate_ships"][enemy_ship_name]["location"] and
-                        self.player_number != state["pirate_ships"][enemy_ship_name]["player"]):
-                    actions[ship].add(("plunder", ship, enemy_ship_name))
-            actions[ship].add(("wait", ship))
+    @staticmethod
+    def kinds(situation):
+        """
+        :return: the kinds of actions possible in a situation
+        """
+        return ((SAIL, WAIT) + ((COLLECT,) if situation & CAN_COLLECT else ()) +
+                ((DEPOSIT,) if situation & CAN_DEPOSIT else ()) + ((PLUNDER,) if situation & CAN_PLUNDER else ()))
+
+    def situation(self, state, name):
+        ship = state["pirate_ships"][name]
+        location = ship["location"]
+        situation = 0
+        if ship["capacity"] > 0 and any(type(treasure["location"]) != str and
+                                        location in self.neighbors[treasure["location"]]
+                                        for treasure in state["treasures"].values()):
+            situation |= CAN_COLLECT
+        if location == state["base"] and any(treasure["location"] == name for treasure in state["treasures"].values()):
+            situation |= CAN_DEPOSIT
+        if any(other["location"] == location and other["player"] != ship["player"]
+               for other in state["pirate_ships"].values()):
+            situation |= CAN_PLUNDER
+        return situation
+
+    def remember(self, state, move):
+        """
+        Keeps the state of our turn and our move, to rebuild the state the opponent decides in next
+        """
+        self.previous = copy_state(state), move
+
+    def observe(self, state):
+        """
+        Counts the actions the opponent took since our previous turn
+        :param state: the state passed to act
+        """
+        if self.previous is None:
+            return
+        decided = self.decision_state(state)
+        held = {}
+        for treasure_name, treasure in state["treasures"].items():
+            held.setdefault(treasure["location"], set()).add(treasure_name)
+        held_before = {}
+        for treasure_name, treasure in decided["treasures"].items():
+            held_before.setdefault(treasure["location"], set()).add(treasure_name)
+        for name, ship in decided["pirate_ships"].items():
+            if ship["player"] != self.his_number:
+                continue
+            situation = self.situation(decided, name)
+            carried, carried_before = held.get(name, set()), held_before.get(name, set())
+            kind = WAIT
+            if state["pirate_ships"][name]["location"] != ship["location"]:
+                kind = SAIL
+            elif situation & CAN_COLLECT and carried - carried_before:
+                kind = COLLECT
+            elif situation & CAN_DEPOSIT and carried < carried_before and len(carried) == len(carried_before) - 1:
+                kind = DEPOSIT
+            elif situation & CAN_PLUNDER and carried == carried_before and \
+                    any(other["location"] == ship["location"] and other["player"] == self.player_number and
+                        held_before.get(other_name) and not held.get(other_name)
+                        for other_name, other in decided["pirate_ships"].items()):
+                kind = PLUNDER
+            self.counts[situation * ACTION_KINDS + kind] += 1
+            self.tables[situation] = None
+        self.observations += 1
+
+    def decision_state(self, state):
+        """
+        :return: the state the opponent last decided in: our previous state after our move, and, when the opponent
+        moves first, after the marines of the round caught ships and moved to where they are now
+        """
+        previous, move = self.previous
+        reset_simulator(self.simulator, previous)
+        self.simulator.apply_action(move, self.player_number)
+        if self.player_number == PLAYER_2:
+            self.simulator.check_collision_with_marines()
+            for marine_name, marine in self.simulator.state["marine_ships"].items():
+                marine["index"] = state["marine_ships"][marine_name]["index"]
+        return self.simulator.state
+
+    def table(self, situation):
+        """
+        Builds the alias table of a situation, by Vose's method
+        :return: the kinds of actions, and the probability and alias of every slot
+        """
+        kinds = self.kinds(situation)
+        weights = [self.counts[situation * ACTION_KINDS + kind] for kind in kinds]
+        total = sum(weights)
+        scaled = [weight * len(kinds) / total for weight in weights]
+        probability = [1.0] * len(kinds)
+        alias = list(range(len(kinds)))
+        small = [slot for slot, weight in enumerate(scaled) if weight < 1]
+        large = [slot for slot, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        return kinds, probability, alias
+
+    def sample(self, situation):
+        """
+        :return: a kind of action for a ship in the situation
+        """
+        table = self.tables[situation]
+        if table is None:
+            table = self.tables[situation] = self.table(situation)
+        kinds, probability, alias = table
+        slot = int(random.random() * len(kinds))
+        return kinds[slot] if random.random() < probability[slot] else kinds[alias[slot]]
+
+
+class RolloutEngine:
+    """
+    Plays rollouts for both players. Compiled once per game from the map.
+    Cells are numbered row by row, and a rollout runs on flat lists of ship cells, capacities and treasures
+    instead of the state dictionaries, with per-cell neighbor tables built in advance.
+    Atomic ship actions are numbered too, for RAVE: sailing or waiting by the ship and the cell it ends in,
+    collecting by the ship and the cell of the treasure, depositing by the ship and plundering by both ships.
+    """
 
+    def __init__(self, initial_state):
+        game_map = initial_state["map"]
+        self.width = len(game_map[0])
+        neighbors_dict = get_neighbor_dict(game_map)
+        self.cells = [(i, j) for i in range(len(game_map)) for j in range(self.width)]
+        self.neighbors = [tuple(self.cell(neighbor) for neighbor in neighbors_dict[location])
+                          for location in self.cells]
+        # sailing to a neighbor or waiting, which is staying in the same cell
+        self.moves = [self.neighbors[cell] + (cell,) for cell in range(len(self.cells))]
+        # a treasure can be collected from the cells next to it, islands included
+        self.adjacent = [frozenset(self.cell((i + di, j + dj)) for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                                   if 0 <= i + di < len(game_map) and 0 <= j + dj < self.width)
+                         for i, j in self.cells]
+        self.islands = [cell for cell, (i, j) in enumerate(self.cells) if game_map[i][j] == 'I']
+        self.base = self.cell(initial_state["base"])
+        self.ship_names = list(initial_state["pirate_ships"].keys())
+        self.ship_index = {name: ship for ship, name in enumerate(self.ship_names)}
+        # first ids of the collect, deposit and plunder actions
+        self.collect_atoms = len(self.ship_names) * len(self.cells)
+        self.deposit_atoms = 2 * self.collect_atoms
+        self.plunder_atoms = self.deposit_atoms + len(self.ship_names)
+        self.owner = [ship["player"] for ship in initial_state["pirate_ships"].values()]
+        self.fleet = {player: [ship for ship, owner in enumerate(self.owner) if owner == player]
+                      for player in (PLAYER_1, PLAYER_2)}
+        self.fleet_names = {player: [self.ship_names[ship] for ship in fleet] for player, fleet in self.fleet.items()}
+        # reads the cells of the ships of a fleet from a list of ship cells. The fleet is given twice so that a fleet of
+        # a single ship reads a tuple too, and not a bare cell
+        self.fleet_cells = {player: itemgetter(*fleet, *fleet) if fleet else lambda location: ()
+                            for player, fleet in self.fleet.items()}
+        self.marine_paths = [tuple(self.cell(location) for location in marine["path"])
+                             for marine in initial_state["marine_ships"].values()]
+        # the indices a marine may move to, by its current index
+        self.marine_moves = [[tuple(range(max(0, index - 1), min(len(path), index + 2))) for index in range(len(path))]
+                             for path in self.marine_paths]
+        # the same moves with the cells they lead to, as (index, cell)
+        self.marine_steps = [[tuple((index, path[index]) for index in moves) for moves in marine_moves]
+                             for path, marine_moves in zip(self.marine_paths, self.marine_moves)]
+        # the moves of all the marines together, by their joint state, see marine_state: every combination of their
+        # moves as (state, cells), so that a round draws them at once. Only built for few joint states
+        self.marine_table = None
+        if math.prod(len(path) for path in self.marine_paths) <= MARINE_TABLE_STATES:
+            self.marine_table = []
+            for state in itertools.product(*(range(len(path)) for path in self.marine_paths)):
+                steps = itertools.product(*(moves[index] for moves, index in zip(self.marine_moves, state)))
+                self.marine_table.append(tuple(
+                    (self.marine_state(indices), tuple(path[index] for path, index in zip(self.marine_paths, indices)))
+                    for indices in steps))
+        # atomic actions of the state dictionaries, built once
+        self.sail_actions = {(name, location): tuple(('sail', name, neighbor) for neighbor in neighbors_dict[location])
+                             for name in self.ship_names for location in self.cells}
+        self.wait_actions = {name: ("wait", name) for name in self.ship_names}
+
+    def cell(self, location):
+        return location[0] * self.width + location[1]
+
+    def marine_state(self, indices):
+        """
+        :return: the joint state of the marines at the given indices of their paths
+        """
+        state = 0
+        for path, index in zip(self.marine_paths, indices):
+            state = state * len(path) + index
+        return state
+
+    def atom(self, action, state):
+        """
+        :param action: an atomic action of a ship
+        :param state: the state the action is taken in
+        :return: the id of the action
+        """
+        ship = self.ship_index[action[1]]
+        if action[0] == 'sail':
+            return ship * len(self.cells) + self.cell(action[2])
+        if action[0] == 'wait':
+            return ship * len(self.cells) + self.cell(state["pirate_ships"][action[1]]["location"])
+        if action[0] == 'collect':
+            return self.collect_atoms + ship * len(self.cells) + self.cell(state["treasures"][action[2]]["location"])
+        if action[0] == 'deposit':
+            return self.deposit_atoms + ship
+        return self.plunder_atoms + ship * len(self.ship_names) + self.ship_index[action[2]]
+
+    def act(self, state, player, policy):
+        """
+        Chooses a joint action for a state dictionary
+        :return: the joint action of the player
+        """
+        pirate_ships = state["pirate_ships"]
+        treasures = state["treasures"]
+        offered = []
         whole_action = []
-        for atomic_actions in actions.values():
-            for action in atomic_actions:
-                if action[0] == "deposit":
-                    whole_action.append(action)
-                    break
-                if action[0] == "collect":
-                    whole_action.append(action)
+        for name in self.fleet_names[player]:
+            ship = pirate_ships[name]
+            location = ship["location"]
+            capacity = ship["capacity"]
+            collects = []
+            deposits = []
+            if capacity > 0:
+                for treasure, treasure_value in treasures.items():
+                    treasure_location = treasure_value["location"]
+                    if (type(treasure_location) != str and treasure not in offered and
+                            self.cell(location) in self.adjacent[self.cell(treasure_location)]):
+                        collects.append(("collect", name, treasure))
+                        offered.append(treasure)
+            if location == state["base"]:
+                deposits = [("deposit", name, treasure) for treasure, treasure_value in treasures.items()
+                            if treasure_value["location"] == name]
+            plunders = [("plunder", name, enemy_name) for enemy_name, enemy in pirate_ships.items()
+                        if enemy["player"] != player and enemy["location"] == location and
+                        (not policy.plunder_only_profitable or enemy["capacity"] < 2)]
+            if policy.model is not None:
+                kind = policy.model.sample((CAN_COLLECT if collects else 0) | (CAN_DEPOSIT if deposits else 0) |
+                                           (CAN_PLUNDER if plunders else 0))
+                options = {SAIL: self.sail_actions[(name, location)], COLLECT: collects, DEPOSIT: deposits,
+                           PLUNDER: plunders}.get(kind) or (self.wait_actions[name],)
+                whole_action.append(options[int(random.random() * len(options))])
+                continue
+            if policy.prefer_deposit_collect and (deposits or collects):
+                whole_action.append(deposits[0] if deposits else collects[0])
+                continue
+            options = [sail for sail in self.sail_actions[(name, location)]
+                       if not policy.avoid_marines or capacity == 2 or
+                       not is_marine_in_loc(state["marine_ships"], sail[2])]
+            options += collects
+            options += deposits
+            options += plunders
+            options.append(self.wait_actions[name])
+            whole_action.append(options[int(random.random() * len(options))])
+        return tuple(whole_action)
+
+    def play(self, simulator, turns_to_go, player, policies, seen=None):
+        """
+        Plays a rollout from the state of the simulator, without changing it
+        :param turns_to_go: number of turns (rounds) to play, the current one included
+        :param player: the player to move first
+        :param policies: the rollout policy of every player
+        :param seen: if given, the sets the ids of the atomic actions of every player are added to
+        :return: the final score of every player
+        """
+        state = simulator.state
+        ship_index = self.ship_index
+        cell = self.cell
+        location = [cell(state["pirate_ships"][name]["location"]) for name in self.ship_names]
+        capacity = [state["pirate_ships"][name]["capacity"] for name in self.ship_names]
+        # a free treasure is located in a cell, a collected one in -1 - the index of its ship
+        treasure_location = []
+        treasure_reward = []
+        for treasure in state["treasures"].values():
+            held = type(treasure["location"]) == str
+            treasure_location.append(-1 - ship_index[treasure["location"]] if held else cell(treasure["location"]))
+            treasure_reward.append(treasure["reward"])
+        marine_index = [marine["index"] for marine in state["marine_ships"].values()]
+        marine_steps = self.marine_steps
+        marines = range(len(marine_steps))
+        marine_table = self.marine_table
+        marine_state = self.marine_state(marine_index) if marine_table is not None else None
+        score = {PLAYER_1: simulator.score[PLAYER_1_NAME], PLAYER_2: simulator.score[PLAYER_2_NAME]}
+        islands = self.islands
+        rand = random.random
+        act_ship = self._act_ship
+        fleets = self.fleet
+        adjacent = self.adjacent
+        moves = self.moves
+        base = self.base
+        owner = self.owner
+        marine_cells = [path[index] for path, index in zip(self.marine_paths, marine_index)]
+        num_cells = len(self.cells)
+        played = None
+        # the cells next to a free treasure, where a ship with room may collect it
+        collectable = self.collectable(treasure_location)
+        # what a turn of every player needs, looked up once per rollout
+        turn_settings = {number: (policies[number], policies[number].avoid_marines, policies[number].model,
+                                  fleets[number], fleets[his_number(number)], self.fleet_cells[his_number(number)])
+                         for number in (PLAYER_1, PLAYER_2)}
+
+        neighbors = self.neighbors
+
+        # the first round may start with the second player
+        turn_order = (PLAYER_1, PLAYER_2) if player == PLAYER_1 else (PLAYER_2,)
+        for _ in range(turns_to_go):
+            for player in turn_order:
+                policy, avoid_marines, model, fleet, enemies, enemy_cells = turn_settings[player]
+                if seen is not None:
+                    played = seen[player]
+                # the treasure offered for collection to a ship is not offered to the next ones
+                offered = 0
+                acted = False
+                # enemy ships stay put during the turn of the player, so plundering is possible only in their cells
+                enemy_cells = enemy_cells(location)
+                for ship in fleet:
+                    here = location[ship]
+                    # most of the time a ship can only sail or wait
+                    if ((here not in collectable or capacity[ship] <= 0) and here not in enemy_cells and
+                            (here != base or -1 - ship not in treasure_location)):
+                        if model is None:
+                            options = moves[here]
+                            target = options[int(rand() * len(options))]
+                            if avoid_marines and capacity[ship] != 2:
+                                # drawing again until the ship waits or sails clear of the marines is uniform over the
+                                # safe moves, without building a list of them
+                                while target != here and target in marine_cells:
+                                    target = options[int(rand() * len(options))]
+                            location[ship] = target
+                        else:
+                            options = neighbors[here] if model.sample(0) == SAIL else ()
+                            if options:
+                                location[ship] = options[int(rand() * len(options))]
+                        if played is not None:
+                            played.add(ship * num_cells + location[ship])
+                    else:
+                        offered = act_ship(ship, player, policy, offered, location, capacity, treasure_location,
+                                           treasure_reward, marine_cells, score, played, enemies, enemy_cells)
+                        acted = True
+                if acted and REMOVED in treasure_location:
+                    treasure_reward[:] = [reward for where, reward in zip(treasure_location, treasure_reward)
+                                          if where != REMOVED]
+                    treasure_location[:] = [where for where in treasure_location if where != REMOVED]
+                if offered & COLLECTED:
+                    collectable = self.collectable(treasure_location)
+                if len(treasure_location) <= 9 and islands and rand() < TREASURE_ARRIVAL_PROBABILITY:
+                    island = islands[int(rand() * len(islands))]
+                    treasure_location.append(island)
+                    treasure_reward.append(1 + int(rand() * 9))
+                    collectable |= adjacent[island]
+
+            # marines catch ships, then move
+            for caught in marine_cells:
+                if caught in location:
+                    for ship, ship_location in enumerate(location):
+                        if ship_location in marine_cells:
+                            capacity[ship] = 2
+                            score[owner[ship]] -= simulator.MARINE_COLLISION_PENALTY
+                            held = -1 - ship
+                            for treasure in range(len(treasure_location) - 1, -1, -1):
+                                if treasure_location[treasure] == held:
+                                    del treasure_location[treasure]
+                                    del treasure_reward[treasure]
                     break
+            if marine_table is not None:
+                steps = marine_table[marine_state]
+                marine_state, marine_cells = steps[int(rand() * len(steps))]
+            else:
+                for marine in marines:
+                    steps = marine_steps[marine][marine_index[marine]]
+                    marine_index[marine], marine_cells[marine] = steps[int(rand() * len(steps))]
+            turn_order = (PLAYER_1, PLAYER_2)
+        return score
+
+    def collectable(self, treasure_location):
+        """
+        :return: the set of the cells next to the free treasures of a rollout
+        """
+        adjacent = self.adjacent
+        cells = set()
+        for where in treasure_location:
+            if where >= 0:
+                cells |= adjacent[where]
+        return cells
+
+    def _act_ship(self, ship, player, policy, offered, location, capacity, treasure_location, treasure_reward,
+                  marine_cells, score, played, enemies, enemy_cells):
+        """
+        Chooses and applies the action of a ship that may do more than sail or wait, in place.
+        Removed treasures are marked REMOVED, so the indices of the others stay valid during the move
+        :param offered: bit mask of the treasures already offered for collection to other ships of the player
+        :param played: if not None, the set the id of the action is added to
+        :param enemies: the ships of the other player, and enemy_cells their cells
+        :return: the updated bit mask, with COLLECTED set if the ship collected a treasure
+        """
+        rand = random.random
+        ship_location = location[ship]
+        held = -1 - ship
+        collects = deposits = 0
+        collect = deposit = -1
+        if capacity[ship] > 0:
+            # the treasures in the cells next to the ship, found by the list and set methods instead of a loop over
+            # all the treasures. Held and removed treasures are at negative locations, never adjacent
+            for where in self.adjacent[ship_location].intersection(treasure_location):
+                treasure = -1
+                for _ in range(treasure_location.count(where)):
+                    treasure = treasure_location.index(where, treasure + 1)
+                    if not offered >> treasure & 1:
+                        offered |= 1 << treasure
+                        collects += 1
+                        if collect < 0 or rand() * collects < 1:
+                            collect = treasure
+        if ship_location == self.base and held in treasure_location:
+            for treasure, where in enumerate(treasure_location):
+                if where == held:
+                    deposits += 1
+                    if deposit < 0 or rand() * deposits < 1:
+                        deposit = treasure
+
+        target = None
+        if policy.model is not None or not (policy.prefer_deposit_collect and (deposits or collects)):
+            sails = self.neighbors[ship_location]
+            if policy.avoid_marines and capacity[ship] != 2:
+                sails = [sail for sail in sails if sail not in marine_cells]
+            plunders = NO_PLUNDERS
+            if ship_location in enemy_cells:
+                plunders = [enemy for enemy in enemies if location[enemy] == ship_location and
+                            (not policy.plunder_only_profitable or capacity[enemy] < 2)]
+            if policy.model is not None:
+                kind = policy.model.sample((CAN_COLLECT if collects else 0) | (CAN_DEPOSIT if deposits else 0) |
+                                           (CAN_PLUNDER if plunders else 0))
+                if kind == SAIL:
+                    kind = SAIL if sails else WAIT
+                    target = sails[int(rand() * len(sails))] if sails else None
+                elif kind == PLUNDER:
+                    target = plunders[int(rand() * len(plunders))]
             else:
-                whole_action.append(random.choice(list(atomic_actions)))
-        return whole_action
+                sail_count = len(sails)
+                pick = int(rand() * (sail_count + collects + deposits + len(plunders) + 1))
+                if pick < sail_count:
+                    kind, target = SAIL, sails[pick]
+                else:
+                    pick -= sail_count
+                    if pick < collects:
+                        kind = COLLECT
+                    elif pick < collects + deposits:
+                        kind = DEPOSIT
+                    elif pick < collects + deposits + len(plunders):
+                        kind, target = PLUNDER, plunders[pick - collects - deposits]
+                    else:
+                        kind = WAIT
+        else:
+            kind = DEPOSIT if deposits else COLLECT
+
+        if kind == SAIL:
+            location[ship] = target
+            if played is not None:
+                played.add(ship * len(self.cells) + target)
+        elif kind == WAIT:
+            if played is not None:
+                played.add(ship * len(self.cells) + ship_location)
+        elif kind == PLUNDER:
+            # plundering, the treasure of the enemy ship is lost
+            capacity[target] = 2
+            for treasure, where in enumerate(treasure_location):
+                if where == -1 - target:
+                    treasure_location[treasure] = REMOVED
+            if played is not None:
+                played.add(self.plunder_atoms + ship * len(self.ship_names) + target)
+        elif kind == DEPOSIT:
+            capacity[ship] += 1
+            score[player] += treasure_reward[deposit]
+            treasure_location[deposit] = REMOVED
+            if played is not None:
+                played.add(self.deposit_atoms + ship)
+        else:
+            if played is not None:
+                played.add(self.collect_atoms + ship * len(self.cells) + treasure_location[collect])
+            capacity[ship] -= 1
+            treasure_location[collect] = held
+            offered |= COLLECTED
+        return offered
 
 
-class BetterSample:
-    def __init__(self, initial_state, player_number, neighbors_dict, my_ships, sail_actions):
-        self.ids = IDS
-        self.player_number = player_number
-        self.my_ships = []
-        self.neighbors_dict = neighbors_dict
-        self.my_ships = my_ships
-        self.sail_actions = sail_actions
-        self.simulator = Simulator(initial_state)
-        # for ship_name, ship in initial_state['pirate_ships'].items():
-        #     if ship['player'] == player_number:
-        #         self.my_ships.append(ship_name)
+class BatchSizer:
+    """
+    Adapts the number of rollouts per leaf to the measured throughput. The size moves by factors of 2 between
+    MIN_BATCH_SIZE and MAX_BATCH_SIZE, and turns back when the time per rollout turn of the search went up
+    since the previous measurement.
+    """
 
-    def act(self, state):
-        actions = {}
-        self.simulator.set_state(state)
-        collected_treasures = []
-        for ship in self.my_ships:
-            actions[ship] = set()
-            ship_loc = state["pirate_ships"][ship]["location"]
-            # actions[ship].update(self.sail_actions[(ship, ship_loc)])
-            for neighbor, sail_action in zip(self.neighbors_dict[ship_loc],
-                                             self.sail_actions[(ship, ship_loc)]):
-                if (state["pirate_ships"][ship]["capacity"] == 2 or
-                        not is_marine_in_loc(state['marine_ships'], neighbor)):
-                    actions[ship].add(sail_action)
-            if state["pirate_ships"][ship]["capacity"] > 0:
-                for treasure in state["treasures"].keys():
-                    treasure_loc = state["treasures"][treasure]["location"]
-                    if type(treasure_loc) == str:
-                        continue
-                    if (ship_loc in self.neighbors_dict[treasure_loc] and
-                            treasure not in collected_treasures):
-                        actions[ship].add(("collect", ship, treasure))
-                        collected_treasures.append(treasure)
-            for treasure in state["treasures"].keys():
-                if (ship_loc == state["base"]
-                        and state["treasures"][treasure]["location"] == ship):
-                    actions[ship].add(("deposit", ship, treasure))
-            for enemy_ship_name in state["pirate_ships"].keys():
-                if (ship_loc == state["pirate_ships"][enemy_ship_name]["location"] and
-                        self.player_number != state["pirate_ships"][enemy_ship_name]["player"] and
-                        state["pirate_ships"][enemy_ship_name]["capacity"] < 2):
-                    actions[ship].add(("plunder", ship, enemy_ship_name))
-            actions[ship].add(("wait", ship))
+    def __init__(self, size=BATCH_SIZE):
+        self.size = size
+        self.step = 2
+        self.cost = math.inf
+        self.turns = 0
+        self.seconds = 0.0
 
-        whole_action = []
-        for atomic_actions in actions.values():
-            for action in atomic_actions:
-                if action[0] == "deposit":
-                    whole_action.append(action)
-                    break
-                if action[0] == "collect":
-                    whole_action.append(action)
-                    break
+    def record(self, rollouts, turns_to_go, seconds):
+        """
+        :param rollouts: the number of rollouts of an iteration
+        :param turns_to_go: the length of the rollouts, in turns
+        :param seconds: the time of the whole iteration
+        """
+        self.turns += rollouts * max(1, turns_to_go)
+        self.seconds += seconds
+        if self.turns < BATCH_MEASURE_TURNS:
+            return
+        cost = self.seconds / self.turns
+        if cost > self.cost:
+            self.step = 1 / self.step
+        self.cost = cost
+        self.turns = 0
+        self.seconds = 0.0
+        self.size = int(min(MAX_BATCH_SIZE, max(MIN_BATCH_SIZE, self.size * self.step)))
+
+
+# treasure slots of the batch engine
+EMPTY_SLOT = -2
+FREE_TREASURE = -1
+
+
+class BatchRolloutEngine:
+    """
+    Plays many rollouts at once, with the semantics of RANDOM_POLICY for both players. Built from the tables of
+    a RolloutEngine. Every rollout is a row of NumPy arrays: the cells and capacities of the ships, a fixed number of
+    treasure slots and the indices of the marines, so a half turn of a player is a few array operations for all the
+    rollouts together. Array operations have a fixed cost, so batches smaller than `vector_threshold` and all batches
+    without NumPy are played one by one by the RolloutEngine.
+    :param seed: the seed of the random generator of the vectorized rollouts, drawn from `random` by default so that
+    seeding `random` seeds them too
+    """
+
+    def __init__(self, engine, seed=None):
+        self.engine = engine
+        self.policies = {PLAYER_1: RANDOM_POLICY, PLAYER_2: RANDOM_POLICY}
+        self.vector_threshold = math.inf
+        self.rng = None
+        if np is None:
+            return
+        self.seed(seed)
+        num_cells = len(engine.cells)
+        self.neighbor_count = np.array([len(neighbors) for neighbors in engine.neighbors])
+        width = max(1, int(self.neighbor_count.max()))
+        self.neighbor_table = np.array([neighbors + (0,) * (width - len(neighbors))
+                                        for neighbors in engine.neighbors])
+        self.adjacency = np.zeros((num_cells, num_cells), dtype=bool)
+        for cell, adjacent in enumerate(engine.adjacent):
+            self.adjacency[cell, list(adjacent)] = True
+        self.islands = np.array(engine.islands, dtype=int)
+        self.owner = np.array(engine.owner)
+        self.fleet = {player: np.array(engine.fleet[player], dtype=int) for player in (PLAYER_1, PLAYER_2)}
+        self.enemies = {player: self.fleet[his_number(player)] for player in (PLAYER_1, PLAYER_2)}
+        length = max([len(path) for path in engine.marine_paths], default=1)
+        self.marine_cells = np.array([path + (path[-1],) * (length - len(path)) for path in engine.marine_paths],
+                                     dtype=int).reshape(len(engine.marine_paths), length)
+        self.marine_first = np.array([[moves[0] for moves in marine_moves] + [0] * (length - len(marine_moves))
+                                      for marine_moves in engine.marine_moves], dtype=int).reshape(-1, length)
+        self.marine_count = np.array([[len(moves) for moves in marine_moves] + [1] * (length - len(marine_moves))
+                                      for marine_moves in engine.marine_moves], dtype=int).reshape(-1, length)
+
+    def seed(self, seed=None):
+        if np is not None:
+            self.rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+
+    def calibrate(self, simulator, sizes=CALIBRATION_SIZES, turns_to_go=CALIBRATION_TURNS):
+        """
+        Sets `vector_threshold` to the smallest batch size for which vectorized rollouts are faster than
+        rollouts played one by one, on the state of the simulator
+        """
+        if np is None:
+            return
+        for size in sizes:
+            start = time.perf_counter()
+            for _ in range(size):
+                self.engine.play(simulator, turns_to_go, PLAYER_1, self.policies)
+            scalar = time.perf_counter() - start
+            start = time.perf_counter()
+            self.play(simulator, turns_to_go, PLAYER_1, size)
+            if time.perf_counter() - start < scalar:
+                self.vector_threshold = size
+                return
+
+    def moments(self, simulator, turns_to_go, player, rollouts, player_number):
+        """
+        Plays rollouts and sums their results
+        :param player_number: the player the results are computed for
+        :return: the sum, the sum of squares, the minimum and the maximum of the score differences of the player
+        """
+        his = his_number(player_number)
+        if np is not None and rollouts >= self.vector_threshold:
+            scores = self.play(simulator, turns_to_go, player, rollouts)
+            results = scores[:, player_number - 1] - scores[:, his - 1]
+            return (float(results.sum()), float((results * results).sum()), float(results.min()),
+                    float(results.max()))
+        results = []
+        for _ in range(rollouts):
+            score = self.engine.play(simulator, turns_to_go, player, self.policies)
+            results.append(score[player_number] - score[his])
+        return sum(results), sum(result * result for result in results), min(results), max(results)
+
+    def play(self, simulator, turns_to_go, player, rollouts):
+        """
+        Plays vectorized rollouts from the state of the simulator, without changing it
+        :param turns_to_go: number of turns (rounds) to play, the current one included
+        :param player: the player to move first
+        :param rollouts: number of rollouts
+        :return: the final scores of player 1 and player 2 in every rollout, as an array of shape (rollouts, 2)
+        """
+        engine = self.engine
+        state = simulator.state
+        cell = engine.cell
+        location = np.tile([cell(state["pirate_ships"][name]["location"]) for name in engine.ship_names], (rollouts, 1))
+        capacity = np.tile([state["pirate_ships"][name]["capacity"] for name in engine.ship_names], (rollouts, 1))
+        treasures = list(state["treasures"].values())
+        # spawning stops at MAX_TREASURES + 1 treasures
+        slots = max(len(treasures), MAX_TREASURES + 1)
+        holder = np.full((rollouts, slots), EMPTY_SLOT)
+        treasure_cell = np.zeros((rollouts, slots), dtype=int)
+        reward = np.zeros((rollouts, slots), dtype=int)
+        for slot, treasure in enumerate(treasures):
+            if type(treasure["location"]) == str:
+                holder[:, slot] = engine.ship_index[treasure["location"]]
             else:
-                whole_action.append(random.choice(list(atomic_actions)))
-        return whole_action
+                holder[:, slot] = FREE_TREASURE
+                treasure_cell[:, slot] = cell(treasure["location"])
+            reward[:, slot] = treasure["reward"]
+        marine_index = np.tile([marine["index"] for marine in state["marine_ships"].values()], (rollouts, 1))
+        marines = np.arange(len(engine.marine_paths))
+        score = np.tile([simulator.score[PLAYER_1_NAME], simulator.score[PLAYER_2_NAME]], (rollouts, 1))
+        every_row = np.arange(rollouts)[:, None]
+        rand = self.rng.random
+
+        while turns_to_go > 0:
+            # with random actions, the options of a ship do not depend on the actions of the other ships of the
+            # player, so all of them act together: arrays of shape (rollouts, ships, ...)
+            fleet = self.fleet[player]
+            enemies = self.enemies[player]
+            here = location[:, fleet]
+            sails = self.neighbor_count[here]
+            collects = ((holder == FREE_TREASURE)[:, None, :] &
+                        self.adjacency[here[:, :, None], treasure_cell[:, None, :]] &
+                        (capacity[:, fleet] > 0)[:, :, None])
+            # a treasure is only offered to the first ship next to it
+            collects &= collects.cumsum(1) == 1
+            deposits = (holder[:, None, :] == fleet[None, :, None]) & (here == engine.base)[:, :, None]
+            plunders = location[:, None, enemies] == here[:, :, None]
+            num_collects = collects.sum(2)
+            num_deposits = deposits.sum(2)
+            num_plunders = plunders.sum(2)
+            pick = (rand(here.shape) * (sails + num_collects + num_deposits + num_plunders + 1)).astype(int)
+
+            chosen = pick < sails
+            rows, ships = chosen.nonzero()
+            location[rows, fleet[ships]] = self.neighbor_table[here[chosen], pick[chosen]]
+            pick -= sails
+            chosen = (pick >= 0) & (pick < num_collects)
+            if chosen.any():
+                rows, ships = chosen.nonzero()
+                slot = (collects[chosen].cumsum(1) > pick[chosen][:, None]).argmax(1)
+                holder[rows, slot] = fleet[ships]
+                capacity[rows, fleet[ships]] -= 1
+            pick -= num_collects
+            chosen = (pick >= 0) & (pick < num_deposits)
+            if chosen.any():
+                rows, ships = chosen.nonzero()
+                slot = (deposits[chosen].cumsum(1) > pick[chosen][:, None]).argmax(1)
+                np.add.at(score[:, player - 1], rows, reward[rows, slot])
+                holder[rows, slot] = EMPTY_SLOT
+                capacity[rows, fleet[ships]] += 1
+            pick -= num_deposits
+            chosen = (pick >= 0) & (pick < num_plunders)
+            if chosen.any():
+                rows, ships = chosen.nonzero()
+                enemy = enemies[(plunders[chosen].cumsum(1) > pick[chosen][:, None]).argmax(1)]
+                capacity[rows, enemy] = 2
+                plundered = np.zeros(location.shape, dtype=bool)
+                plundered[rows, enemy] = True
+                holder[(holder >= 0) & plundered[every_row, np.maximum(holder, 0)]] = EMPTY_SLOT
+            # otherwise waiting
+
+            if len(self.islands):
+                empty = holder == EMPTY_SLOT
+                spawn = ((slots - empty.sum(1)) <= MAX_TREASURES) & (rand(rollouts) < TREASURE_ARRIVAL_PROBABILITY)
+                if spawn.any():
+                    slot = empty[spawn].argmax(1)
+                    count = int(spawn.sum())
+                    holder[spawn, slot] = FREE_TREASURE
+                    treasure_cell[spawn, slot] = self.islands[(rand(count) * len(self.islands)).astype(int)]
+                    reward[spawn, slot] = MIN_REWARD + (rand(count) * (MAX_REWARD - MIN_REWARD + 1)).astype(int)
+            if player == PLAYER_1:
+                player = PLAYER_2
+                continue
+
+            # marines catch ships, then move
+            if len(marines):
+                marine_cells = self.marine_cells[marines, marine_index]
+                caught = (location[:, :, None] == marine_cells[:, None, :]).any(2)
+                if caught.any():
+                    capacity[caught] = 2
+                    for owner in (PLAYER_1, PLAYER_2):
+                        score[:, owner - 1] -= (caught & (self.owner == owner)).sum(1) * \
+                                               simulator.MARINE_COLLISION_PENALTY
+                    holder[(holder >= 0) & caught[every_row, np.maximum(holder, 0)]] = EMPTY_SLOT
+                marine_index = (self.marine_first[marines, marine_index] +
+                                (rand(marine_index.shape) * self.marine_count[marines, marine_index]).astype(int))
+            player = PLAYER_1
+            turns_to_go -= 1
+        return score
 
 
 def is_marine_in_loc(marines, loc):
@@ -3,7 +3,8 @@ import ex3_213125164_325407054
 import sample_agent
 from copy import deepcopy
 import time
-import matplotlib.pyplot as plt
+from events import PrintSink
+from state_view import StateView
 
 CONSTRUCTOR_TIMEOUT = 60
 ACTION_TIMEOUT = 5
@@ -11,16 +12,26 @@ DIMENSIONS = (7, 7)
 PENALTY = 10000
 
 
+class ActionTimeoutError(ValueError):
+    """
+    An agent took longer than ACTION_TIMEOUT to act
+    """
+
+
 class Game:
     """
     This class plays the game for you. You are given a sample agent to play against.
+    The game reports what happens as events to a sink: printed by default, or written elsewhere, or dropped when
+    playing headless with events.NullSink.
     """
-    def __init__(self, an_input):
+    def __init__(self, an_input, sink=None):
         self.initial_state = deepcopy(an_input)
         self.simulator = Simulator(self.initial_state)
         self.ids = []
         self.agents = []
         self.score = [0, 0]
+        self.sink = sink if sink is not None else PrintSink()
+        self.latency = 0.0
 
     def initiate_agent(self, module, player_number, UCT_flag=False):
         """
@@ -37,70 +48,124 @@ class Game:
         return agent
 
     def get_action(self, agent, player):
+        """
+        The agent reads the live state of the simulator through a read-only view, instead of a deep copy of it
+        """
         start = time.time()
-        action = agent.act(self.simulator.get_state())
+        action = agent.act(StateView(self.simulator.state))
         finish = time.time()
+        self.latency = finish - start
         if finish - start > ACTION_TIMEOUT:
             self.score[player] -= PENALTY
-            raise ValueError(f'{self.ids[player]} timed out on action!')
+            raise ActionTimeoutError(f'{self.ids[player]} timed out on action!')
         return action
 
+    def close_agents(self):
+        """
+        Closes the agents that hold processes or connections, such as hosted and remote agents, once their episode
+        ends
+        """
+        for agent in self.agents:
+            close = getattr(agent, 'close', None)
+            if close is not None:
+                close()
+
     def play_episode(self, swapped=False):
         length_of_episode = int(self.initial_state["turns to go"]/2)
+        sink = self.sink
+        if sink.enabled:
+            sink.emit({'type': 'episode_start', 'swapped': swapped, 'ids': [agent.ids for agent in self.agents],
+                       'state': self.simulator.get_state()})
         for i in range(length_of_episode):
-            print(f'Turn {i + 1}')
+            if sink.enabled:
+                score_before = dict(self.simulator.get_score())
+                actions, latencies, spawns = [], [], []
             for number, agent in enumerate(self.agents):
                 try:
                     action = self.get_action(agent, number)
                 except (AssertionError, ValueError) as e:
-                    print(e)
+                    if sink.enabled:
+                        kind = 'timeout' if isinstance(e, ActionTimeoutError) else 'error'
+                        sink.emit({'type': 'error', 'turn': i + 1, 'player': number + 1, 'kind': kind,
+                                   'message': str(e)})
                     self.score[number] -= PENALTY
                     return
+                if sink.enabled:
+                    # a treasure deposited or plundered may respawn under the same name, as a new dictionary
+                    treasures_before = dict(self.simulator.state["treasures"])
                 try:
                     self.simulator.act(action, number + 1)
                 except (AssertionError, ValueError):
-                    print(f'{agent.ids} chose illegal action!')
+                    if sink.enabled:
+                        sink.emit({'type': 'error', 'turn': i + 1, 'player': number + 1, 'kind': 'illegal',
+                                   'message': f'{agent.ids} chose illegal action!'})
                     self.score[number] -= PENALTY
                     return
-                print(f"{agent.ids} chose {action}")
+                if sink.enabled:
+                    actions.append(action)
+                    latencies.append(self.latency)
+                    treasures = self.simulator.state["treasures"]
+                    spawns.append({name: deepcopy(treasure) for name, treasure in treasures.items()
+                                   if treasures_before.get(name) is not treasure})
+            if sink.enabled:
+                marine_locations = [marine["path"][marine["index"]]
+                                    for marine in self.simulator.state["marine_ships"].values()]
+                collisions = [name for name, ship in self.simulator.state["pirate_ships"].items()
+                              if ship["location"] in marine_locations]
             self.simulator.check_collision_with_marines()
             self.simulator.move_marines()
-            print(self.simulator.get_score())
-            print(f"-----")
+            if sink.enabled:
+                score = dict(self.simulator.get_score())
+                sink.emit({'type': 'turn', 'turn': i + 1, 'actions': actions, 'latency': latencies,
+                           'score': score, 'score_delta': {player: score[player] - score_before[player]
+                                                           for player in score},
+                           'collisions': collisions, 'spawns': spawns,
+                           'marines': [marine["index"] for marine in self.simulator.state["marine_ships"].values()]})
         if not swapped:
             self.score[0] += self.simulator.get_score()['player 1']
             self.score[1] += self.simulator.get_score()['player 2']
         else:
             self.score[0] += self.simulator.get_score()['player 2']
             self.score[1] += self.simulator.get_score()['player 1']
+        if sink.enabled:
+            sink.emit({'type': 'episode_end', 'swapped': swapped, 'score': dict(self.simulator.get_score()),
+                       'state': self.simulator.get_state()})
 
-            print(f'***********  end of round!  ************ \n \n')
-
-    def play_game(self):
+    def play_game(self, module=ex3_213125164_325407054, rival=sample_agent, UCT_flag=True):
         """
         When initiating the agents in this function, you can set UCT_flag to True in initiate_agent(), when not using
         the general agent. You may also use an agent of your own, instead of sample agent.
+        :param module: the module of your agent
+        :param rival: the module of the rival agent, which plays its general agent
+        :param UCT_flag: whether your agent is the UCT agent of its module
         """
-        print(f'***********  starting a first round!  ************ \n \n')
-        self.agents = [self.initiate_agent(ex3_213125164_325407054, 1, UCT_flag=True),
-                       self.initiate_agent(sample_agent, 2)]
+        self.agents = [self.initiate_agent(module, 1, UCT_flag=UCT_flag),
+                       self.initiate_agent(rival, 2)]
         self.ids = ['Your agent', 'Rival agent']
-        self.play_episode()
-        print(self.simulator.state)
+        try:
+            self.play_episode()
+        finally:
+            self.close_agents()
 
-        print(f'***********  starting a second round!  ************ \n \n')
         self.simulator = Simulator(self.initial_state)
 
-        self.agents = [self.initiate_agent(sample_agent, 1),
-                       self.initiate_agent(ex3_213125164_325407054, 2, UCT_flag=True)]
+        self.agents = [self.initiate_agent(rival, 1),
+                       self.initiate_agent(module, 2, UCT_flag=UCT_flag)]
         self.ids = ['Rival agent', 'Your agent']
-        self.play_episode(swapped=True)
-        print(f'end of game!')
+        try:
+            self.play_episode(swapped=True)
+        finally:
+            self.close_agents()
+        if self.sink.enabled:
+            self.sink.emit({'type': 'game_end', 'score': list(self.score)})
         return self.score
 
 
-def main():
-    an_input = {
+def default_input():
+    """
+    :return: the sample problem the game is played on
+    """
+    return {
         "map": [
             ['S', 'S', 'I', 'S', 'S', 'S', 'S'],
             ['S', 'S', 'I', 'S', 'S', 'S', 'S'],
@@ -134,6 +199,12 @@ def main():
                          },
         "turns to go": 200
     }
+
+
+def main():
+    import matplotlib.pyplot as plt
+
+    an_input = default_input()
     start = time.time()
 
     # to calculate the expected value
@@ -0,0 +1,317 @@
+"""A compact append-only log of played episodes, and a fast deterministic replayer of the logs"""
+
+import mmap
+import pickle
+import struct
+import sys
+import time
+
+from events import EventSink
+from simulator import Simulator, TREASURE_NAMES
+
+MAGIC = b'RPL1'
+# bytes buffered by a writer before a write
+REPLAY_CHUNK_SIZE = 1 << 16
+
+# record tags
+EPISODE, TURN, FINISH = b'E', b'T', b'F'
+# the reasons an episode finished
+COMPLETED, TIMEOUT, ILLEGAL, ERROR = range(4)
+REASONS = {'timeout': TIMEOUT, 'illegal': ILLEGAL, 'error': ERROR}
+
+ACTION_KINDS = ('sail', 'wait', 'collect', 'deposit', 'plunder')
+KIND_CODES = {kind: code for code, kind in enumerate(ACTION_KINDS)}
+NO_SPAWN = 0xFF
+
+LENGTH = struct.Struct('<I')
+FINISH_BODY = struct.Struct('<BHii')
+
+
+class EpisodeCodec:
+    """
+    Packs the turns of an episode into fixed size records, given its initial state.
+    A turn holds, for each player, its atomic actions and the treasure spawned after them, then the marine indices
+    after the marines moved. An atomic action is a byte of its kind and ship, and two bytes of its target: a cell,
+    a treasure or a ship. A spawn is a byte of the treasure, or NO_SPAWN, two bytes of its cell and a byte of reward
+    """
+
+    def __init__(self, initial_state):
+        self.width = len(initial_state["map"][0])
+        self.ship_names = list(initial_state["pirate_ships"])
+        self.ship_index = {name: index for index, name in enumerate(self.ship_names)}
+        self.fleets = [[name for name, ship in initial_state["pirate_ships"].items() if ship["player"] == player]
+                       for player in (1, 2)]
+        self.treasure_names = sorted(set(TREASURE_NAMES) | set(initial_state["treasures"]))
+        self.treasure_index = {name: index for index, name in enumerate(self.treasure_names)}
+        self.marine_names = list(initial_state["marine_ships"])
+        self.format = '<' + ''.join('BH' * len(fleet) + 'BHB' for fleet in self.fleets) + 'B' * len(self.marine_names)
+        self.body = struct.Struct(self.format)
+        self.size = 1 + self.body.size
+
+    def cell(self, location):
+        return location[0] * self.width + location[1]
+
+    def location(self, cell):
+        return cell // self.width, cell % self.width
+
+    def pack_action(self, atomic_action, fields):
+        kind = KIND_CODES[atomic_action[0]]
+        fields.append(kind << 5 | self.ship_index[atomic_action[1]])
+        if kind == 0:
+            fields.append(self.cell(atomic_action[2]))
+        elif kind == 1:
+            fields.append(0)
+        elif kind == 4:
+            fields.append(self.ship_index[atomic_action[2]])
+        else:
+            fields.append(self.treasure_index[atomic_action[2]])
+
+    def pack_spawn(self, spawns, fields):
+        if not spawns:
+            fields += (NO_SPAWN, 0, 0)
+            return
+        (name, treasure), = spawns.items()
+        fields += (self.treasure_index[name], self.cell(treasure["location"]), treasure["reward"])
+
+    def pack(self, actions, spawns, marines):
+        """
+        :param actions: the joint action of every player
+        :param spawns: the treasures spawned after the action of every player, by name
+        :param marines: the marine indices at the end of the turn
+        :return: the record of the turn
+        """
+        fields = []
+        for action, spawned in zip(actions, spawns):
+            for atomic_action in action:
+                self.pack_action(atomic_action, fields)
+            self.pack_spawn(spawned, fields)
+        fields += marines
+        return TURN + self.body.pack(*fields)
+
+    def unpack(self, buffer, offset):
+        """
+        :return: the joint action and the spawned treasure, name and attributes or None, of every player, and the
+        marine indices at the end of the turn
+        """
+        fields = self.body.unpack_from(buffer, offset + 1)
+        position = 0
+        actions, spawns = [], []
+        for fleet in self.fleets:
+            action = []
+            for _ in fleet:
+                code, target = fields[position], fields[position + 1]
+                position += 2
+                kind, ship = code >> 5, self.ship_names[code & 31]
+                if kind == 0:
+                    action.append(('sail', ship, self.location(target)))
+                elif kind == 1:
+                    action.append(('wait', ship))
+                elif kind == 4:
+                    action.append(('plunder', ship, self.ship_names[target]))
+                else:
+                    action.append((ACTION_KINDS[kind], ship, self.treasure_names[target]))
+            actions.append(tuple(action))
+            name, cell, reward = fields[position:position + 3]
+            position += 3
+            spawns.append(None if name == NO_SPAWN else
+                          (self.treasure_names[name], {'location': self.location(cell), 'reward': reward}))
+        return actions, spawns, fields[position:]
+
+
+class ReplayWriter:
+    """
+    Appends episodes to a replay file, in chunks of REPLAY_CHUNK_SIZE bytes
+    """
+
+    def __init__(self, path, chunk_size=REPLAY_CHUNK_SIZE):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.codec = None
+        self.turns = 0
+
+    def start(self, initial_state):
+        self.codec = EpisodeCodec(initial_state)
+        self.turns = 0
+        state = pickle.dumps(initial_state, pickle.HIGHEST_PROTOCOL)
+        self.write(EPISODE + LENGTH.pack(len(state)) + state)
+
+    def turn(self, actions, spawns, marines):
+        self.write(self.codec.pack(actions, spawns, marines))
+        self.turns += 1
+
+    def finish(self, score, reason=COMPLETED):
+        """
+        :param score: the score of the simulator at the end of the episode
+        """
+        self.write(FINISH + FINISH_BODY.pack(reason, self.turns, score['player 1'], score['player 2']))
+
+    def write(self, record):
+        self.buffer += record
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class ReplaySink(EventSink):
+    """
+    Records the episodes of main.Game to a replay file
+    """
+
+    def __init__(self, path, chunk_size=REPLAY_CHUNK_SIZE):
+        self.writer = ReplayWriter(path, chunk_size)
+        self.score = None
+
+    def emit(self, event):
+        kind = event['type']
+        if kind == 'episode_start':
+            self.writer.start(event['state'])
+            self.score = None
+        elif kind == 'turn':
+            self.writer.turn(event['actions'], event['spawns'], event['marines'])
+            self.score = event['score']
+        elif kind == 'episode_end':
+            self.writer.finish(event['score'])
+        elif kind == 'error':
+            # the actions of the interrupted turn are not recorded, so neither is its score
+            self.writer.finish(self.score or {'player 1': 0, 'player 2': 0}, REASONS[event['kind']])
+
+    def close(self):
+        self.writer.close()
+
+
+class Episode:
+    """
+    An episode of a replay file, read in place
+    :param turns: the offset of the first turn record
+    :param count: the number of turns
+    :param score: the recorded final score, or None if the episode was not finished
+    """
+
+    def __init__(self, buffer, initial_state, turns, count, score, reason):
+        self.buffer = buffer
+        self.initial_state = initial_state
+        self.codec = EpisodeCodec(initial_state)
+        self.turns = turns
+        self.count = count
+        self.score = score
+        self.reason = reason
+
+    def __len__(self):
+        return self.count
+
+    def turn(self, index):
+        return self.codec.unpack(self.buffer, self.turns + index * self.codec.size)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.turn(index)
+
+
+class ReplayReader:
+    """
+    Reads a replay file through a memory map. Turn records of an episode have a fixed size, so episodes are indexed
+    by skipping over them, and any turn is decoded in place
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a replay file')
+        self.episodes = self.index()
+
+    def index(self):
+        buffer = self.buffer
+        episodes = []
+        offset = len(MAGIC)
+        while offset < len(buffer):
+            tag = buffer[offset:offset + 1]
+            if tag != EPISODE:
+                raise ValueError(f'unexpected record {tag!r} at offset {offset}')
+            length, = LENGTH.unpack_from(buffer, offset + 1)
+            offset += 1 + LENGTH.size
+            initial_state = pickle.loads(buffer[offset:offset + length])
+            offset += length
+            size = EpisodeCodec(initial_state).size
+            turns = offset
+            while buffer[offset:offset + 1] == TURN:
+                offset += size
+            count = (offset - turns) // size
+            score, reason = None, None
+            if buffer[offset:offset + 1] == FINISH:
+                reason, _, first, second = FINISH_BODY.unpack_from(buffer, offset + 1)
+                score = {'player 1': first, 'player 2': second}
+                offset += 1 + FINISH_BODY.size
+            episodes.append(Episode(buffer, initial_state, turns, count, score, reason))
+        return episodes
+
+    def close(self):
+        self.episodes = []
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def replay(episode: Episode, simulator=None):
+    """
+    Replays an episode through the simulator without validating the actions: the spawned treasures and the marine
+    moves are taken from the log instead of being drawn
+    :param simulator: a simulator to replay on, reset to the initial state of the episode
+    :return: a generator of the state after every turn, with the simulator holding the score
+    """
+    simulator = simulator or Simulator(episode.initial_state)
+    state = simulator.state
+    marines = [state["marine_ships"][name] for name in episode.codec.marine_names]
+    for actions, spawns, indices in episode:
+        for player, (action, spawned) in enumerate(zip(actions, spawns), 1):
+            simulator.apply_action(action, player)
+            if spawned is not None:
+                state["treasures"][spawned[0]] = spawned[1]
+        simulator.check_collision_with_marines()
+        for marine, index in zip(marines, indices):
+            marine["index"] = index
+        yield state
+
+
+def verify(path):
+    """
+    Replays every finished episode of a replay file and checks its final score
+    :return: the number of turns replayed
+    """
+    turns = 0
+    with ReplayReader(path) as reader:
+        for number, episode in enumerate(reader.episodes):
+            simulator = Simulator(episode.initial_state)
+            for _ in replay(episode, simulator):
+                turns += 1
+            if episode.reason == COMPLETED and simulator.score != episode.score:
+                raise AssertionError(f'episode {number}: replayed score {simulator.score}, recorded {episode.score}')
+    return turns
+
+
+def main(paths):
+    for path in paths:
+        start = time.perf_counter()
+        turns = verify(path)
+        seconds = time.perf_counter() - start
+        print(f'{path}: {turns} turns verified in {seconds:.3f}s, {turns / max(seconds, 1e-9):.0f} turns/s')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,159 @@
+"""Compact diffs between the successive states of a game, for agents that mirror the state out of process"""
+
+import pickle
+import time
+from copy import deepcopy
+
+
+class StateEncoder:
+    """
+    Encodes every state as its diff from the state encoded before it, starting from the initial state.
+    A diff is a tuple of the ships that moved or changed capacity as (index, location, capacity), the treasures
+    added or changed as (name, location, reward), the names of the treasures removed, and the marine indices, or
+    None if no marine moved. Ships are indexed in the order of the initial state. A treasure that is both removed and
+    added, as one that spawned again under its name, is added after the removals, at the end
+    """
+
+    def __init__(self, initial_state):
+        self.ship_names = list(initial_state["pirate_ships"])
+        self.marine_names = list(initial_state["marine_ships"])
+        self.ships = self.treasures = self.marines = None
+        self.reset(initial_state)
+
+    def reset(self, state):
+        """
+        Starts again from a state, the one a new mirror starts from
+        """
+        self.ships = [(state["pirate_ships"][name]["location"], state["pirate_ships"][name]["capacity"])
+                      for name in self.ship_names]
+        self.treasures = {name: (treasure["location"], treasure["reward"])
+                          for name, treasure in state["treasures"].items()}
+        self.marines = tuple(state["marine_ships"][name]["index"] for name in self.marine_names)
+
+    def encode(self, state):
+        pirate_ships = state["pirate_ships"]
+        ships = []
+        for index, name in enumerate(self.ship_names):
+            ship = pirate_ships[name]
+            value = ship["location"], ship["capacity"]
+            if value != self.ships[index]:
+                self.ships[index] = value
+                ships.append((index, value[0], value[1]))
+        current = state["treasures"]
+        known = self.treasures
+        removed = [name for name in known if name not in current]
+        for name in removed:
+            del known[name]
+        # the mirror keeps the treasures in the order of the state: from the first treasure out of order on, every
+        # treasure is removed and added again, at the end
+        order = list(known)
+        kept = 0
+        in_order = True
+        treasures = []
+        for name, treasure in current.items():
+            value = treasure["location"], treasure["reward"]
+            in_order = in_order and kept < len(order) and order[kept] == name
+            if in_order:
+                kept += 1
+                if known[name] != value:
+                    known[name] = value
+                    treasures.append((name, value[0], value[1]))
+                continue
+            if name in known:
+                del known[name]
+                removed.append(name)
+            known[name] = value
+            treasures.append((name, value[0], value[1]))
+        marines = tuple(state["marine_ships"][name]["index"] for name in self.marine_names)
+        moved = marines if marines != self.marines else None
+        self.marines = marines
+        return tuple(ships), tuple(treasures), tuple(removed), moved
+
+
+class StateMirror:
+    """
+    Keeps a copy of the state of a game, by applying to the initial state the diffs of a StateEncoder
+    """
+
+    def __init__(self, initial_state):
+        self.state = deepcopy(initial_state)
+        self.ships = [self.state["pirate_ships"][name] for name in self.state["pirate_ships"]]
+        self.marines = [self.state["marine_ships"][name] for name in self.state["marine_ships"]]
+
+    def apply(self, diff):
+        """
+        :return: the mirrored state, updated in place
+        """
+        ships, treasures, removed, marines = diff
+        for index, location, capacity in ships:
+            ship = self.ships[index]
+            ship["location"] = location
+            ship["capacity"] = capacity
+        state_treasures = self.state["treasures"]
+        for name in removed:
+            del state_treasures[name]
+        for name, location, reward in treasures:
+            state_treasures[name] = {"location": location, "reward": reward}
+        if marines is not None:
+            for marine, index in zip(self.marines, marines):
+                marine["index"] = index
+        return self.state
+
+
+def large_input(size, an_input):
+    """
+    :return: the input grown to a square map of the size, with open sea around it and marine paths as long
+    """
+    state = deepcopy(an_input)
+    width = len(state["map"][0])
+    state["map"] = [row + ['S'] * (size - width) for row in state["map"]] + \
+                   [['S'] * size for _ in range(size - len(state["map"]))]
+    for marine in state["marine_ships"].values():
+        marine["path"] = (marine["path"] + marine["path"][-2:0:-1]) * max(1, size // len(marine["path"]))
+    return state
+
+
+def benchmark_diffs(sizes=(7, 70, 200), turns=200, repeats=3):
+    """
+    Plays the sample agents against each other on growing maps, and prints the mean bytes and serialization time per
+    turn of pickling the whole state, and of encoding and pickling its diff
+    """
+    import random
+    import main
+    import sample_agent
+    from simulator import Simulator
+
+    for size in sizes:
+        random.seed(0)
+        an_input = large_input(size, main.default_input())
+        simulator = Simulator(an_input)
+        agents = [sample_agent.Agent(an_input, 1), sample_agent.Agent(an_input, 2)]
+        states = []
+        for _ in range(turns):
+            for number, agent in enumerate(agents, 1):
+                simulator.act(agent.act(deepcopy(simulator.state)), number)
+                states.append(deepcopy(simulator.state))
+            simulator.check_collision_with_marines()
+            simulator.move_marines()
+        full_bytes = sum(len(pickle.dumps(state, pickle.HIGHEST_PROTOCOL)) for state in states) / len(states)
+        diff_bytes = 0
+        full_seconds = diff_seconds = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for state in states:
+                pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+            full_seconds = min(full_seconds, time.perf_counter() - start)
+            encoder = StateEncoder(an_input)
+            start = time.perf_counter()
+            diffs = [pickle.dumps(encoder.encode(state), pickle.HIGHEST_PROTOCOL) for state in states]
+            diff_seconds = min(diff_seconds, time.perf_counter() - start)
+            diff_bytes = sum(map(len, diffs)) / len(states)
+        mirror = StateMirror(an_input)
+        for state, diff in zip(states, diffs):
+            assert mirror.apply(pickle.loads(diff)) == state
+        print(f'{size:>4}x{size:<4} state {full_bytes:>9.0f} bytes {full_seconds / len(states) * 1e6:>8.1f} us | '
+              f'diff {diff_bytes:>5.0f} bytes {diff_seconds / len(states) * 1e6:>6.1f} us')
+
+
+if __name__ == '__main__':
+    benchmark_diffs()
@@ -0,0 +1,114 @@
+"""Read-only views over the live state of a simulator, handed to the agents instead of deep copies of the state"""
+
+from collections.abc import Mapping, Sequence
+from copy import deepcopy
+
+
+def view(value):
+    """
+    :return: a read-only view of a dictionary or a list, or the value itself, which is immutable
+    """
+    if type(value) is dict:
+        return StateView(value)
+    if type(value) is list:
+        return SequenceView(value)
+    return value
+
+
+def clone(value):
+    """
+    Copies the dictionaries of a state, leaving its lists, the map and the marine paths, shared as read-only views
+    """
+    if isinstance(value, StateView):
+        value = value._data
+    if type(value) is dict:
+        return {key: clone(item) for key, item in value.items()}
+    return view(value)
+
+
+class StateView(Mapping):
+    """
+    A read-only mapping over a dictionary of a state. Nested dictionaries and lists are wrapped on access, so the view
+    costs nothing to make whatever the size of the state, and it reads the live data: it is only valid while the
+    state does not change, that is during the act of the agent it was given to.
+    An agent that keeps or changes the state takes a cheap mutable copy with clone(); copy.deepcopy, and so
+    Simulator(view), makes a plain deep copy, and a pickled view unpickles as a plain dictionary
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return view(self._data[key])
+
+    def get(self, key, default=None):
+        return view(self._data[key]) if key in self._data else default
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        return self._data == (other._data if isinstance(other, StateView) else other)
+
+    __hash__ = None
+
+    def clone(self):
+        """
+        :return: a mutable copy of the state, sharing its map and marine paths with the view, read only
+        """
+        return clone(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self._data, memo)
+
+    def __reduce__(self):
+        return dict, (self._data,)
+
+    def __repr__(self):
+        return f'StateView({self._data!r})'
+
+
+class SequenceView(Sequence):
+    """
+    A read-only sequence over a list of a state, a row of the map or a marine path
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        return view(self._data[index])
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def __iter__(self):
+        for value in self._data:
+            yield view(value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        return self._data == (other._data if isinstance(other, SequenceView) else other)
+
+    __hash__ = None
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self._data, memo)
+
+    def __reduce__(self):
+        return list, (self._data,)
+
+    def __repr__(self):
+        return f'SequenceView({self._data!r})'
@@ -0,0 +1,72 @@
+import itertools
+import random
+from copy import deepcopy
+
+import pytest
+
+import ex3_213125164_325407054 as ex3
+import main
+import sample_agent
+from simulator import Simulator, TREASURE_NAMES
+from state_delta import large_input
+
+ROUNDS = 60
+
+
+def recorded_states(an_input, seed):
+    """
+    :return: the states of a game of the sample agents, with the player to move in each
+    """
+    random.seed(seed)
+    simulator = Simulator(an_input)
+    agents = {1: sample_agent.Agent(an_input, 1), 2: sample_agent.Agent(an_input, 2)}
+    states = []
+    for _ in range(ROUNDS):
+        for player, agent in agents.items():
+            states.append((deepcopy(simulator.state), player))
+            simulator.act(agent.act(deepcopy(simulator.state)), player)
+        simulator.check_collision_with_marines()
+        simulator.move_marines()
+    return states
+
+
+def renamed(state):
+    """
+    :return: the state with other names for its treasures, which only some actions name
+    """
+    state = deepcopy(state)
+    names = [name for name in reversed(TREASURE_NAMES) if name not in state["treasures"]]
+    state["treasures"] = {new: treasure for new, treasure in zip(names, state["treasures"].values())}
+    return state
+
+
+@pytest.mark.parametrize('size, seed', ((7, 0), (7, 1), (12, 2)))
+def test_cached_actions_match_uncached_actions(size, seed):
+    an_input = large_input(size, main.default_input())
+    neighbors = ex3.get_neighbor_dict(an_input["map"])
+    cache = ex3.ActionCache(neighbors)
+    fleets = {player: ex3.get_my_ships(an_input, player) for player in (1, 2)}
+    for recorded, player in recorded_states(an_input, seed):
+        # the actions of both fleets, as the searches look them up for both players, also in a state that differs
+        # only by the names of its treasures
+        for state, fleet in itertools.product((recorded, renamed(recorded)), fleets.values()):
+            cached = cache.actions(state, fleet)
+            uncached = ex3.ActionCache(neighbors).actions(state, fleet)
+            assert sorted(cached) == sorted(uncached)
+    assert cache.hits > 0
+
+
+def test_small_cache_evicts_the_least_recently_used_entries():
+    an_input = main.default_input()
+    cache = ex3.ActionCache(ex3.get_neighbor_dict(an_input["map"]), size=2)
+    fleet = ex3.get_my_ships(an_input, 1)
+    states = []
+    for location in ((1, 0), (3, 0), (2, 1)):
+        state = deepcopy(an_input)
+        state["pirate_ships"]["pirate_ship_1"]["location"] = location
+        states.append(state)
+        cache.actions(state, fleet)
+    assert len(cache.entries) == 2
+    assert cache.key(states[0], fleet) not in cache.entries
+    cache.actions(states[2], fleet)
+    assert cache.hits == 1
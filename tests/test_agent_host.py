@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import main
+from agent_host import AgentHost, AgentSpec, default_action
+
+DEADLINE = 0.3
+
+
+class ScriptedAgent:
+    """
+    Answers with the turn of the game it believes it plays, instead of an action, and on the acts of its process it
+    is scripted for, sleeps past the deadline or raises. Counts its turns like the agents of ex3
+    """
+
+    def __init__(self, initial_state, player_number, sleep_on=(), raise_on=()):
+        self.ids = ['scripted']
+        self.sleep_on = sleep_on
+        self.raise_on = raise_on
+        self.turn = -1
+        self.acts = 0
+
+    def act(self, state):
+        self.turn += 1
+        self.acts += 1
+        if self.acts in self.sleep_on:
+            time.sleep(10 * DEADLINE)
+        if self.acts in self.raise_on:
+            raise RuntimeError('scripted failure')
+        return 'turn', self.turn
+
+
+class ScriptedSpec:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def build(self, initial_state, player_number, turn=0):
+        agent = ScriptedAgent(initial_state, player_number, **self.kwargs)
+        agent.turn += turn
+        return agent
+
+
+@pytest.fixture
+def an_input():
+    return main.default_input()
+
+
+def host(an_input, **kwargs):
+    return AgentHost(ScriptedSpec(**kwargs), an_input, 1, deadline=DEADLINE)
+
+
+def test_hosted_agent_answers(an_input):
+    agent = host(an_input)
+    try:
+        assert agent.ids == ['scripted']
+        assert agent.act(an_input) == ('turn', 0)
+        assert agent.act(an_input) == ('turn', 1)
+        assert agent.timeouts == agent.errors == agent.restarts == 0
+    finally:
+        agent.close()
+
+
+def test_agent_past_its_deadline_falls_back_and_restarts(an_input):
+    agent = host(an_input, sleep_on=(2,))
+    try:
+        assert agent.act(an_input) == ('turn', 0)
+        start = time.monotonic()
+        assert agent.act(an_input) == default_action(an_input, 1)
+        assert time.monotonic() - start < 5 * DEADLINE
+        assert (agent.timeouts, agent.restarts, agent.histogram.fallbacks) == (1, 1, 1)
+        # the new process answers in time, and counts on from the turns played before the restart
+        assert agent.act(an_input) == ('turn', 2)
+        assert agent.timeouts == 1
+    finally:
+        agent.close()
+
+
+def test_agent_that_raises_falls_back_without_a_restart(an_input):
+    agent = host(an_input, raise_on=(1,))
+    try:
+        assert agent.act(an_input) == default_action(an_input, 1)
+        assert (agent.errors, agent.timeouts, agent.restarts) == (1, 0, 0)
+        assert agent.act(an_input) == ('turn', 1)
+    finally:
+        agent.close()
+
+
+def test_spec_builds_an_agent_that_counts_on_from_the_turn():
+    an_input = main.default_input()
+    spec = AgentSpec('ex3_213125164_325407054', 'UCTAgent')
+    assert spec.build(an_input, 1).turn == -1
+    assert spec.build(an_input, 1, turn=7).turn == 6
@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+import main
+import sample_agent
+from agent_server import AgentServer, connection_pool, remote_module
+from events import NullSink
+
+AUTHKEY = b'test-key'
+
+
+@pytest.fixture
+def server():
+    with AgentServer('127.0.0.1:0', authkey=AUTHKEY).start() as server:
+        yield server
+    connection_pool(server.address, AUTHKEY).close()
+
+
+def test_remote_game_reuses_connections(server):
+    random.seed(0)
+    an_input = main.default_input()
+    an_input["turns to go"] = 10
+    module = remote_module(server.address, 'ex3_213125164_325407054', authkey=AUTHKEY, action_time=0.05)
+    score = main.Game(an_input, NullSink()).play_game(module, sample_agent)
+    # an illegal move or a missed deadline would cost the penalty
+    assert score[0] > -main.PENALTY
+    # the session of each episode ended, and left its connection to the next one
+    assert len(connection_pool(server.address, AUTHKEY).idle) == 1
+
+
+def test_server_needs_authkey_beyond_loopback():
+    with pytest.raises(ValueError):
+        AgentServer('0.0.0.0:0', authkey=None)
+
+
+def test_loopback_server_makes_up_authkey():
+    server = AgentServer('127.0.0.1:0', authkey=None)
+    try:
+        assert len(server.authkey) >= 16
+    finally:
+        server.stop()
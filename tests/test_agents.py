@@ -0,0 +1,77 @@
+import gc
+import random
+from copy import deepcopy
+
+import pytest
+
+import ex3_213125164_325407054 as ex3
+import main
+import sample_agent
+from simulator import Simulator
+from state_view import StateView
+
+ROUNDS = 12
+# search time per move, short enough for the tests and long enough for trees of a few levels
+SEARCH_SECONDS = 0.05
+
+AGENTS = {
+    'agent': lambda state, player: ex3.Agent(state, player),
+    'agent_open_loop_no_prior': lambda state, player: ex3.Agent(state, player, prior=None, open_loop=True),
+    'agent_closed_loop': lambda state, player: ex3.Agent(state, player, open_loop=False),
+    'uct_agent': lambda state, player: ex3.UCTAgent(state, player),
+}
+
+
+def is_legal(simulator, action, player):
+    try:
+        return simulator.check_if_action_legal(action, player)
+    except KeyError:
+        # a move that names a treasure missing from the state
+        return False
+
+
+@pytest.mark.parametrize('seat', (1, 2))
+@pytest.mark.parametrize('name', AGENTS)
+@pytest.mark.parametrize('seed', (0, 1))
+def test_agent_moves_are_legal(name, seat, seed):
+    random.seed(seed)
+    an_input = main.default_input()
+    an_input["turns to go"] = 2 * ROUNDS
+    simulator = Simulator(an_input)
+    agent = AGENTS[name](deepcopy(an_input), seat)
+    agent.time_manager.hard_limit = SEARCH_SECONDS
+    agents = {seat: agent, 3 - seat: sample_agent.Agent(deepcopy(an_input), 3 - seat)}
+    for turn in range(ROUNDS):
+        for player in (1, 2):
+            action = agents[player].act(StateView(simulator.state))
+            assert is_legal(simulator, action, player), f'turn {turn}: illegal action {action} of player {player}'
+            simulator.act(action, player)
+        simulator.check_collision_with_marines()
+        simulator.move_marines()
+
+
+@pytest.mark.parametrize('name', AGENTS)
+def test_search_restores_the_garbage_collector(name):
+    an_input = main.default_input()
+    agent = AGENTS[name](deepcopy(an_input), 1)
+    agent.time_manager.hard_limit = SEARCH_SECONDS
+    assert gc.get_freeze_count() == 0
+    agent.act(StateView(Simulator(an_input).state))
+    assert gc.isenabled()
+    assert gc.get_freeze_count() == 0
+
+
+def test_batch_rollouts_follow_the_seed_of_random():
+    pytest.importorskip('numpy')
+    an_input = main.default_input()
+    simulator = Simulator(an_input)
+    results = []
+    for _ in range(2):
+        random.seed(3)
+        batch = ex3.BatchRolloutEngine(ex3.RolloutEngine(an_input))
+        results.append(batch.play(simulator, 50, 1, 64).tolist())
+    assert results[0] == results[1]
+    batch.seed(3)
+    seeded = batch.play(simulator, 50, 1, 64).tolist()
+    batch.seed(3)
+    assert batch.play(simulator, 50, 1, 64).tolist() == seeded
@@ -0,0 +1,16 @@
+import random
+
+import benchmark
+
+
+def test_measure_seeds_every_repeat_and_the_generator_of_the_operation():
+    draws, seeds = [], []
+
+    def operation(index):
+        draws.append(random.random())
+        return 1
+    operation.seed = seeds.append
+    benchmark.measure(operation, repeats=3, min_seconds=0, seed=5)
+    assert seeds == [5, 6, 7]
+    random.seed(6)
+    assert draws[1] == random.random()
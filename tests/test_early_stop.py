@@ -0,0 +1,66 @@
+import pytest
+
+import ex3_213125164_325407054 as ex3
+
+# more than the search can still run, so that only confidence bounds can settle the decision
+MANY_ITERATIONS = 10 ** 6
+
+
+def child(visits, mean, deviation=1.0, node_class=ex3.UCTNode):
+    node = node_class()
+    node.visits = visits
+    node.wins = mean * visits
+    node.sum_squares = visits * (deviation ** 2 + mean ** 2)
+    return node
+
+
+@pytest.mark.parametrize('remaining, settled', ((59, True), (60, False)))
+def test_a_visit_lead_beyond_the_remaining_iterations_settles(remaining, settled):
+    children = [child(100, 0.5), child(40, 0.4)]
+    assert ex3.decision_settled(children, remaining, 0) is settled
+
+
+@pytest.mark.parametrize('node_class', (ex3.UCTNode, ex3.Node))
+@pytest.mark.parametrize('other_mean, settled', ((0.05, True), (0.15, False)))
+def test_separated_confidence_bounds_settle(node_class, other_mean, settled):
+    # the bounds are 3 deviations over the square root of the visits: 1.0 - 0.3 for the best child, and the other
+    # mean + 0.6, so the means must be more than 0.9 apart
+    children = [child(100, 1.0, node_class=node_class), child(25, other_mean, node_class=node_class)]
+    assert ex3.decision_settled(children, MANY_ITERATIONS, 1.0) is settled
+
+
+def test_the_widest_deviation_bounds_every_child():
+    children = [child(100, 1.0), child(25, 0.05, deviation=1.2)]
+    assert not ex3.decision_settled(children, MANY_ITERATIONS, 1.0)
+
+
+def test_a_best_mean_that_is_not_the_most_visited_does_not_settle():
+    children = [child(100, 0.5), child(10, 0.6)]
+    assert not ex3.decision_settled(children, 0, 1.0)
+
+
+@pytest.mark.parametrize('visits, settled', ((ex3.MIN_ITERATIONS_TO_SETTLE - 1, False),
+                                             (ex3.MIN_ITERATIONS_TO_SETTLE, True)))
+def test_too_few_iterations_do_not_settle(visits, settled):
+    children = [child(visits - 1, 1.0), child(1, 0.0)]
+    assert ex3.decision_settled(children, 0, 1.0) is settled
+
+
+def test_a_single_move_is_settled_once_visited():
+    assert ex3.decision_settled([child(1, 0.0)], MANY_ITERATIONS, 1.0)
+    assert not ex3.decision_settled([child(0, 0.0)], MANY_ITERATIONS, 1.0)
+    assert not ex3.decision_settled([child(1, 0.0), child(0, 0.0)], MANY_ITERATIONS, 1.0)
+
+
+def test_without_a_range_of_results_only_the_visit_lead_settles():
+    children = [child(100, 1.0), child(25, -5.0)]
+    assert not ex3.decision_settled(children, MANY_ITERATIONS, 0)
+    assert ex3.decision_settled(children, 74, 0)
+
+
+def test_node_deviation_follows_its_results():
+    node = ex3.Node()
+    for result in (1, 3, 1, 3):
+        node.update(result)
+    assert node.deviation(7) == pytest.approx(1.0)
+    assert ex3.Node().deviation(7) == 7
@@ -0,0 +1,190 @@
+import itertools
+import math
+import time
+from copy import deepcopy
+
+import pytest
+
+import ex3_213125164_325407054 as ex3
+import main
+from simulator import Simulator, TREASURE_ARRIVAL_PROBABILITY, TREASURE_NAMES
+
+NAMES = {1: 'player 1', 2: 'player 2'}
+
+
+def duel_input():
+    """
+    The sample map with a ship per player, both next to the base on the path of a marine. The ship of player 1
+    carries a treasure, which the other may plunder
+    """
+    an_input = main.default_input()
+    del an_input["pirate_ships"]["pirate_ship_2"], an_input["pirate_ships"]["pirate_ship_4"]
+    an_input["pirate_ships"]["pirate_ship_1"].update(location=(2, 1), capacity=1)
+    an_input["pirate_ships"]["pirate_ship_3"]["location"] = (2, 1)
+    an_input["treasures"] = {"treasure_1": {"location": "pirate_ship_1", "reward": 7}}
+    an_input["marine_ships"]["marine_1"]["index"] = 1
+    return an_input
+
+
+def crowded_input():
+    """
+    The duel with treasures on every island, so many that none spawns even after one is deposited or lost
+    """
+    an_input = duel_input()
+    islands = [(i, j) for i, row in enumerate(an_input["map"]) for j, cell in enumerate(row) if cell == 'I']
+    for name, island, reward in zip(TREASURE_NAMES[1:], islands + islands[:1], itertools.cycle(range(1, 10))):
+        an_input["treasures"][name] = {"location": island, "reward": reward}
+    assert len(an_input["treasures"]) > ex3.MAX_TREASURES + 1
+    return an_input
+
+
+def lone_island_input():
+    """
+    The duel on a map with a single island, so that spawns have few outcomes
+    """
+    an_input = duel_input()
+    an_input["map"] = [['I' if (i, j) == (0, 2) else 'B' if cell == 'B' else 'S' for j, cell in enumerate(row)]
+                       for i, row in enumerate(an_input["map"])]
+    return an_input
+
+
+def legal_actions(simulator, state, player):
+    """
+    Every joint action of the player the simulator accepts, built without the action generation of the agent
+    """
+    simulator.state = state
+    per_ship = []
+    for name, ship in state["pirate_ships"].items():
+        if ship["player"] != player:
+            continue
+        options = [('wait', name)] + [('sail', name, cell) for cell in simulator.neighbors(ship["location"])]
+        options += [('collect', name, treasure) for treasure, value in state["treasures"].items()
+                    if type(value["location"]) != str]
+        options += [('deposit', name, treasure) for treasure, value in state["treasures"].items()
+                    if value["location"] == name]
+        options += [('plunder', name, enemy) for enemy, other in state["pirate_ships"].items()
+                    if other["player"] != player]
+        per_ship.append(options)
+    return [action for action in itertools.product(*per_ship) if simulator.check_if_action_legal(action, player)]
+
+
+class Expectimax:
+    """
+    Plain expectimax over the same game as the solver, with no pruning, memoization or skipped spawns
+    """
+
+    def __init__(self, an_input, player_number):
+        self.simulator = Simulator(an_input)
+        self.me, self.him = NAMES[player_number], NAMES[3 - player_number]
+        self.player_number = player_number
+        self.islands = [(i, j) for i, row in enumerate(an_input["map"]) for j, cell in enumerate(row) if cell == 'I']
+
+    def difference(self):
+        return self.simulator.score[self.me] - self.simulator.score[self.him]
+
+    def act(self, state, player, rounds):
+        """
+        :return: the value of every legal action of the player
+        """
+        values = {}
+        for action in legal_actions(self.simulator, state, player):
+            simulator = self.simulator
+            simulator.state = deepcopy(state)
+            simulator.score = {'player 1': 0, 'player 2': 0}
+            simulator.apply_action(action, player)
+            reward = self.difference()
+            values[action] = reward + self.spawn(simulator.state, player, rounds)
+        return values
+
+    def value(self, state, player, rounds):
+        values = self.act(state, player, rounds).values()
+        return max(values) if player == self.player_number else min(values)
+
+    def spawn(self, state, player, rounds):
+        if len(state["treasures"]) > ex3.MAX_TREASURES:
+            return self.end_action(state, player, rounds)
+        name = next(name for name in TREASURE_NAMES if name not in state["treasures"])
+        value = (1 - TREASURE_ARRIVAL_PROBABILITY) * self.end_action(state, player, rounds)
+        outcomes = [(island, reward) for island in self.islands for reward in range(1, 10)]
+        for island, reward in outcomes:
+            outcome = deepcopy(state)
+            outcome["treasures"][name] = {"location": island, "reward": reward}
+            value += TREASURE_ARRIVAL_PROBABILITY / len(outcomes) * self.end_action(outcome, player, rounds)
+        return value
+
+    def end_action(self, state, player, rounds):
+        if player == 1:
+            return self.value(state, 2, rounds)
+        simulator = self.simulator
+        simulator.state = state = deepcopy(state)
+        simulator.score = {'player 1': 0, 'player 2': 0}
+        simulator.check_collision_with_marines()
+        penalty = self.difference()
+        if rounds == 1:
+            return penalty
+        marines = list(state["marine_ships"].values())
+        choices = [range(max(0, marine["index"] - 1), min(len(marine["path"]), marine["index"] + 2))
+                   for marine in marines]
+        outcomes = list(itertools.product(*choices))
+        value = penalty
+        for indices in outcomes:
+            outcome = deepcopy(state)
+            for marine, index in zip(outcome["marine_ships"].values(), indices):
+                marine["index"] = index
+            value += self.value(outcome, 1, rounds - 1) / len(outcomes)
+        return value
+
+
+@pytest.mark.parametrize('player', (1, 2))
+@pytest.mark.parametrize('make_input, rounds', ((crowded_input, 1), (crowded_input, 2), (lone_island_input, 1)))
+def test_solver_matches_expectimax(make_input, rounds, player):
+    an_input = make_input()
+    solver = ex3.EndgameSolver(an_input, player)
+    move = solver.solve(an_input, rounds, time.monotonic() + 60)
+    values = Expectimax(an_input, player).act(an_input, player, rounds)
+    assert solver.value == pytest.approx(max(values.values()))
+    assert values[move] == pytest.approx(solver.value)
+
+
+@pytest.mark.parametrize('player', (1, 2))
+def test_table_hits_return_the_value_of_a_fresh_solve(player):
+    an_input = crowded_input()
+    solver = ex3.EndgameSolver(an_input, player)
+    solver.deadline = math.inf
+    state = ex3.copy_state(an_input)
+    fresh, _ = solver.act(state, player, 2, -math.inf, math.inf)
+    # an exact entry at the root
+    assert solver.act(state, player, 2, -math.inf, math.inf)[0] == pytest.approx(fresh)
+    solver.table = {}
+    # the searches share the table, so every one of them meets the bounds the others left
+    for alpha, beta in ((fresh + 1, fresh + 2), (fresh - 2, fresh - 1), (fresh + 0.5, fresh + 3),
+                        (fresh - 3, fresh - 0.5), (fresh - 0.5, fresh + 0.5)):
+        bound, _ = solver.act(state, player, 2, alpha, beta)
+        # a value outside the window bounds the true value from the side of the window it fell out of
+        if bound <= alpha:
+            assert fresh <= bound + 1e-9
+        elif bound >= beta:
+            assert fresh >= bound - 1e-9
+        else:
+            assert bound == pytest.approx(fresh)
+    assert solver.act(state, player, 2, -math.inf, math.inf)[0] == pytest.approx(fresh)
+
+
+def test_canonical_key_ignores_treasure_names_and_the_order_of_a_fleet():
+    state = main.default_input()
+    state["pirate_ships"]["pirate_ship_2"]["location"] = (1, 0)
+    renamed = deepcopy(state)
+    renamed["treasures"] = {"treasure_9": renamed["treasures"].pop("treasure_1")}
+    swapped = deepcopy(state)
+    ships = swapped["pirate_ships"]
+    ships["pirate_ship_1"]["location"], ships["pirate_ship_2"]["location"] = (1, 0), (2, 0)
+    assert ex3.canonical_state_key(renamed) == ex3.canonical_state_key(state)
+    assert ex3.canonical_state_key(swapped) == ex3.canonical_state_key(state)
+    # a ship of the other player in the same cell is not interchangeable with it
+    other = deepcopy(state)
+    other["pirate_ships"]["pirate_ship_3"]["location"] = (1, 0)
+    other["pirate_ships"]["pirate_ship_2"]["location"] = (2, 0)
+    assert ex3.canonical_state_key(other) != ex3.canonical_state_key(state)
+    moved = deepcopy(state)
+    moved["marine_ships"]["marine_1"]["index"] = 1
+    assert ex3.canonical_state_key(moved) != ex3.canonical_state_key(state)
@@ -0,0 +1,76 @@
+import random
+import time
+import types
+
+import pytest
+
+import main
+import sample_agent
+from agent_host import AgentSpec
+from events import MemorySink
+from tournament import TournamentGame
+
+ROUNDS = 5
+
+
+class FailingAgent:
+    """
+    Fails on its second turn, by raising or by taking too long
+    """
+
+    def __init__(self, initial_state, player_number, failure):
+        self.ids = ['failing']
+        self.failure = failure
+        self.turn = 0
+        self.action = tuple(('wait', name) for name, ship in initial_state['pirate_ships'].items()
+                            if ship['player'] == player_number)
+
+    def act(self, state):
+        self.turn += 1
+        if self.turn == 2:
+            if self.failure == 'raise':
+                raise ValueError('failed on purpose')
+            time.sleep(2 * main.ACTION_TIMEOUT)
+        return self.action
+
+
+@pytest.fixture
+def an_input():
+    an_input = main.default_input()
+    an_input["turns to go"] = 2 * ROUNDS
+    return an_input
+
+
+def play_failing_game(an_input, failure, sink):
+    """
+    Plays a game of a failing agent against the sample agent, with a short action timeout
+    """
+    module = types.SimpleNamespace(Agent=lambda state, player: FailingAgent(state, player, failure))
+    timeout = main.ACTION_TIMEOUT
+    main.ACTION_TIMEOUT = 0.05
+    try:
+        main.Game(an_input, sink).play_game(module, sample_agent, UCT_flag=False)
+    finally:
+        main.ACTION_TIMEOUT = timeout
+
+
+@pytest.mark.parametrize('failure, kind', (('raise', 'error'), ('sleep', 'timeout')))
+def test_errors_tell_timeouts_from_agents_that_raise(an_input, failure, kind):
+    sink = MemorySink()
+    play_failing_game(an_input, failure, sink)
+    errors = [event for event in sink.events if event['type'] == 'error']
+    assert [(error['kind'], error['turn']) for error in errors] == [(kind, 2), (kind, 2)]
+
+
+def test_tournament_games_emit_the_events_of_main_games(an_input):
+    sinks = []
+    for play in (lambda sink: main.Game(an_input, sink).play_game(sample_agent, sample_agent, UCT_flag=False),
+                 lambda sink: TournamentGame(an_input, AgentSpec('sample_agent'), AgentSpec('sample_agent'),
+                                             sink=sink).play_game()):
+        random.seed(0)
+        sinks.append(MemorySink())
+        play(sinks[-1])
+    main_events, tournament_events = ([event['type'] for event in sink.events] for sink in sinks)
+    assert main_events == tournament_events
+    assert tournament_events[-1] == 'game_end'
+    assert sinks[1].events[-1]['score'] == sinks[0].events[-1]['score']
@@ -0,0 +1,99 @@
+import itertools
+from copy import deepcopy
+
+import pytest
+
+import ex3_213125164_325407054 as ex3
+import main
+from simulator import Simulator
+
+
+def fleet_actions(state, player):
+    """
+    :return: the actions of every ship of the player, and the joint actions the agents choose from
+    """
+    neighbors = ex3.get_neighbor_dict(state["map"])
+    ships = ex3.get_my_ships(state, player)
+    per_ship = [ex3.get_actions_for_ship(ship, state, [], None, player, neighbors) for ship in ships]
+    return per_ship, ex3.joint_actions(per_ship, state)
+
+
+def outcome(state, action, player):
+    simulator = Simulator(state)
+    simulator.apply_action(action, player)
+    return ex3.canonical_state_key(simulator.state), simulator.score[f'player {player}']
+
+
+def check_actions(state, player):
+    """
+    Checks that every joint action is legal, and that they lead to every outcome of the legal joint actions
+    :return: the number of joint actions, and of legal combinations of the actions of the ships
+    """
+    per_ship, actions = fleet_actions(state, player)
+    simulator = Simulator(state)
+    assert all(simulator.check_if_action_legal(action, player) for action in actions if ex3.collects_distinct(action))
+    legal = [action for action in itertools.product(*per_ship) if simulator.check_if_action_legal(action, player)]
+    assert {outcome(state, action, player) for action in actions if ex3.collects_distinct(action)} == \
+           {outcome(state, action, player) for action in legal}
+    return len(actions), len(list(itertools.product(*per_ship)))
+
+
+@pytest.fixture
+def state():
+    state = main.default_input()
+    # both ships of player 1 next to the treasure, with a spare treasure of the same reward
+    for name in ("pirate_ship_1", "pirate_ship_2"):
+        state["pirate_ships"][name]["location"] = (0, 1)
+    state["treasures"]["treasure_2"] = {"location": (1, 2), "reward": 4}
+    return state
+
+
+def test_swapped_actions_of_interchangeable_ships_collapse(state):
+    per_ship, actions = fleet_actions(state, 1)
+    count = len(per_ship[0])
+    assert per_ship[0] == {(kind, 'pirate_ship_1', *rest) for kind, _, *rest in per_ship[1]}
+    # one joint action per multiset of the actions of the ships
+    assert len(actions) == count * (count + 1) // 2
+    names = [tuple(sorted(atomic_action[0:1] + atomic_action[2:] for atomic_action in action)) for action in actions]
+    assert len(set(names)) == len(names)
+    check_actions(state, 1)
+
+
+def test_ships_with_different_cargo_do_not_collapse(state):
+    state["treasures"]["treasure_3"] = {"location": "pirate_ship_1", "reward": 3}
+    state["treasures"]["treasure_4"] = {"location": "pirate_ship_2", "reward": 2}
+    for name in ("pirate_ship_1", "pirate_ship_2"):
+        state["pirate_ships"][name]["capacity"] = 1
+    assert check_actions(state, 1)[0] == len(list(itertools.product(*fleet_actions(state, 1)[0])))
+
+
+def test_ships_with_different_capacity_do_not_collapse(state):
+    state["pirate_ships"]["pirate_ship_2"]["capacity"] = 1
+    joint, combinations = check_actions(state, 1)
+    assert joint == combinations
+
+
+def test_deposits_of_equal_rewards_collapse():
+    state = main.default_input()
+    state["pirate_ships"]["pirate_ship_2"]["location"] = (1, 0)
+    state["treasures"] = {"treasure_1": {"location": "pirate_ship_1", "reward": 4},
+                          "treasure_2": {"location": "pirate_ship_1", "reward": 4},
+                          "treasure_3": {"location": "pirate_ship_2", "reward": 4}}
+    per_ship, actions = fleet_actions(state, 1)
+    deposits = {atomic_action for action in actions for atomic_action in action if atomic_action[0] == 'deposit'}
+    assert len(deposits) == 1
+    joint, combinations = check_actions(state, 1)
+    assert joint == combinations - len(per_ship[1])
+    different = deepcopy(state)
+    different["treasures"]["treasure_2"]["reward"] = 5
+    joint, combinations = check_actions(different, 1)
+    assert joint == combinations
+
+
+@pytest.mark.parametrize('player', (1, 2))
+def test_joint_actions_next_to_an_enemy_are_legal_and_complete(player):
+    state = main.default_input()
+    for name, ship in state["pirate_ships"].items():
+        ship["location"] = (0, 1) if ship["player"] == player else (0, 3)
+    state["pirate_ships"]["pirate_ship_3" if player == 1 else "pirate_ship_1"]["location"] = (0, 1)
+    check_actions(state, player)
@@ -0,0 +1,107 @@
+import random
+from collections import Counter
+
+import pytest
+
+import ex3_213125164_325407054 as ex3
+import main
+from simulator import Simulator
+
+SAMPLES = 50000
+
+
+def kind_probabilities(table):
+    """
+    :return: the probability of every kind of action the alias table samples
+    """
+    kinds, probability, alias = table
+    result = dict.fromkeys(kinds, 0.0)
+    for slot, kind in enumerate(kinds):
+        result[kind] += probability[slot] / len(kinds)
+        result[kinds[alias[slot]]] += (1 - probability[slot]) / len(kinds)
+    return result
+
+
+@pytest.mark.parametrize('situation, weights', (
+    (ex3.CAN_COLLECT | ex3.CAN_DEPOSIT | ex3.CAN_PLUNDER, (10, 1, 5, 3, 1)),
+    (ex3.CAN_PLUNDER, (1, 7, 2)),
+    (0, (4, 4)),
+))
+def test_alias_tables_sample_the_counted_frequencies(situation, weights):
+    model = ex3.OpponentModel(main.default_input(), 1)
+    kinds = model.kinds(situation)
+    for kind, weight in zip(kinds, weights):
+        model.counts[situation * ex3.ACTION_KINDS + kind] = weight
+    expected = {kind: weight / sum(weights) for kind, weight in zip(kinds, weights)}
+    assert kind_probabilities(model.table(situation)) == pytest.approx(expected)
+    random.seed(0)
+    counts = Counter(model.sample(situation) for _ in range(SAMPLES))
+    assert set(counts) <= set(kinds)
+    for kind in kinds:
+        assert counts[kind] / SAMPLES == pytest.approx(expected[kind], abs=0.01)
+
+
+def observed_counts(an_input, player_number, our_move, his_move):
+    """
+    Plays a round from the input, our move first and then the move of the opponent, and lets a model of the player
+    observe it. The tables of the situations it counted in must be rebuilt
+    :return: the counts the model added, by (situation, kind)
+    """
+    random.seed(0)
+    model = ex3.OpponentModel(an_input, player_number)
+    simulator = Simulator(an_input)
+    model.remember(ex3.copy_state(simulator.state), our_move)
+    for player, move in ((player_number, our_move), (ex3.his_number(player_number), his_move)):
+        simulator.act(move, player)
+        if player == ex3.PLAYER_2:
+            simulator.check_collision_with_marines()
+            simulator.move_marines()
+    for situation in range(ex3.SITUATIONS):
+        model.sample(situation)
+    before = list(model.counts)
+    model.observe(simulator.state)
+    added = {divmod(index, ex3.ACTION_KINDS): after - count
+             for index, (count, after) in enumerate(zip(before, model.counts)) if after != count}
+    assert all(model.tables[situation] is None for situation, _ in added)
+    return added
+
+
+@pytest.fixture
+def an_input():
+    an_input = main.default_input()
+    # away from the ships, so that no ship is caught
+    an_input["marine_ships"]["marine_1"]["index"] = 5
+    return an_input
+
+
+def test_observe_credits_a_collect_and_a_sail(an_input):
+    an_input["pirate_ships"]["pirate_ship_3"]["location"] = (0, 1)
+    waits = (('wait', 'pirate_ship_1'), ('wait', 'pirate_ship_2'))
+    his_move = (('collect', 'pirate_ship_3', 'treasure_1'), ('sail', 'pirate_ship_4', (1, 0)))
+    assert observed_counts(an_input, 1, waits, his_move) == {(ex3.CAN_COLLECT, ex3.COLLECT): 1,
+                                                              (ex3.CAN_PLUNDER, ex3.SAIL): 1}
+
+
+def test_observe_credits_a_plunder_of_our_ship(an_input):
+    an_input["pirate_ships"]["pirate_ship_1"]["location"] = (1, 0)
+    an_input["pirate_ships"]["pirate_ship_3"]["location"] = (1, 0)
+    an_input["treasures"]["treasure_1"]["location"] = "pirate_ship_1"
+    waits = (('wait', 'pirate_ship_1'), ('wait', 'pirate_ship_2'))
+    his_move = (('plunder', 'pirate_ship_3', 'pirate_ship_1'), ('wait', 'pirate_ship_4'))
+    assert observed_counts(an_input, 1, waits, his_move) == {(ex3.CAN_PLUNDER, ex3.PLUNDER): 1,
+                                                              (ex3.CAN_PLUNDER, ex3.WAIT): 1}
+
+
+def test_observe_credits_a_deposit_of_the_first_player(an_input):
+    an_input["treasures"]["treasure_1"]["location"] = "pirate_ship_1"
+    our_move = (('sail', 'pirate_ship_3', (1, 0)), ('sail', 'pirate_ship_4', (3, 0)))
+    his_move = (('deposit', 'pirate_ship_1', 'treasure_1'), ('wait', 'pirate_ship_2'))
+    assert observed_counts(an_input, 2, our_move, his_move) == {(ex3.CAN_DEPOSIT, ex3.DEPOSIT): 1,
+                                                                 (0, ex3.WAIT): 1}
+
+
+def test_nothing_is_observed_before_our_first_move():
+    model = ex3.OpponentModel(main.default_input(), 2)
+    before = list(model.counts)
+    model.observe(main.default_input())
+    assert list(model.counts) == before and model.observations == 0
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+import main
+import sample_agent
+from replay import COMPLETED, ERROR, ILLEGAL, TIMEOUT, ReplayReader, ReplaySink, replay, verify
+from simulator import Simulator
+from test_events import play_failing_game
+
+ROUNDS = 15
+
+
+def play_recorded_game(path):
+    random.seed(0)
+    an_input = main.default_input()
+    an_input["turns to go"] = 2 * ROUNDS
+    sink = ReplaySink(path)
+    game = main.Game(an_input, sink)
+    game.play_game(module=sample_agent, rival=sample_agent, UCT_flag=False)
+    sink.close()
+    return game
+
+
+def test_replay_round_trip(tmp_path):
+    path = tmp_path / 'game.replay'
+    play_recorded_game(path)
+    with ReplayReader(path) as reader:
+        assert len(reader.episodes) == 2
+        for episode in reader.episodes:
+            assert len(episode) == ROUNDS
+            assert episode.reason == COMPLETED
+            simulator = Simulator(episode.initial_state)
+            states = list(replay(episode, simulator))
+            assert len(states) == ROUNDS
+            assert simulator.score == episode.score
+    assert verify(path) == 2 * ROUNDS
+
+
+def test_appended_games_are_read_back(tmp_path):
+    path = tmp_path / 'games.replay'
+    play_recorded_game(path)
+    play_recorded_game(path)
+    with ReplayReader(path) as reader:
+        assert len(reader.episodes) == 4
+    assert verify(path) == 4 * ROUNDS
+
+
+def test_error_before_any_turn_records_no_score_of_the_previous_episode(tmp_path):
+    path = tmp_path / 'error.replay'
+    state = main.default_input()
+    sink = ReplaySink(path)
+    sink.emit({'type': 'episode_start', 'state': state})
+    sink.emit({'type': 'turn', 'actions': [(('wait', 'pirate_ship_1'), ('wait', 'pirate_ship_2')),
+                                           (('wait', 'pirate_ship_3'), ('wait', 'pirate_ship_4'))],
+               'spawns': [{}, {}], 'marines': [1, 1], 'score': {'player 1': 5, 'player 2': 3}})
+    sink.emit({'type': 'episode_end', 'score': {'player 1': 5, 'player 2': 3}})
+    sink.emit({'type': 'episode_start', 'state': state})
+    sink.emit({'type': 'error', 'kind': 'illegal'})
+    sink.close()
+    with ReplayReader(path) as reader:
+        first, second = reader.episodes
+        assert first.score == {'player 1': 5, 'player 2': 3}
+        assert len(second) == 0
+        assert second.reason == ILLEGAL
+        assert second.score == {'player 1': 0, 'player 2': 0}
+
+
+@pytest.mark.parametrize('failure, reason', (('raise', ERROR), ('sleep', TIMEOUT)))
+def test_episodes_record_why_they_ended(tmp_path, failure, reason):
+    path = tmp_path / 'failed.replay'
+    an_input = main.default_input()
+    an_input["turns to go"] = 2 * ROUNDS
+    with ReplaySink(path) as sink:
+        play_failing_game(an_input, failure, sink)
+    with ReplayReader(path) as reader:
+        assert [episode.reason for episode in reader.episodes] == [reason, reason]
+        assert all(len(episode) == 1 for episode in reader.episodes)
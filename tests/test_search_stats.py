@@ -0,0 +1,79 @@
+import json
+import random
+from copy import deepcopy
+
+import pytest
+
+import ex3_213125164_325407054 as ex3
+import main
+from simulator import Simulator
+from state_view import StateView
+
+SEARCH_SECONDS = 0.1
+
+AGENTS = {
+    'agent': lambda state, player, **kwargs: ex3.Agent(state, player, **kwargs),
+    'agent_halving': lambda state, player, **kwargs: ex3.Agent(state, player, root_policy='halving', **kwargs),
+    'uct_agent': lambda state, player, **kwargs: ex3.UCTAgent(state, player, **kwargs),
+    'uct_agent_halving': lambda state, player, **kwargs: ex3.UCTAgent(state, player, root_policy='halving',
+                                                                      **kwargs),
+    'uct_agent_macro': lambda state, player, **kwargs: ex3.UCTAgent(state, player, macro=True, **kwargs),
+}
+
+
+def searched(name, seed, stats):
+    random.seed(seed)
+    an_input = main.default_input()
+    agent = AGENTS[name](deepcopy(an_input), 1, stats=stats)
+    agent.time_manager.hard_limit = SEARCH_SECONDS
+    agent.act(StateView(Simulator(an_input).state))
+    return agent
+
+
+def height(node):
+    return 1 + max(height(child) for child in node.children) if node.children else 0
+
+
+@pytest.mark.parametrize('name', AGENTS)
+@pytest.mark.parametrize('seed', (0, 1))
+def test_statistics_match_the_tree(name, seed):
+    agent = searched(name, seed, True)
+    stats, root = agent.search_stats, agent.root
+    assert stats.iterations > 1
+    assert stats.rollouts == stats.iterations
+    # every iteration backs its playout up through the root
+    assert root.visits == stats.iterations
+    # without a root policy that expands the root first, the first iteration plays out from the root itself
+    expanded_first = name.endswith('halving')
+    assert sum(visits for _, visits, _ in stats.root) == stats.iterations - (0 if expanded_first else 1)
+    assert sorted(stats.root, key=lambda entry: -entry[1]) == stats.root
+    children = {child.move: child for child in root.children}
+    assert len(children) == len(stats.root)
+    for move, visits, mean in stats.root:
+        assert visits == children[move].visits
+        assert mean == (children[move].wins / visits if visits else 0.0)
+    # the deepest leaf reached was expanded, unless it ended the game
+    assert stats.max_depth <= height(root) <= stats.max_depth + 1
+    assert 0 < stats.mean_depth() <= stats.max_depth
+    assert stats.nodes == agent.pool.in_use
+    assert 0 < stats.search_seconds() <= stats.seconds
+    json.dumps(stats.as_dict())
+
+
+@pytest.mark.parametrize('name', AGENTS)
+def test_statistics_are_off_by_default(name):
+    assert searched(name, 0, False).search_stats is None
+    assert ex3.SEARCH_STATS is False
+
+
+def test_batch_statistics_count_every_rollout():
+    pytest.importorskip('numpy')
+    random.seed(0)
+    an_input = main.default_input()
+    agent = ex3.UCTAgent(deepcopy(an_input), 1, batch=True, stats=True)
+    agent.time_manager.hard_limit = SEARCH_SECONDS
+    agent.act(StateView(Simulator(an_input).state))
+    stats = agent.search_stats
+    assert stats.rollouts > stats.iterations > 1
+    assert agent.root.visits == stats.rollouts
+    assert sum(visits for _, visits, _ in stats.root) < stats.rollouts
@@ -0,0 +1,98 @@
+import pickle
+import random
+from copy import deepcopy
+
+import pytest
+
+import main
+import sample_agent
+from simulator import Simulator
+from state_delta import StateEncoder, StateMirror, large_input
+
+ROUNDS = 40
+
+
+def played_states(an_input, rounds=ROUNDS, seed=0):
+    """
+    :return: the states of a game of the sample agents, after the action of every player
+    """
+    random.seed(seed)
+    simulator = Simulator(an_input)
+    agents = {1: sample_agent.Agent(an_input, 1), 2: sample_agent.Agent(an_input, 2)}
+    states = []
+    for _ in range(rounds):
+        for player, agent in agents.items():
+            simulator.act(agent.act(deepcopy(simulator.state)), player)
+            states.append(deepcopy(simulator.state))
+        simulator.check_collision_with_marines()
+        simulator.move_marines()
+        states.append(deepcopy(simulator.state))
+    return states
+
+
+@pytest.mark.parametrize('size', (7, 20))
+@pytest.mark.parametrize('seed', (0, 1))
+def test_mirror_follows_the_encoded_states(size, seed):
+    an_input = large_input(size, main.default_input())
+    encoder = StateEncoder(an_input)
+    mirror = StateMirror(an_input)
+    for state in played_states(an_input, seed=seed):
+        diff = pickle.loads(pickle.dumps(encoder.encode(state), pickle.HIGHEST_PROTOCOL))
+        mirrored = mirror.apply(diff)
+        assert mirrored == state
+        assert list(mirrored["treasures"]) == list(state["treasures"])
+
+
+def test_unchanged_state_encodes_an_empty_diff():
+    an_input = main.default_input()
+    encoder = StateEncoder(an_input)
+    assert encoder.encode(deepcopy(an_input)) == ((), (), (), None)
+
+
+def test_reset_starts_a_new_mirror_from_the_middle_of_a_game():
+    an_input = main.default_input()
+    states = played_states(an_input)
+    middle = len(states) // 2
+    encoder = StateEncoder(an_input)
+    encoder.reset(states[middle])
+    mirror = StateMirror(states[middle])
+    for state in states[middle + 1:]:
+        mirrored = mirror.apply(encoder.encode(state))
+        assert mirrored == state
+        assert list(mirrored["treasures"]) == list(state["treasures"])
+
+
+def two_treasure_input():
+    an_input = main.default_input()
+    treasure = next(iter(an_input["treasures"].values()))
+    an_input["treasures"]["treasure_2"] = {"location": treasure["location"], "reward": treasure["reward"] + 1}
+    return an_input
+
+
+def test_a_treasure_spawned_again_under_its_name_moves_to_the_end():
+    an_input = two_treasure_input()
+    encoder = StateEncoder(an_input)
+    mirror = StateMirror(an_input)
+    state = deepcopy(an_input)
+    first, *others = state["treasures"]
+    # collected, deposited and spawned again at the same place, between two turns of the agent
+    state["treasures"][first] = state["treasures"].pop(first)
+    diff = encoder.encode(state)
+    assert first in diff[2]
+    mirrored = mirror.apply(diff)
+    assert list(mirrored["treasures"]) == others + [first]
+    assert mirrored == state
+
+
+def test_a_treasure_changed_in_place_keeps_its_place():
+    an_input = two_treasure_input()
+    encoder = StateEncoder(an_input)
+    mirror = StateMirror(an_input)
+    state = deepcopy(an_input)
+    first, *others = state["treasures"]
+    state["treasures"][first]["location"] = next(iter(state["pirate_ships"]))
+    diff = encoder.encode(state)
+    assert diff[1:3] == (((first, state["treasures"][first]["location"], state["treasures"][first]["reward"]),), ())
+    mirrored = mirror.apply(diff)
+    assert list(mirrored["treasures"]) == [first] + others
+    assert mirrored == state
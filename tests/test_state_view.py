@@ -0,0 +1,100 @@
+import pickle
+from copy import deepcopy
+
+import pytest
+
+import main
+from simulator import Simulator
+from state_view import SequenceView, StateView
+
+
+@pytest.fixture
+def state():
+    return main.default_input()
+
+
+def plain(value):
+    """
+    :return: whether the value is made of plain dictionaries, lists and tuples only, with no view inside
+    """
+    if type(value) is dict:
+        return all(plain(key) and plain(item) for key, item in value.items())
+    if type(value) in (list, tuple):
+        return all(plain(item) for item in value)
+    return not isinstance(value, (StateView, SequenceView))
+
+
+def test_views_read_the_live_state(state):
+    state_view = StateView(state)
+    assert state_view == state
+    assert state_view["pirate_ships"]["pirate_ship_1"]["location"] == (2, 0)
+    assert isinstance(state_view["map"], SequenceView) and isinstance(state_view["map"][0], SequenceView)
+    state["pirate_ships"]["pirate_ship_1"]["location"] = (1, 0)
+    assert state_view["pirate_ships"]["pirate_ship_1"]["location"] == (1, 0)
+    assert state_view.get("missing") is None and "base" in state_view
+
+
+@pytest.mark.parametrize('path', ((), ("pirate_ships",), ("pirate_ships", "pirate_ship_1"), ("treasures",),
+                                  ("marine_ships", "marine_1")))
+def test_views_of_dictionaries_can_not_be_changed(state, path):
+    target = StateView(state)
+    for key in path:
+        target = target[key]
+    key = next(iter(target))
+    with pytest.raises(TypeError):
+        target[key] = None
+    with pytest.raises(TypeError):
+        del target[key]
+    with pytest.raises(TypeError):
+        target["new"] = None
+    assert not hasattr(target, 'update') and not hasattr(target, 'pop')
+    with pytest.raises(AttributeError):
+        target._other = None
+
+
+@pytest.mark.parametrize('path', (("map",), ("map", 0), ("marine_ships", "marine_1", "path")))
+def test_views_of_lists_can_not_be_changed(state, path):
+    target = StateView(state)
+    for key in path:
+        target = target[key]
+    assert isinstance(target, SequenceView)
+    with pytest.raises(TypeError):
+        target[0] = None
+    with pytest.raises(TypeError):
+        del target[0]
+    assert not hasattr(target, 'append') and not hasattr(target, 'sort')
+
+
+def test_clone_is_an_independent_plain_copy(state):
+    original = deepcopy(state)
+    copy = StateView(state).clone()
+    assert type(copy) is dict and copy == state
+    assert all(type(copy[key]) is dict for key in ("pirate_ships", "treasures", "marine_ships"))
+    assert type(copy["pirate_ships"]["pirate_ship_1"]) is dict
+    copy["pirate_ships"]["pirate_ship_1"]["location"] = (1, 0)
+    del copy["treasures"]["treasure_1"]
+    copy["marine_ships"]["marine_1"]["index"] = 3
+    assert state == original
+    state["pirate_ships"]["pirate_ship_2"]["capacity"] = 0
+    assert copy["pirate_ships"]["pirate_ship_2"]["capacity"] == 2
+    # the lists are shared, read only
+    with pytest.raises(TypeError):
+        copy["map"][0][0] = 'I'
+
+
+def test_deepcopy_and_pickle_make_plain_containers(state):
+    for copy in (deepcopy(StateView(state)), pickle.loads(pickle.dumps(StateView(state)))):
+        assert type(copy) is dict and copy == state and plain(copy)
+        copy["pirate_ships"]["pirate_ship_1"]["location"] = (1, 0)
+        copy["map"][0][0] = 'I'
+        assert state == main.default_input()
+    path = StateView(state)["marine_ships"]["marine_1"]["path"]
+    for copy in (deepcopy(path), pickle.loads(pickle.dumps(path))):
+        assert type(copy) is list and copy == state["marine_ships"]["marine_1"]["path"]
+
+
+def test_simulator_copies_a_view(state):
+    simulator = Simulator(StateView(state))
+    assert plain(simulator.state)
+    simulator.act((('sail', 'pirate_ship_1', (1, 0)), ('wait', 'pirate_ship_2')), 1)
+    assert state == main.default_input()
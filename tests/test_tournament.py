@@ -0,0 +1,60 @@
+import math
+import time
+
+import pytest
+
+import main
+from agent_host import AgentSpec, LatencyHistogram
+from tournament import CONFIDENCE_Z, GameResult, Tournament, TournamentStats
+
+DIFFERENCES = (2, 4, 4, 4, 5, 5, 7, 9)
+
+
+def stats_of(differences, latencies=None):
+    stats = TournamentStats()
+    for index, difference in enumerate(differences):
+        stats.add(GameResult(index, index, 10 + difference, 10, 1.0, latencies))
+    return stats
+
+
+def test_statistics_of_known_differences():
+    stats = stats_of(DIFFERENCES)
+    assert stats.games() == 8
+    assert stats.mean() == 5
+    # the sample deviation: squared deviations sum to 32, over 7 degrees of freedom
+    assert stats.stdev() == pytest.approx(math.sqrt(32 / 7))
+    margin = CONFIDENCE_Z * math.sqrt(32 / 7) / math.sqrt(8)
+    assert stats.confidence_interval() == pytest.approx((5 - margin, 5 + margin))
+    stats.start = time.time() - 1800
+    assert stats.games_per_hour() == pytest.approx(16, rel=0.01)
+    report = stats.report()
+    assert 'games 8' in report and 'agent 15.00' in report and 'rival 10.00' in report
+    assert f'[{5 - margin:.2f}, {5 + margin:.2f}]' in report
+
+
+def test_statistics_of_too_few_games():
+    assert (TournamentStats().mean(), TournamentStats().stdev()) == (0.0, 0.0)
+    stats = stats_of((3,))
+    assert (stats.mean(), stats.stdev(), stats.confidence_interval()) == (3, 0.0, (3, 3))
+
+
+def test_latencies_are_merged_per_agent():
+    histogram = LatencyHistogram()
+    histogram.add(0.003)
+    histogram.add(1.5, fallback=True)
+    stats = stats_of((1, 2, 3), {'Agent': histogram})
+    merged = stats.latencies['Agent']
+    assert (merged.count(), merged.fallbacks, merged.maximum) == (6, 3, 1.5)
+
+
+def test_results_do_not_depend_on_the_number_of_workers():
+    an_input = main.default_input()
+    an_input["turns to go"] = 20
+    results = []
+    for workers in (1, 2):
+        tournament = Tournament(AgentSpec('sample_agent'), AgentSpec('sample_agent'), 3, an_input, workers=workers,
+                                seed=5)
+        results.append(sorted((result.index, result.seed, result.agent_score, result.rival_score)
+                              for result in tournament.run()))
+        assert tournament.stats.games() == 3
+    assert results[0] == results[1]
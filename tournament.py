@@ -0,0 +1,236 @@
+"""Plays many games between two agents on a process pool and reports the statistics of the score differences"""
+
+import argparse
+import math
+import os
+import random
+import statistics
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+from agent_host import AgentHost, AgentSpec, LatencyHistogram
+from agent_server import RemoteAgent
+from events import NullSink
+from replay import ReplaySink
+from simulator import Simulator
+
+# the z value of the reported confidence intervals, 95% two sided
+CONFIDENCE_Z = 1.96
+SEED_STRIDE = 1000003
+
+GameResult = namedtuple('GameResult', ['index', 'seed', 'agent_score', 'rival_score', 'seconds', 'latencies'],
+                        defaults=(None,))
+
+
+class TournamentGame(main.Game):
+    """
+    A game between two given agents, played as in main.Game: a first episode, and with side swapping a second
+    episode in which the rival moves first. Scores are [agent, rival]
+    :param action_time: if given, the time limit the agents plan their moves for, for agents with a time manager
+    :param isolate: whether every agent runs in a process of its own, see agent_host.AgentHost. The latencies of the
+    hosted agents are then kept, per id
+    :param server: if given, the address of the agent_server.AgentServer the agents run on, instead of locally
+    """
+
+    def __init__(self, an_input, agent: AgentSpec, rival: AgentSpec, action_time=None, sink=None, isolate=False,
+                 server=None):
+        super().__init__(an_input, sink)
+        self.agent = agent
+        self.rival = rival
+        self.action_time = action_time
+        self.server = server
+        self.isolate = isolate or server is not None
+        self.latencies = {'Agent': LatencyHistogram(), 'Rival': LatencyHistogram()}
+
+    def initiate(self, spec: AgentSpec, player_number):
+        if self.server is not None:
+            return RemoteAgent(self.server, spec, self.initial_state, player_number, action_time=self.action_time)
+        if self.isolate:
+            return AgentHost(spec, self.initial_state, player_number, action_time=self.action_time)
+        start = time.time()
+        agent = spec.build(self.initial_state, player_number)
+        if time.time() - start > main.CONSTRUCTOR_TIMEOUT:
+            raise ValueError('agent timed out on constructor!')
+        if self.action_time is not None and hasattr(agent, 'time_manager'):
+            agent.time_manager.hard_limit = self.action_time
+        return agent
+
+    def play_game(self, swap=True):
+        self.agents = [self.initiate(self.agent, 1), self.initiate(self.rival, 2)]
+        self.ids = ['Agent', 'Rival']
+        self.play_hosted_episode()
+        if swap:
+            self.simulator = Simulator(self.initial_state)
+            self.agents = [self.initiate(self.rival, 1), self.initiate(self.agent, 2)]
+            self.ids = ['Rival', 'Agent']
+            self.play_hosted_episode(swapped=True)
+        if self.sink.enabled:
+            self.sink.emit({'type': 'game_end', 'score': list(self.score)})
+        return self.score
+
+    def play_hosted_episode(self, swapped=False):
+        try:
+            self.play_episode(swapped)
+        finally:
+            if self.isolate:
+                for ids, host in zip(self.ids, self.agents):
+                    self.latencies[ids].merge(host.histogram)
+            self.close_agents()
+
+
+def seed_all(seed):
+    random.seed(seed)
+    try:
+        import numpy
+        numpy.random.seed(seed % 2 ** 32)
+    except ImportError:
+        pass
+
+
+def play(index, seed, an_input, agent, rival, swap, action_time, replays=None, isolate=False, server=None):
+    """
+    Plays one game in a worker, headless
+    :param replays: if given, the directory the replay of the game is written to
+    :param isolate: whether every agent runs in a process of its own
+    :param server: if given, the address of the agent server the agents run on
+    :return: the result of the game
+    """
+    seed_all(seed)
+    start = time.time()
+    with (ReplaySink(os.path.join(replays, f'game_{index}.rpl')) if replays else NullSink()) as sink:
+        game = TournamentGame(an_input, agent, rival, action_time, sink, isolate, server)
+        score = game.play_game(swap)
+    return GameResult(index, seed, score[0], score[1], time.time() - start,
+                      game.latencies if game.isolate else None)
+
+
+class TournamentStats:
+    """
+    Running statistics of the score differences of the agent over the rival
+    """
+
+    def __init__(self):
+        self.differences = []
+        self.agent_scores = []
+        self.rival_scores = []
+        self.latencies = {}
+        self.start = time.time()
+
+    def add(self, result: GameResult):
+        self.differences.append(result.agent_score - result.rival_score)
+        self.agent_scores.append(result.agent_score)
+        self.rival_scores.append(result.rival_score)
+        for ids, histogram in (result.latencies or {}).items():
+            self.latencies.setdefault(ids, LatencyHistogram()).merge(histogram)
+
+    def games(self):
+        return len(self.differences)
+
+    def mean(self):
+        return statistics.fmean(self.differences) if self.differences else 0.0
+
+    def stdev(self):
+        return statistics.stdev(self.differences) if len(self.differences) > 1 else 0.0
+
+    def confidence_interval(self):
+        """
+        :return: the bounds of the confidence interval of the mean difference, by the normal approximation
+        """
+        margin = CONFIDENCE_Z * self.stdev() / math.sqrt(max(1, self.games()))
+        return self.mean() - margin, self.mean() + margin
+
+    def games_per_hour(self):
+        return 3600 * self.games() / max(time.time() - self.start, 1e-9)
+
+    def report(self):
+        low, high = self.confidence_interval()
+        return (f'games {self.games()}  agent {statistics.fmean(self.agent_scores):.2f}  '
+                f'rival {statistics.fmean(self.rival_scores):.2f}  difference {self.mean():.2f} '
+                f'± {self.stdev():.2f}  95% CI [{low:.2f}, {high:.2f}]  {self.games_per_hour():.1f} games/hour')
+
+    def latency_report(self):
+        return '\n'.join(f'{ids} latency: {histogram.report()}' for ids, histogram in self.latencies.items())
+
+
+class Tournament:
+    """
+    Farms the games out to a process pool and streams their results back as they finish.
+    Game i is played with seed seed + i * SEED_STRIDE in whichever worker runs it, so results do not depend on the
+    number of workers
+    """
+
+    def __init__(self, agent: AgentSpec, rival: AgentSpec, games, an_input=None, workers=None, seed=0, swap=True,
+                 action_time=None, replays=None, isolate=False, server=None):
+        self.agent = agent
+        self.rival = rival
+        self.games = games
+        self.an_input = an_input if an_input is not None else main.default_input()
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self.swap = swap
+        self.action_time = action_time
+        self.replays = replays
+        self.isolate = isolate
+        self.server = server
+        self.stats = TournamentStats()
+
+    def run(self):
+        """
+        :return: a generator of the results of the games, in order of completion
+        """
+        self.stats = TournamentStats()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(play, index, self.seed + index * SEED_STRIDE, self.an_input, self.agent,
+                                   self.rival, self.swap, self.action_time, self.replays, self.isolate,
+                                   self.server)
+                       for index in range(self.games)]
+            for future in as_completed(futures):
+                result = future.result()
+                self.stats.add(result)
+                yield result
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--agent', default='ex3_213125164_325407054:UCTAgent', help="'module:Class' of the agent")
+    parser.add_argument('--agent-kwargs', help='JSON object of keyword arguments of the agent')
+    parser.add_argument('--rival', default='sample_agent:Agent', help="'module:Class' of the rival")
+    parser.add_argument('--rival-kwargs', help='JSON object of keyword arguments of the rival')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None, help='processes, the number of cores by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--turns', type=int, default=None, help="the 'turns to go' of every episode")
+    parser.add_argument('--action-time', type=float, default=None, help='the time limit the agents plan for')
+    parser.add_argument('--no-swap', action='store_true', help='play only the episode in which the agent moves first')
+    parser.add_argument('--replays', help='a directory to write the replay of every game to')
+    parser.add_argument('--isolate', action='store_true',
+                        help='run every agent in a process of its own, preempted at the deadline')
+    parser.add_argument('--server', help="run the agents on the agent server at 'host:port' or a Unix socket path, "
+                        "whose key is read from AGENT_SERVER_AUTHKEY")
+    return parser.parse_args()
+
+
+def run_tournament():
+    arguments = parse_arguments()
+    an_input = main.default_input()
+    if arguments.turns is not None:
+        an_input["turns to go"] = arguments.turns
+    tournament = Tournament(AgentSpec.parse(arguments.agent, arguments.agent_kwargs),
+                            AgentSpec.parse(arguments.rival, arguments.rival_kwargs), arguments.games, an_input,
+                            arguments.workers, arguments.seed, not arguments.no_swap, arguments.action_time,
+                            arguments.replays, arguments.isolate, arguments.server)
+    if arguments.replays:
+        os.makedirs(arguments.replays, exist_ok=True)
+    print(f'{tournament.agent} vs {tournament.rival}: {tournament.games} games on {tournament.workers} workers')
+    for result in tournament.run():
+        print(f'game {result.index} (seed {result.seed}): {result.agent_score} - {result.rival_score} '
+              f'in {result.seconds:.1f}s | {tournament.stats.report()}', flush=True)
+    print(tournament.stats.report())
+    if arguments.isolate or arguments.server:
+        print(tournament.stats.latency_report())
+
+
+if __name__ == '__main__':
+    run_tournament()